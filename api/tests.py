@@ -1,3 +1,87 @@
-from django.test import TestCase
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+
+from user_manager.models import UserAcl
+from wgwadmlibrary.wireguard_status import get_status_snapshot, get_status_snapshot_cache_key, status_history, \
+    store_status_snapshot
+from wireguard.models import Peer, PeerAllowedIP, PeerGroup, PeerStatus, WireGuardInstance
+
+# Queries of a removal: the lookups, the cascade collection and the deletes of the peer group, user and
+# instance, and the ACL index invalidation. Django deletes the collected peers and their allowed IPs
+# 100 rows per query, nothing else depends on the number of peers.
+REMOVE_INSTANCE_QUERIES = {100: 37, 200: 39}
+
+
+class RemoveInstanceTest(TestCase):
+    """Removing an instance is set based, the number of queries does not grow with its peers."""
+
+    def create_instance(self, name, peer_count):
+        # bulk_create sends no post_save signal, nothing touches the running system
+        wireguard_instance = WireGuardInstance.objects.bulk_create([
+            WireGuardInstance(
+                name=name, instance_id=200, listen_port=52020, address='10.200.0.1', netmask=16,
+                private_key='test', public_key='test', hostname='test',
+            )
+        ])[0]
+        peers = Peer.objects.bulk_create([
+            Peer(name=f'peer{index}', public_key=f'peer{index}', wireguard_instance=wireguard_instance)
+            for index in range(peer_count)
+        ])
+        PeerAllowedIP.objects.bulk_create([
+            PeerAllowedIP(peer=peer, priority=0, allowed_ip=f'10.200.{index // 250}.{index % 250 + 2}')
+            for index, peer in enumerate(peers)
+        ])
+        PeerStatus.objects.bulk_create([PeerStatus(peer=peer) for peer in peers])
+        peer_group = PeerGroup.objects.create(name=f'{name}_group')
+        PeerGroup.peer.through.objects.bulk_create([
+            PeerGroup.peer.through(peergroup=peer_group, peer=peer) for peer in peers
+        ])
+        PeerGroup.server_instance.through.objects.bulk_create([
+            PeerGroup.server_instance.through(peergroup=peer_group, wireguardinstance=wireguard_instance)
+        ])
+        user_acl = UserAcl.objects.create(user=User.objects.create_user(name, email=name), user_level=20)
+        user_acl.peer_groups.add(peer_group)
+
+    def remove_instance(self, name):
+        with mock.patch('wireguard_tools.views.cleanup_removed_instance', return_value=(True, 'removed')):
+            return self.client.post(
+                '/remove_instances/', json.dumps({'instance': name}), content_type='application/json',
+                HTTP_X_API_KEY=settings.N8N_API_KEY,
+            )
+
+    def test_query_count_does_not_grow_with_peers(self):
+        for peer_count in (100, 200):
+            name = f'customer{peer_count}@example.com'
+            self.create_instance(name, peer_count)
+            with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(REMOVE_INSTANCE_QUERIES[peer_count]):
+                response = self.remove_instance(name)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['deleted_data']['peers_deleted'], peer_count)
+            self.assertFalse(Peer.objects.exists())
+            self.assertFalse(PeerAllowedIP.objects.exists())
+            self.assertFalse(UserAcl.objects.exists())
+
+
+class StatusSnapshotTest(SimpleTestCase):
+    """'?since=<etag>' snapshots are shared by the workers through the cache."""
+
+    snapshot = {'wg0': {'peer': {
+        'allowed-ips': ['10.0.0.2/32'], 'latest-handshakes': '0', 'transfer': {'tx': 0, 'rx': 0}, 'endpoints': '(none)',
+    }}}
+
+    def test_snapshot_of_another_worker_is_found(self):
+        etag = store_status_snapshot(self.snapshot)
+        self.addCleanup(cache.delete, get_status_snapshot_cache_key(etag))
+        # Another worker has no local history
+        status_history.clear()
+        self.assertEqual(get_status_snapshot(etag), self.snapshot)
+        self.assertIn(etag, status_history)
+
+    def test_unknown_etag(self):
+        self.assertIsNone(get_status_snapshot('0' * 20))
+        self.assertIsNone(get_status_snapshot('../etag'))
@@ -1,7 +1,9 @@
 import base64
 import datetime
+import json
 import os
 import subprocess
+import time
 import uuid
 
 import pytz
@@ -11,8 +13,9 @@ from django.contrib import auth
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied
+from django.db import connection, transaction
 from django.http import HttpResponseForbidden
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.utils import timezone
 from django.views.decorators.http import require_http_methods
@@ -20,10 +23,12 @@ from django.views.decorators.csrf import csrf_exempt
 
 from user_manager.models import AuthenticationToken, UserAcl
 from vpn_invite.models import InviteSettings, PeerInvite
-from wgwadmlibrary.tools import create_peer_invite, get_peer_invite_data, send_email, user_allowed_peers, \
-    user_has_access_to_peer
+from wgwadmlibrary.instance_allocation import claim_pooled_instance, create_wireguard_instance, netmask_for_user_count
+from wgwadmlibrary.tools import create_peer_invite, get_peer_invite_data, get_request_user_acl, send_email, \
+    suppress_model_signals, user_allowed_instances, user_allowed_peer_public_keys, user_has_access_to_peer
+from wgwadmlibrary.wireguard_status import filter_status, get_status_delta, get_status_snapshot, \
+    read_wireguard_status, status_reader, store_status_snapshot
 from wireguard.models import Peer, PeerStatus, WebadminSettings, WireGuardInstance, PeerGroup, PeerAllowedIP
-from django.db import models
 
 
 def get_vpn_hostname(request=None):
@@ -156,7 +161,7 @@ def routerfleet_get_user_token(request):
 @login_required
 def peer_info(request):
     peer = get_object_or_404(Peer, uuid=request.GET.get('uuid'))
-    user_acl = get_object_or_404(UserAcl, user=request.user)
+    user_acl = get_request_user_acl(request)
 
     if not user_has_access_to_peer(user_acl, peer):
         raise PermissionDenied
@@ -245,13 +250,20 @@ def api_instance_info(request):
 
 @require_http_methods(["GET"])
 def wireguard_status(request):
+    """
+    Status of every interface and peer.
+
+    '?instance=<uuid>' limits the response to that instance. With '?since=<etag>' the response is
+    {'etag', 'full', 'status', 'removed'}: 'status' holds only the peers that changed since the snapshot
+    identified by the etag, and 'removed' lists the peers that are gone. When the etag is unknown the
+    full status is returned with 'full' set. The etag of every response is in the ETag header.
+    """
     user_acl = None
     enhanced_filter = False
-    filter_peer_list = []
 
     if request.user.is_authenticated:
-        user_acl = get_object_or_404(UserAcl, user=request.user)
-        if user_acl.enable_enhanced_filter and user_acl.peer_groups.count() > 0:
+        user_acl = get_request_user_acl(request)
+        if user_acl.enable_enhanced_filter and user_acl.peer_groups.exists():
             enhanced_filter = True
     elif request.GET.get('key'):
         api_key = get_api_key('api')
@@ -268,62 +280,111 @@ def wireguard_status(request):
     else:
         return HttpResponseForbidden()
 
+    wireguard_instance = None
+    interfaces = None
+    if request.GET.get('instance'):
+        wireguard_instance = get_object_or_404(WireGuardInstance, uuid=request.GET.get('instance'))
+        if user_acl and wireguard_instance not in user_allowed_instances(user_acl):
+            return HttpResponseForbidden()
+        interfaces = {f"wg{wireguard_instance.instance_id}"}
+
+    filter_public_keys = None
     if enhanced_filter:
-        for server_instance in WireGuardInstance.objects.all():
-            for peer in user_allowed_peers(user_acl, server_instance):
-                if peer.public_key not in filter_peer_list:
-                    filter_peer_list.append(peer.public_key)
-
-    commands = {
-        'latest-handshakes': "wg show all latest-handshakes | expand | tr -s ' '",
-        'allowed-ips': "wg show all allowed-ips | expand | tr -s ' '",
-        'transfer': "wg show all transfer | expand | tr -s ' '",
-        'endpoints': "wg show all endpoints | expand | tr -s ' '",
-    }
+        filter_public_keys = user_allowed_peer_public_keys(user_acl, wireguard_instance)
 
-    output = {}
+    try:
+        snapshot = read_wireguard_status()
+    except (OSError, RuntimeError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
 
-    for key, command in commands.items():
-        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        stdout, stderr = process.communicate()
+    etag = store_status_snapshot(snapshot)
+    output = filter_status(snapshot, interfaces, filter_public_keys)
 
-        if process.returncode != 0:
-            return JsonResponse({'error': stderr}, status=400)
+    if 'since' in request.GET:
+        previous_snapshot = get_status_snapshot(request.GET.get('since'))
+        if previous_snapshot is None:
+            response = JsonResponse({'etag': etag, 'full': True, 'status': output, 'removed': {}})
+        else:
+            previous_output = filter_status(previous_snapshot, interfaces, filter_public_keys)
+            status = {}
+            removed = {}
+            for interface, peers in output.items():
+                changed, removed_peers = get_status_delta(previous_output.get(interface, {}), peers)
+                if changed:
+                    status[interface] = changed
+                if removed_peers:
+                    removed[interface] = removed_peers
+            for interface, peers in previous_output.items():
+                if interface not in output and peers:
+                    removed[interface] = list(peers)
+            response = JsonResponse({'etag': etag, 'full': False, 'status': status, 'removed': removed})
+    else:
+        response = JsonResponse(output)
+    response['ETag'] = f'"{etag}"'
+    return response
+
+
+STATUS_STREAM_MAX_SECONDS = 300
+STATUS_STREAM_KEEPALIVE_SECONDS = 15
 
-        current_interface = None
-        for line in stdout.strip().split('\n'):
-            parts = line.split()
-            if len(parts) >= 3:
-                interface, peer, value = parts[0], parts[1], " ".join(parts[2:])
-                current_interface = interface
-            elif len(parts) == 2 and current_interface:
-                peer, value = parts
-            else:
-                continue
 
-            if interface not in output:
-                output[interface] = {}
-            if enhanced_filter and peer not in filter_peer_list:
+def stream_status_events(interface, interval, allowed_public_keys):
+    """
+    Server-sent events with the peers of 'interface' that changed since the previous event.
+
+    The first event carries every peer. An event is sent every 'interval' seconds even when nothing
+    changed, the peer list uses it to refresh throughput. The stream ends after STATUS_STREAM_MAX_SECONDS
+    to release the worker thread, and the browser reconnects on its own.
+    """
+    token = status_reader.subscribe(interval)
+    sent_status = {}
+    version = 0
+    started = time.monotonic()
+    next_event = started
+    try:
+        yield f"retry: {interval * 1000}\n\n"
+        while time.monotonic() - started < STATUS_STREAM_MAX_SECONDS:
+            delay = next_event - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            version, snapshot = status_reader.wait_for_snapshot(version, STATUS_STREAM_KEEPALIVE_SECONDS)
+            if snapshot is None:
+                yield ": keepalive\n\n"
                 continue
-            if peer not in output[interface]:
-                output[interface][peer] = {
-                    'allowed-ips': [],
-                    'latest-handshakes': '',
-                    'transfer': {'tx': 0, 'rx': 0},
-                    'endpoints': '',
-                }
 
-            if key == 'allowed-ips':
-                output[interface][peer]['allowed-ips'].append(value)
-            elif key == 'transfer':
-                rx, tx = value.split()[-2:]
-                output[interface][peer]['transfer'] = {'tx': int(tx), 'rx': int(rx)}
-            elif key == 'endpoints':
-                output[interface][peer]['endpoints'] = value
-            else:
-                output[interface][peer][key] = value
+            interface_status = filter_status(snapshot, {interface}, allowed_public_keys).get(interface, {})
+            changed, removed = get_status_delta(sent_status, interface_status)
+            sent_status = interface_status
+            next_event = time.monotonic() + interval
+            yield f"data: {json.dumps({'interface': interface, 'changed': changed, 'removed': removed})}\n\n"
+    finally:
+        status_reader.unsubscribe(token)
+
+
+@require_http_methods(["GET"])
+def wireguard_status_stream(request):
+    if not request.user.is_authenticated:
+        return HttpResponseForbidden()
+    user_acl = get_request_user_acl(request)
+    wireguard_instance = get_object_or_404(WireGuardInstance, uuid=request.GET.get('instance'))
+    if wireguard_instance not in user_allowed_instances(user_acl):
+        return HttpResponseForbidden()
+
+    allowed_public_keys = None
+    if user_acl.enable_enhanced_filter and user_acl.peer_groups.exists():
+        allowed_public_keys = user_allowed_peer_public_keys(user_acl, wireguard_instance)
+
+    interval = max(wireguard_instance.peer_list_refresh_interval, 1)
+    interface = f"wg{wireguard_instance.instance_id}"
+    # The stream does not use the database, do not hold a connection while it is open
+    connection.close()
 
-    return JsonResponse(output)
+    response = StreamingHttpResponse(
+        stream_status_events(interface, interval, allowed_public_keys), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @require_http_methods(["GET"])
@@ -400,7 +461,7 @@ def cron_check_updates(request):
 @login_required
 def api_peer_invite(request):
     PeerInvite.objects.filter(invite_expiration__lt=timezone.now()).delete()
-    user_acl = get_object_or_404(UserAcl, user=request.user)
+    user_acl = get_request_user_acl(request)
     invite_settings = InviteSettings.objects.filter(name='default_settings').first()
     peer_invite = PeerInvite.objects.none()
 
@@ -460,64 +521,45 @@ def api_peer_invite(request):
     return JsonResponse(data, status=200)
 
 
-@require_http_methods(["GET"])
-def webhook_create_instance(request):
+def create_customer_instance(customer_email, user_count=1, dns_primary=None, dns_secondary=None, request=None):
+    """
+    Create the WireGuard instance of a customer, sized for user_count peers, and return it.
+
+    The instance id, listen port and address are allocated atomically, so concurrent orders on different
+    cluster nodes never collide and slots of removed instances are reused. When the node has pooled
+    instances one of them is used, which skips the allocation and key generation.
+    """
     from wgwadmlibrary.dns_utils import get_optimal_dns_config
 
+    if dns_primary is None or dns_secondary is None:
+        optimal_dns_primary, optimal_dns_secondary = get_optimal_dns_config()
+        dns_primary = optimal_dns_primary if dns_primary is None else dns_primary
+        dns_secondary = optimal_dns_secondary if dns_secondary is None else dns_secondary
+
+    netmask = netmask_for_user_count(user_count)
+    instance_fields = {
+        'name': customer_email,  # Use provided email as display name
+        'hostname': get_vpn_hostname(request),  # Use dynamic hostname
+        'dns_primary': dns_primary,
+        'dns_secondary': dns_secondary,
+        'pending_changes': True,
+    }
+    # A slot keyed in advance by this node's refill job, if there is one
+    instance = claim_pooled_instance(get_vpn_hostname(), netmask, **instance_fields)
+    if instance is None:
+        instance = create_wireguard_instance(netmask=netmask, **instance_fields)
+    return instance
+
+
+@require_http_methods(["GET"])
+def webhook_create_instance(request):
     try:
-        # Get user count and email from request
-        user_count = int(request.GET.get('user_count', 1))
-        customer_email = request.GET.get('email', 'customer@email.com')
-
-        # Calculate netmask based on user count
-        # We need to ensure we have enough IPs for the requested users
-        # Adding some buffer for future growth
-        # Minimum of 6 usable IPs (netmask 29 = 8 IPs total, 6 usable)
-        if user_count <= 6:
-            netmask = 29  # 8 IPs total, 6 usable
-        elif user_count <= 14:
-            netmask = 28  # 16 IPs
-        elif user_count <= 30:
-            netmask = 27  # 32 IPs
-        elif user_count <= 62:
-            netmask = 26  # 64 IPs
-        elif user_count <= 126:
-            netmask = 25  # 128 IPs
-        elif user_count <= 254:
-            netmask = 24  # 256 IPs
-        else:
-            netmask = 23  # 512 IPs
-
-        # Get the next available instance ID and port
-        max_instance_id = WireGuardInstance.objects.all().aggregate(models.Max('instance_id'))['instance_id__max']
-        new_instance_id = (max_instance_id + 1) if max_instance_id is not None else 0
-
-        max_listen_port = WireGuardInstance.objects.all().aggregate(models.Max('listen_port'))['listen_port__max']
-        new_listen_port = (max_listen_port + 1) if max_listen_port is not None else 51820
-
-        # Generate WireGuard keys
-        new_private_key = subprocess.check_output('wg genkey', shell=True).decode('utf-8').strip()
-        new_public_key = subprocess.check_output(f'echo {new_private_key} | wg pubkey', shell=True).decode('utf-8').strip()
-
-        # Generate default address
-        new_address = f'10.188.{new_instance_id}.1'
-
-        # Get the correct hostname for this node
-        instance_hostname = get_vpn_hostname(request)
-
-        # Create the instance
-        instance = WireGuardInstance.objects.create(
-            name=customer_email,  # Use provided email as display name
-            instance_id=new_instance_id,
-            private_key=new_private_key,
-            public_key=new_public_key,
-            hostname=instance_hostname,  # Use dynamic hostname
-            listen_port=new_listen_port,
-            address=new_address,
-            netmask=netmask,  # Use calculated netmask
-            dns_primary=request.GET.get('dns_primary', get_optimal_dns_config()[0]),
-            dns_secondary=request.GET.get('dns_secondary', get_optimal_dns_config()[1]),
-            pending_changes=True
+        instance = create_customer_instance(
+            request.GET.get('email', 'customer@email.com'),
+            int(request.GET.get('user_count', 1)),
+            dns_primary=request.GET.get('dns_primary'),
+            dns_secondary=request.GET.get('dns_secondary'),
+            request=request
         )
 
         return JsonResponse({
@@ -588,89 +630,33 @@ def remove_instance(request):
                 'message': f'Instance with name "{instance_name}" not found'
             }, status=404)
         
-        # Get related data counts for response
-        peers_count = instance.peer_set.count()
-        peer_groups_count = PeerGroup.objects.filter(server_instance=instance).count()
-        
-        # Delete all associated peers and their data
-        for peer in instance.peer_set.all():
-            # Delete peer status
-            try:
-                peer.peerstatus.delete()
-            except:
-                pass
-            
-            # Delete peer allowed IPs
-            peer.peerallowedip_set.all().delete()
-            
-            # Remove peer from all peer groups
-            for peer_group in PeerGroup.objects.filter(peer=peer):
-                peer_group.peer.remove(peer)
-            
-            # Delete the peer
-            peer.delete()
-        
-        # Find and delete the peer group named {instance_name}_group
-        peer_group_name = f"{instance_name}_group"
-        peer_group_deleted = False
-        try:
-            peer_group = PeerGroup.objects.get(name=peer_group_name)
-            peer_group.delete()
-            peer_group_deleted = True
-        except PeerGroup.DoesNotExist:
-            # Peer group doesn't exist, that's okay
-            pass
-        
-        # Remove instance from any remaining peer groups (cleanup)
-        for peer_group in PeerGroup.objects.filter(server_instance=instance):
-            peer_group.server_instance.remove(instance)
-        
-        # Find and delete the user account (email matches instance_name)
-        user_deleted = False
-        user_acl_deleted = False
-        try:
-            user = User.objects.get(email=instance_name)
-            
-            # Delete UserAcl if it exists
-            try:
-                user_acl = UserAcl.objects.get(user=user)
-                user_acl.delete()
-                user_acl_deleted = True
-            except UserAcl.DoesNotExist:
-                # UserAcl doesn't exist, that's okay
-                pass
-            
-            # Delete the user
-            user.delete()
-            user_deleted = True
-        except User.DoesNotExist:
-            # User doesn't exist, that's okay
-            pass
-        
         # Store instance info before deletion
         instance_uuid = str(instance.uuid)
         instance_id = instance.instance_id
+        peers_count = instance.peer_set.count()
+
+        # One transaction, with the per row DNS and firewall signal handlers skipped. Deleting the instance
+        # cascades to its peers, their status and allowed IPs, and the peer group memberships.
+        with transaction.atomic(), suppress_model_signals():
+            # The peer group named {instance_name}_group
+            deleted_count, deleted_per_model = PeerGroup.objects.filter(name=f"{instance_name}_group").delete()
+            peer_group_deleted = deleted_per_model.get(PeerGroup._meta.label, 0) > 0
+
+            # The user account (email matches instance_name) and its UserAcl
+            deleted_count, deleted_per_model = User.objects.filter(email=instance_name).delete()
+            user_deleted = deleted_per_model.get(User._meta.label, 0) > 0
+            user_acl_deleted = deleted_per_model.get(UserAcl._meta.label, 0) > 0
+
+            instance.delete()
+
+        # Stop the removed interface and refresh the firewall and DNS once, other interfaces are not reloaded
+        from wireguard_tools.views import cleanup_removed_instance
+        success, message = cleanup_removed_instance(instance_id)
 
-        # Stop the WireGuard interface and remove its config file so peers are disconnected
-        from wireguard_tools.views import stop_and_remove_interface, reload_wireguard_interfaces
-        try:
-            stop_and_remove_interface(instance_id)
-        except Exception as e:
-            # Log but do not fail the whole request if cleanup fails
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"Error stopping/removing WireGuard interface wg{instance_id}: {e}")
-        
-        # Delete the instance
-        instance.delete()
-        
-        # Reload WireGuard interfaces to apply changes
-        success, message = reload_wireguard_interfaces()
-        
         if success:
             return JsonResponse({
                 'status': 'success',
-                'message': f'Instance "{instance_name}" and all associated data deleted successfully. WireGuard interfaces reloaded.',
+                'message': f'Instance "{instance_name}" and all associated data deleted successfully. {message}.',
                 'deleted_data': {
                     'instance_uuid': instance_uuid,
                     'instance_id': instance_id,
@@ -687,7 +673,7 @@ def remove_instance(request):
         else:
             return JsonResponse({
                 'status': 'partial_success',
-                'message': f'Instance "{instance_name}" deleted but WireGuard reload failed: {message}',
+                'message': f'Instance "{instance_name}" deleted but the cleanup failed: {message}',
                 'deleted_data': {
                     'instance_uuid': instance_uuid,
                     'instance_id': instance_id,
@@ -1,12 +1,14 @@
 """
 JWT service for managing token lifecycle, caching, and refresh.
 """
+import os
 import time
 import logging
+import threading
 from typing import Optional, Dict, Any
 from django.core.cache import cache
 from .oauth2_client import oauth2_client
-from .utils.jwt_keys import get_rsa_public_key
+from .utils.jwt_keys import jwt_key_manager
 
 logger = logging.getLogger(__name__)
 
@@ -14,20 +16,48 @@ logger = logging.getLogger(__name__)
 class JWTService:
     """
     Service for managing JWT tokens with caching and automatic refresh.
+
+    Tokens are refreshed in the background REFRESH_AHEAD seconds before they expire, or half way
+    through their lifetime when they live shorter than twice that, and the cached token keeps being
+    served while that refresh runs (stale-while-revalidate). A background refresh never runs sooner
+    than MIN_REFRESH_INTERVAL after the previous fetch of this process, so short lived or already
+    expired tokens cannot make it fetch in a loop. Only a missing or nearly
+    expired token makes the caller wait. A lock in the cache lets a single worker fetch at a time, the
+    others wait for its token instead of starting their own OAuth round-trip.
     """
     
     CACHE_KEY_PREFIX = 'portbro_jwt_token'
     CACHE_TIMEOUT = 300  # 5 minutes default cache timeout
+    EXPIRY_BUFFER = 30  # Never hand out a token this close to its expiry
+    REFRESH_AHEAD = 120  # Refresh in the background when the token expires within this many seconds
+    MIN_REFRESH_INTERVAL = 30  # Never refresh in the background sooner than this after a fetch
+    REFRESH_LOCK_KEY = f'{CACHE_KEY_PREFIX}_refresh_lock'
+    REFRESH_LOCK_TIMEOUT = 30
     
     def __init__(self):
         self.oauth2_client = oauth2_client
+        self.fetch_lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.refresh_thread = None
+        self.refresh_timer = None
+        self.last_fetch_at = 0
     
-    def get_cached_jwt_token(self) -> Optional[str]:
+    def get_refresh_ahead(self, lifetime: float) -> float:
         """
-        Get JWT token from cache if available and not expired.
-        
-        Returns:
-            Cached JWT token or None if not available/expired
+        Seconds before expiry at which a token living 'lifetime' seconds is refreshed.
+        """
+        return min(self.REFRESH_AHEAD, lifetime // 2)
+    
+    def needs_refresh(self, cached_data: Dict[str, Any]) -> bool:
+        """
+        Whether the cached token entered its refresh window.
+        """
+        refresh_ahead = self.get_refresh_ahead(cached_data.get('lifetime', self.CACHE_TIMEOUT))
+        return cached_data['expires_at'] - time.time() < refresh_ahead
+    
+    def get_cached_jwt_data(self) -> Optional[Dict[str, Any]]:
+        """
+        Get the cached token data ({'token', 'expires_at', 'lifetime'}) if the token is not about to expire.
         """
         try:
             cached_data = cache.get(self.CACHE_KEY_PREFIX)
@@ -35,10 +65,9 @@ class JWTService:
                 token = cached_data.get('token')
                 expires_at = cached_data.get('expires_at', 0)
                 
-                # Check if token is still valid (with 30 second buffer)
-                if token and expires_at > time.time() + 30:
-                    logger.debug("Using cached JWT token")
-                    return token
+                # Check if token is still valid (with EXPIRY_BUFFER seconds to spare)
+                if token and expires_at > time.time() + self.EXPIRY_BUFFER:
+                    return cached_data
                 else:
                     logger.debug("Cached JWT token expired")
                     cache.delete(self.CACHE_KEY_PREFIX)
@@ -48,9 +77,22 @@ class JWTService:
             logger.error(f"Error getting cached JWT token: {e}")
             return None
     
+    def get_cached_jwt_token(self) -> Optional[str]:
+        """
+        Get JWT token from cache if available and not expired.
+        
+        Returns:
+            Cached JWT token or None if not available/expired
+        """
+        cached_data = self.get_cached_jwt_data()
+        if cached_data:
+            logger.debug("Using cached JWT token")
+            return cached_data['token']
+        return None
+    
     def cache_jwt_token(self, token: str, expires_in: int = 300) -> None:
         """
-        Cache JWT token with expiration time.
+        Cache JWT token with expiration time and schedule its background refresh.
         
         Args:
             token: JWT token to cache
@@ -59,10 +101,12 @@ class JWTService:
         try:
             cache_data = {
                 'token': token,
-                'expires_at': time.time() + expires_in
+                'expires_at': time.time() + expires_in,
+                'lifetime': expires_in
             }
             cache.set(self.CACHE_KEY_PREFIX, cache_data, timeout=expires_in)
             logger.debug(f"Cached JWT token, expires in {expires_in} seconds")
+            self.schedule_refresh(expires_in - self.get_refresh_ahead(expires_in))
         except Exception as e:
             logger.error(f"Error caching JWT token: {e}")
     
@@ -73,11 +117,16 @@ class JWTService:
         Returns:
             Fresh JWT token or None if failed
         """
+        self.last_fetch_at = time.time()
         try:
             jwt_token = self.oauth2_client.get_vpn_jwt_token()
             if jwt_token:
-                # Cache the token for future use
-                self.cache_jwt_token(jwt_token)
+                # Cache the token until its own 'exp' when it has one
+                expires_in = self.CACHE_TIMEOUT
+                token_claims = self.oauth2_client.validate_jwt_token(jwt_token)
+                if token_claims and isinstance(token_claims.get('exp'), (int, float)):
+                    expires_in = max(int(token_claims['exp'] - time.time()), 1)
+                self.cache_jwt_token(jwt_token, expires_in)
                 logger.info("Successfully obtained fresh JWT token")
                 return jwt_token
             else:
@@ -87,24 +136,104 @@ class JWTService:
             logger.error(f"Error getting fresh JWT token: {e}")
             return None
     
+    def refresh_jwt_token(self, stale_token: Optional[str] = None) -> Optional[str]:
+        """
+        Fetch a new token, with at most one fetch in flight across workers.
+        
+        A worker that does not get the lock waits for the token fetched by the one that did. If that
+        takes longer than REFRESH_LOCK_TIMEOUT, it fetches one itself. Across processes this relies on
+        cache.add(), which is atomic with the database, memcached and redis backends and best effort
+        with the file based one.
+        
+        Args:
+            stale_token: Token the caller rejected, a cached copy of it is not accepted
+            
+        Returns:
+            JWT token or None if failed
+        """
+        # Threads of this process queue here, the first one fetches and the others reuse its token
+        with self.fetch_lock:
+            cached_token = self.get_cached_jwt_token()
+            if cached_token and cached_token != stale_token:
+                return cached_token
+            deadline = time.time() + self.REFRESH_LOCK_TIMEOUT
+            while time.time() < deadline:
+                if cache.add(self.REFRESH_LOCK_KEY, os.getpid(), timeout=self.REFRESH_LOCK_TIMEOUT):
+                    try:
+                        return self.get_fresh_jwt_token()
+                    finally:
+                        cache.delete(self.REFRESH_LOCK_KEY)
+                time.sleep(0.1)
+                cached_token = self.get_cached_jwt_token()
+                if cached_token and cached_token != stale_token:
+                    return cached_token
+            logger.warning("Timed out waiting for another worker to refresh the JWT token")
+            return self.get_fresh_jwt_token()
+    
+    def background_refresh(self) -> None:
+        """
+        Refresh the token unless another worker already did, or is doing it right now.
+        """
+        cached_data = self.get_cached_jwt_data()
+        if cached_data and not self.needs_refresh(cached_data):
+            # Another worker refreshed it, follow its expiry instead
+            refresh_ahead = self.get_refresh_ahead(cached_data.get('lifetime', self.CACHE_TIMEOUT))
+            self.schedule_refresh(cached_data['expires_at'] - time.time() - refresh_ahead)
+            return
+        if time.time() - self.last_fetch_at < self.MIN_REFRESH_INTERVAL:
+            # The token fetched moments ago is already due, wait before asking again
+            self.schedule_refresh(self.last_fetch_at + self.MIN_REFRESH_INTERVAL - time.time())
+            return
+        if not cache.add(self.REFRESH_LOCK_KEY, os.getpid(), timeout=self.REFRESH_LOCK_TIMEOUT):
+            return
+        try:
+            self.get_fresh_jwt_token()
+        finally:
+            cache.delete(self.REFRESH_LOCK_KEY)
+    
+    def refresh_in_background(self) -> None:
+        """
+        Start background_refresh() in a thread, unless one is already running in this process.
+        """
+        with self.refresh_lock:
+            if self.refresh_thread and self.refresh_thread.is_alive():
+                return
+            self.refresh_thread = threading.Thread(target=self.background_refresh, name='jwt-refresh', daemon=True)
+            self.refresh_thread.start()
+    
+    def schedule_refresh(self, delay: float) -> None:
+        """
+        Refresh the token in the background after 'delay' seconds, replacing any earlier schedule. The
+        refresh never runs sooner than MIN_REFRESH_INTERVAL after the last fetch.
+        """
+        delay = max(delay, self.last_fetch_at + self.MIN_REFRESH_INTERVAL - time.time(), 1)
+        with self.refresh_lock:
+            if self.refresh_timer:
+                self.refresh_timer.cancel()
+            self.refresh_timer = threading.Timer(delay, self.refresh_in_background)
+            self.refresh_timer.daemon = True
+            self.refresh_timer.start()
+    
     def get_jwt_token(self, force_refresh: bool = False) -> Optional[str]:
         """
         Get JWT token, using cache if available and not forcing refresh.
         
+        A cached token in its refresh window is still returned, and a refresh is started in the background.
+        
         Args:
             force_refresh: If True, bypass cache and get fresh token
             
         Returns:
             JWT token or None if failed
         """
-        if not force_refresh:
-            # Try to get from cache first
-            cached_token = self.get_cached_jwt_token()
-            if cached_token:
-                return cached_token
+        cached_data = self.get_cached_jwt_data()
+        if cached_data and not force_refresh:
+            if self.needs_refresh(cached_data):
+                self.refresh_in_background()
+            return cached_data['token']
         
         # Get fresh token
-        return self.get_fresh_jwt_token()
+        return self.refresh_jwt_token(stale_token=cached_data['token'] if cached_data else None)
     
     def validate_and_get_token_info(self, token: str) -> Optional[Dict[str, Any]]:
         """
@@ -119,8 +248,8 @@ class JWTService:
         try:
             import jwt as pyjwt
             
-            # Get RSA public key from environment or file
-            rsa_public_key = get_rsa_public_key()
+            # Parsed RSA public key, loaded once from environment or file
+            rsa_public_key = jwt_key_manager.get_public_key()
             
             if not rsa_public_key:
                 logger.error("RSA public key not available for JWT validation")
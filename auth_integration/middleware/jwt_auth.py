@@ -1,14 +1,60 @@
-import requests
+import hashlib
 import logging
-from django.http import JsonResponse
+import threading
+import time
+from collections import OrderedDict
+
+import jwt as pyjwt
 from django.conf import settings
-from authlib.jose import jwt, JsonWebKey
+
 from auth_integration.utils.jwt_user import ensure_user_from_jwt
-from auth_integration.utils.jwt_keys import get_rsa_public_key
+from auth_integration.utils.jwt_keys import jwt_key_manager
 
 logger = logging.getLogger(__name__)
 
 
+class VerifiedTokenCache:
+    """
+    Bounded LRU of tokens that passed verification, so repeated Bearer requests skip the RSA check.
+
+    Entries are keyed by the SHA-256 of the token and expire with its 'exp' claim. Tokens without an
+    'exp' claim are never cached.
+    """
+
+    MAX_SIZE = 1024
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = OrderedDict()
+
+    def get(self, token):
+        token_hash = hashlib.sha256(token.encode()).hexdigest()
+        with self.lock:
+            cached = self.tokens.get(token_hash)
+            if cached is None:
+                return None
+            claims, expires_at = cached
+            if expires_at <= time.time():
+                del self.tokens[token_hash]
+                return None
+            self.tokens.move_to_end(token_hash)
+            return claims
+
+    def set(self, token, claims):
+        expires_at = claims.get('exp')
+        if not isinstance(expires_at, (int, float)):
+            return
+        token_hash = hashlib.sha256(token.encode()).hexdigest()
+        with self.lock:
+            self.tokens[token_hash] = (claims, expires_at)
+            self.tokens.move_to_end(token_hash)
+            while len(self.tokens) > self.MAX_SIZE:
+                self.tokens.popitem(last=False)
+
+
+verified_token_cache = VerifiedTokenCache()
+
+
 class JWTAuthenticationMiddleware:
     """
     Middleware that validates incoming JWTs from portbro.com
@@ -17,7 +63,8 @@ class JWTAuthenticationMiddleware:
 
     def __init__(self, get_response):
         self.get_response = get_response
-        self.jwks = None  # cache for JWKS keys
+        # Load the JWKS in the background before the first token arrives
+        jwt_key_manager.start()
 
     def __call__(self, request):
         auth_header = request.headers.get("Authorization")
@@ -34,29 +81,35 @@ class JWTAuthenticationMiddleware:
         return self.get_response(request)
 
     def validate_jwt(self, token):
+        claims = verified_token_cache.get(token)
+        if claims is not None:
+            return claims
+        claims = self.verify_jwt(token)
+        if claims:
+            verified_token_cache.set(token, claims)
+        return claims
+
+    def verify_jwt(self, token):
         try:
             # First try to validate with the provided RSA public key
             try:
-                import jwt as pyjwt
-                
-                # Get RSA public key from environment or file
-                rsa_public_key = get_rsa_public_key()
-                
+                rsa_public_key = jwt_key_manager.get_public_key()
+
                 if not rsa_public_key:
                     logger.error("RSA public key not available for JWT validation")
                     return None
-                
+
                 claims = pyjwt.decode(
-                    token, 
-                    rsa_public_key, 
+                    token,
+                    rsa_public_key,
                     algorithms=['RS256'],
                     audience='vpn-nodes',
                     issuer='portbro.com'
                 )
-                
-                logger.info(f"JWT validation successful with RSA key for user: {claims.get('username', 'unknown')}")
+
+                logger.debug(f"JWT validation successful with RSA key for user: {claims.get('username', 'unknown')}")
                 return claims
-                
+
             except pyjwt.ExpiredSignatureError:
                 logger.warning("JWT token has expired")
                 return None
@@ -72,34 +125,34 @@ class JWTAuthenticationMiddleware:
             except Exception as e:
                 logger.debug(f"RSA JWT validation failed: {e} - trying JWKS validation")
                 # Fall through to JWKS validation
-            
-            # Fallback: Try to validate using JWKS from portbro.com
-            try:
-                if not self.jwks:
-                    resp = requests.get(settings.PARENT_JWKS_URL, timeout=5)
-                    resp.raise_for_status()
-                    self.jwks = JsonWebKey.import_key_set(resp.json())
 
-                claims = jwt.decode(token, self.jwks, algorithms=['RS256'])
-                claims.validate()  # checks exp, iat, nbf
+            # Fallback: validate with the JWKS from portbro.com, loaded in the background by jwt_key_manager
+            kid = pyjwt.get_unverified_header(token).get('kid')
+            jwks_keys = jwt_key_manager.get_jwks_keys(kid)
+            if not jwks_keys:
+                logger.warning(f"No JWKS key available for kid {kid}, a refresh has been scheduled")
+                return None
 
-                if claims.get("iss") != settings.PARENT_ISSUER:
-                    logger.warning(f"Invalid issuer from JWKS: {claims.get('iss')}")
-                    return None
+            for jwks_key in jwks_keys:
+                try:
+                    claims = pyjwt.decode(
+                        token,
+                        jwks_key,
+                        algorithms=['RS256'],
+                        audience=settings.PARENT_AUDIENCE,
+                        issuer=settings.PARENT_ISSUER
+                    )
+                except pyjwt.InvalidSignatureError:
+                    continue
+                logger.debug(f"JWT validation successful with JWKS for user: {claims.get('username', 'unknown')}")
+                return claims
 
-                if claims.get("aud") != settings.PARENT_AUDIENCE:
-                    logger.warning(f"Invalid audience from JWKS: {claims.get('aud')}")
-                    return None
+            logger.warning("JWT signature does not match any JWKS key")
+            return None
 
-                logger.info(f"JWT validation successful with JWKS for user: {claims.get('username', 'unknown')}")
-                return claims
-            except requests.RequestException as e:
-                logger.error(f"Failed to fetch JWKS from {settings.PARENT_JWKS_URL}: {e}")
-                return None
-            except Exception as e:
-                logger.error(f"JWKS validation failed: {e}")
-                return None
-                
+        except pyjwt.InvalidTokenError as e:
+            logger.warning(f"JWKS validation failed: {e}")
+            return None
         except Exception as e:
             logger.error(f"JWT validation failed: {e}")
             return None
@@ -1,3 +1,121 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+import jwt
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from .jwt_service import JWTService
+from .oauth2_client import PortbroOAuth2Client
+
+
+class StubOAuthHandler(BaseHTTPRequestHandler):
+    """Local stand-in for the portbro.com token and VPN auth endpoints."""
+
+    def do_POST(self):
+        server = self.server
+        if self.path.startswith('/o/token/'):
+            body = {'access_token': 'stub-oauth-token'}
+        else:
+            with server.lock:
+                server.jwt_requests += 1
+                token_number = server.jwt_requests
+            # Slow enough for concurrent callers to overlap
+            time.sleep(0.2)
+            claims = {'token': token_number, 'exp': int(time.time()) + server.token_lifetime}
+            body = {'access_token': jwt.encode(claims, 'stub', algorithm='HS256')}
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class JWTServiceRefreshTest(SimpleTestCase):
+    """Token refresh against a local stub OAuth server: one fetch per miss, no refresh loop for short tokens."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubOAuthHandler)
+        cls.server.lock = threading.Lock()
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.jwt_requests = 0
+        self.server.token_lifetime = 3600
+        oauth2_client = PortbroOAuth2Client()
+        oauth2_client.client_id = 'stub'
+        oauth2_client.client_secret = 'stub'
+        oauth2_client.token_url = f'http://127.0.0.1:{self.server.server_port}/o/token/'
+        oauth2_client.vpn_auth_url = f'http://127.0.0.1:{self.server.server_port}/vpn/auth/'
+        self.jwt_service = JWTService()
+        self.jwt_service.oauth2_client = oauth2_client
+        self.clear_cached_token()
+
+    def tearDown(self):
+        if self.jwt_service.refresh_timer:
+            self.jwt_service.refresh_timer.cancel()
+        self.clear_cached_token()
+
+    def clear_cached_token(self):
+        cache.delete_many([JWTService.CACHE_KEY_PREFIX, JWTService.REFRESH_LOCK_KEY])
+
+    def test_concurrent_misses_fetch_once(self):
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(self.jwt_service.get_jwt_token())) for index in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.server.jwt_requests, 1)
+        self.assertEqual(len(set(tokens)), 1)
+        self.assertIsNotNone(tokens[0])
+
+    def test_long_lived_token_refreshes_ahead_of_expiry(self):
+        self.jwt_service.get_jwt_token()
+        self.assertAlmostEqual(
+            self.jwt_service.refresh_timer.interval, 3600 - JWTService.REFRESH_AHEAD, delta=2
+        )
+
+    def test_short_lived_token_refreshes_half_way(self):
+        self.server.token_lifetime = 100
+        self.jwt_service.get_jwt_token()
+        self.assertAlmostEqual(self.jwt_service.refresh_timer.interval, 50, delta=2)
+
+    def test_expired_token_does_not_refresh_in_a_loop(self):
+        self.server.token_lifetime = -10
+        self.jwt_service.get_fresh_jwt_token()
+        self.assertGreaterEqual(self.jwt_service.refresh_timer.interval, JWTService.MIN_REFRESH_INTERVAL - 1)
+
+        # A background refresh right after the fetch waits instead of asking again
+        self.jwt_service.background_refresh()
+        self.assertEqual(self.server.jwt_requests, 1)
+        self.assertGreaterEqual(self.jwt_service.refresh_timer.interval, JWTService.MIN_REFRESH_INTERVAL - 2)
+
+    def test_token_in_refresh_window_is_served_while_refreshing(self):
+        self.server.token_lifetime = 100
+        token = self.jwt_service.get_jwt_token()
+        # Move the cached token into its refresh window, past the minimum interval since the fetch
+        cached_data = cache.get(JWTService.CACHE_KEY_PREFIX)
+        cached_data['expires_at'] = time.time() + 40
+        cache.set(JWTService.CACHE_KEY_PREFIX, cached_data, timeout=40)
+        self.jwt_service.last_fetch_at -= JWTService.MIN_REFRESH_INTERVAL
+
+        self.assertEqual(self.jwt_service.get_jwt_token(), token)
+        self.jwt_service.refresh_thread.join()
+        self.assertEqual(self.server.jwt_requests, 2)
+        self.assertNotEqual(self.jwt_service.get_jwt_token(), token)
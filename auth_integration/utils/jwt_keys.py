@@ -3,7 +3,14 @@ Utility functions for loading JWT RSA keys from environment variables or files.
 """
 import os
 import logging
+import threading
+import time
+
+import requests
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
 from django.conf import settings
+from jwt import PyJWKSet
+from jwt.exceptions import PyJWKError, PyJWKSetError
 
 logger = logging.getLogger(__name__)
 
@@ -91,3 +98,94 @@ def get_rsa_private_key():
     # No fallback for private keys - return None
     logger.warning("RSA private key not found. Token generation will not work.")
     return None
+
+
+class JWTKeyManager:
+    """
+    Keeps the keys used to verify portbro.com JWTs in memory.
+
+    The RSA public key is read and parsed once. The JWKS is fetched by a background thread, refreshed
+    every JWT_JWKS_TTL seconds and as soon as a token signed with an unknown kid shows up (at most once
+    every JWKS_MIN_REFRESH_INTERVAL seconds). Requests only ever read the keys already loaded, they
+    never wait on the network.
+    """
+
+    JWKS_MIN_REFRESH_INTERVAL = 60
+    JWKS_FETCH_TIMEOUT = 5
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.refresh_event = threading.Event()
+        self.thread = None
+        self.public_key = None
+        self.jwks_keys = {}
+        self.jwks_fetched_at = 0
+        self.jwks_attempted_at = 0
+
+    @property
+    def jwks_ttl(self):
+        return getattr(settings, 'JWT_JWKS_TTL', 3600)
+
+    def get_public_key(self):
+        """Parsed RSA public key from get_rsa_public_key(), or None if it cannot be loaded."""
+        if self.public_key is None:
+            with self.lock:
+                if self.public_key is None:
+                    rsa_public_key = get_rsa_public_key()
+                    try:
+                        self.public_key = load_pem_public_key(rsa_public_key.encode()) if rsa_public_key else None
+                    except ValueError as e:
+                        logger.error(f"Invalid RSA public key: {e}")
+        return self.public_key
+
+    def get_jwks_keys(self, kid=None):
+        """
+        JWKS keys to try for a token: the key matching 'kid', or every key when the token has no kid.
+        An unknown kid or an expired JWKS schedules a refresh in the background.
+        """
+        self.start()
+        if kid is None:
+            keys = list(self.jwks_keys.values())
+        else:
+            keys = [self.jwks_keys[kid]] if kid in self.jwks_keys else []
+        if (kid is not None and not keys) or time.time() - self.jwks_fetched_at > self.jwks_ttl:
+            self.refresh_event.set()
+        return keys
+
+    def start(self):
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.refresh_event.set()
+                self.thread = threading.Thread(target=self.run, name='jwks-refresh', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            self.refresh_event.wait(timeout=self.jwks_ttl)
+            delay = self.jwks_attempted_at + self.JWKS_MIN_REFRESH_INTERVAL - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.refresh_event.clear()
+            self.refresh_jwks()
+
+    def refresh_jwks(self):
+        self.jwks_attempted_at = time.time()
+        try:
+            response = requests.get(settings.PARENT_JWKS_URL, timeout=self.JWKS_FETCH_TIMEOUT)
+            response.raise_for_status()
+            jwk_set = PyJWKSet.from_dict(response.json())
+        except (requests.RequestException, AttributeError, ValueError, PyJWKError, PyJWKSetError) as e:
+            logger.warning(f"Failed to refresh JWKS from {settings.PARENT_JWKS_URL}: {e}")
+            return False
+
+        # Replace the whole dict at once, readers never see a partial key set
+        self.jwks_keys = {jwk.key_id: jwk.key for jwk in jwk_set.keys}
+        self.jwks_fetched_at = time.time()
+        logger.info(f"Loaded {len(self.jwks_keys)} JWKS keys from {settings.PARENT_JWKS_URL}")
+        return True
+
+
+# Global instance
+jwt_key_manager = JWTKeyManager()
@@ -26,7 +26,7 @@ def ensure_user_from_jwt(claims):
             # Check if the new username is already taken by another user
             if not User.objects.filter(username=username).exclude(email=email).exists():
                 user.username = username
-                user.save()
+                user.save(update_fields=['username'])
             # If username is taken, keep the existing username but log a warning
             else:
                 print(f"Warning: Username '{username}' is already taken, keeping existing username '{user.username}' for user {email}")
@@ -51,32 +51,40 @@ def ensure_user_from_jwt(claims):
     # Update email if it's different (for existing users)
     if not created and user.email != email:
         user.email = email
-        user.save()
-
-    acl, _ = UserAcl.objects.get_or_create(user=user)
+        user.save(update_fields=['email'])
 
     # Map userlevel or role → user_level
     if userlevel is not None:
         # Use direct userlevel from portbro.com
-        acl.user_level = userlevel
+        user_level = int(userlevel)
     elif role == "admin":
-        acl.user_level = 50
+        user_level = 50
     elif role == "manager":
-        acl.user_level = 40
+        user_level = 40
     else:
-        acl.user_level = 30  # peer manager by default
+        user_level = 30  # peer manager by default
+
+    acl_fields = {
+        'user_level': user_level,
+        'enable_reload': True,
+        'enable_restart': True,
+        'enable_console': True,
+    }
+    acl, acl_created = UserAcl.objects.get_or_create(user=user, defaults=acl_fields)
 
-    acl.enable_reload = True
-    acl.enable_restart = True
-    acl.enable_console = True
-    acl.save()
+    # Only write when the claims differ from what is stored, most requests change nothing
+    changed_fields = [field for field, value in acl_fields.items() if getattr(acl, field) != value]
+    if changed_fields:
+        for field in changed_fields:
+            setattr(acl, field, acl_fields[field])
+        acl.save(update_fields=changed_fields + ['updated'])
 
     # SECURITY FIX: Don't automatically assign users to instances
     # Users should only be assigned to instances they're supposed to have access to
     # This prevents users from seeing instances they shouldn't have access to
     
     # Check if user already has a peer group assigned
-    if not acl.peer_groups.exists():
+    if acl_created or not acl.peer_groups.exists():
         # Only create a peer group if user doesn't have one already
         # Use the actual username (which is now the email) for consistency
         group, created = PeerGroup.objects.get_or_create(name=f"{user.username}_group")
@@ -1,17 +1,16 @@
 import subprocess
 
 from django.contrib.auth.decorators import login_required
-from django.shortcuts import get_object_or_404, render
+from django.shortcuts import render
 from django.utils.translation import gettext_lazy as _
 
-from user_manager.models import UserAcl
-from wgwadmlibrary.tools import is_valid_ip_or_hostname
+from wgwadmlibrary.tools import get_request_user_acl, is_valid_ip_or_hostname
 from wireguard.models import WireGuardInstance
 
 
 @login_required
 def view_console(request):
-    user_acl = get_object_or_404(UserAcl, user=request.user)
+    user_acl = get_request_user_acl(request)
 
     if not user_acl.enable_console:
         return render(request, 'access_denied.html', {'page_title': 'Access Denied'})
@@ -165,6 +165,21 @@ def update_instance(interface, total_tx, total_rx):
         debug_log(f"Error updating RRD for instance {interface} (file {instance_file}): {e}")
 
 
+def merge_status_delta(status, data):
+    """
+    Applies a '?since=<etag>' response from the status API to the locally kept status.
+    Returns the updated status and the etag to send on the next query.
+    """
+    if data.get("full"):
+        status = {}
+    for interface, peers in data.get("status", {}).items():
+        status.setdefault(interface, {}).update(peers)
+    for interface, peers in data.get("removed", {}).items():
+        for peer_key in peers:
+            status.get(interface, {}).pop(peer_key, None)
+    return status, data.get("etag", "")
+
+
 def main_loop():
     """
     Main loop that:
@@ -189,6 +204,10 @@ def main_loop():
     debug_log("Waiting 30 seconds before first query...")
     time.sleep(30)
 
+    # Only peers that changed since the previous query are transferred, the full status is kept here
+    status = {}
+    etag = ""
+
     while True:
         loop_start = time.time()
         # Refresh the API key on every iteration in case the file changes
@@ -198,12 +217,13 @@ def main_loop():
             sys.exit(1)
 
         # Build the URL for the API call
-        url = f"{API_ADDRESS}/api/wireguard_status/?rrdkey={api_key}"
+        url = f"{API_ADDRESS}/api/wireguard_status/?rrdkey={api_key}&since={etag}"
         debug_log("Querying API at: " + url)
         try:
             response = requests.get(url, timeout=10)
             response.raise_for_status()
-            data = response.json()
+            status, etag = merge_status_delta(status, response.json())
+            data = status
         except Exception as e:
             debug_log("Error fetching or parsing API data: " + str(e))
             time.sleep(30)
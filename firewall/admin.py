@@ -17,7 +17,7 @@ admin.site.register(FirewallRule, FirewallRuleAdmin)
 
 
 class FirewallSettingsAdmin(admin.ModelAdmin):
-    list_display = ('wan_interface', 'default_forward_policy', 'default_output_policy', 'allow_peer_to_peer', 'allow_instance_to_instance')
+    list_display = ('wan_interface', 'default_forward_policy', 'default_output_policy', 'allow_peer_to_peer', 'allow_instance_to_instance', 'firewall_backend')
 
 admin.site.register(FirewallSettings, FirewallSettingsAdmin)
 
@@ -0,0 +1,252 @@
+import ipaddress
+import random
+import re
+import shutil
+import socket
+import subprocess
+import time
+
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+
+from firewall.models import FirewallRule, FirewallSettings
+from firewall.nftables import generate_nftables_ruleset
+from firewall.tools import export_firewall_ipsets, generate_iptables_restore_payload, get_dns_ip, get_firewall_rules, \
+    parse_iptables_command, tag_firewall_rules
+from wgwadmlibrary.instance_allocation import find_free_instance_slot
+from wireguard.models import Peer, PeerAllowedIP, WireGuardInstance
+
+NFTABLES_CHAIN_REGEX = re.compile(r'^\s+chain (\S+) \{')
+NFTABLES_IIFNAME_REGEX = re.compile(r'iifname (?:"([^"]+)"|@(\S+))')
+# Each synthetic instance gets a /22
+SYNTHETIC_INSTANCE_NETMASK = 22
+
+
+def generate_synthetic_firewall_dataset(peer_count=1000, rule_count=200, instance_count=4, seed=0):
+    """
+    Create a synthetic set of instances, peers and firewall rules for benchmarking.
+
+    Objects are created with bulk_create, so no post_save signal touches the running system. Instances
+    are allocated with find_free_instance_slot() and get a /22 each, so at most 1021 peers per instance.
+    Call this inside a transaction that is rolled back.
+    """
+    generator = random.Random(seed)
+    peers_per_instance = -(-peer_count // instance_count)
+    if peers_per_instance > 2 ** (32 - SYNTHETIC_INSTANCE_NETMASK) - 3:
+        raise ValueError(f'{peers_per_instance} peers do not fit in a /{SYNTHETIC_INSTANCE_NETMASK} instance network')
+
+    wireguard_instances = []
+    peer_addresses = []
+    for index in range(instance_count):
+        # One at a time, so the next slot sees the instances created before it
+        instance_slot = find_free_instance_slot(SYNTHETIC_INSTANCE_NETMASK)
+        wireguard_instances += WireGuardInstance.objects.bulk_create([WireGuardInstance(
+            name=f'benchmark{index}', instance_id=instance_slot['instance_id'], listen_port=instance_slot['listen_port'],
+            private_key='benchmark', public_key=f'benchmark{index}', hostname='benchmark',
+            address=instance_slot['address'], netmask=SYNTHETIC_INSTANCE_NETMASK,
+        )])
+        network = ipaddress.ip_network(f"{instance_slot['address']}/{SYNTHETIC_INSTANCE_NETMASK}", strict=False)
+        peer_addresses.append([str(host) for host in network.hosts() if str(host) != instance_slot['address']])
+
+    peers = Peer.objects.bulk_create([
+        Peer(name=f'benchmark{index}', public_key=f'benchmark{index}', pre_shared_key='benchmark',
+             wireguard_instance=wireguard_instances[index % instance_count])
+        for index in range(peer_count)
+    ])
+
+    allowed_ips = []
+    for index, peer in enumerate(peers):
+        allowed_ips.append(PeerAllowedIP(
+            peer=peer, priority=0, netmask=32, allowed_ip=peer_addresses[index % instance_count][index // instance_count],
+        ))
+        # One peer in five routes a network behind it
+        if index % 5 == 0:
+            allowed_ips.append(PeerAllowedIP(peer=peer, priority=1, allowed_ip=f'100.{64 + index // 256 % 64}.{index % 256}.0', netmask=24))
+    PeerAllowedIP.objects.bulk_create(allowed_ips)
+
+    firewall_rules = FirewallRule.objects.bulk_create([
+        FirewallRule(
+            firewall_chain='forward', sort_order=100 + index, description=f'benchmark{index}',
+            protocol=generator.choice(['', 'tcp', 'udp', 'both']), rule_action=generator.choice(['accept', 'reject', 'drop']),
+            destination_port=str(generator.randint(1, 65535)) if generator.random() < 0.5 else '',
+            source_peer_include_networks=generator.random() < 0.2, destination_peer_include_networks=generator.random() < 0.2,
+        ) for index in range(rule_count)
+    ])
+    for firewall_rule in firewall_rules:
+        firewall_rule.source_peer.set(generator.sample(peers, generator.randint(1, min(20, peer_count))))
+        firewall_rule.destination_peer.set(generator.sample(peers, generator.randint(1, min(20, peer_count))))
+
+    return wireguard_instances
+
+
+def count_iptables_rules(firewall_rules):
+    chain_rules = {}
+    for line in firewall_rules.splitlines():
+        parsed_command = parse_iptables_command(line)
+        if parsed_command and parsed_command[1] == '-A':
+            chain = f"{parsed_command[0]}/{parsed_command[2]}"
+            chain_rules[chain] = chain_rules.get(chain, 0) + 1
+    return chain_rules
+
+
+def count_nftables_rules(ruleset):
+    chain_rules = {}
+    chain = None
+    for line in ruleset.splitlines():
+        chain_match = NFTABLES_CHAIN_REGEX.match(line)
+        if chain_match:
+            chain = chain_match.group(1)
+            chain_rules[chain] = 0
+        elif line.strip() == '}':
+            chain = None
+        elif chain and line.strip() and not line.strip().startswith(('#', 'type ')):
+            chain_rules[chain] += 1
+    return chain_rules
+
+
+def interface_matches(rule_interface, interface):
+    if rule_interface.endswith('+') or rule_interface.endswith('*'):
+        return interface.startswith(rule_interface[:-1])
+    return rule_interface == interface
+
+
+def estimate_iptables_traversal(firewall_rules, interface):
+    """
+    Rough number of WGWADM_FORWARD rules evaluated for a forwarded packet from 'interface' that matches
+    none of them: every rule without an input interface or with a matching one.
+    """
+    traversed = 0
+    for line in firewall_rules.splitlines():
+        parsed_command = parse_iptables_command(line)
+        if not parsed_command or parsed_command[1] != '-A' or parsed_command[2] != 'WGWADM_FORWARD':
+            continue
+        arguments = parsed_command[3].split()
+        if '-i' in arguments and not interface_matches(arguments[arguments.index('-i') + 1], interface):
+            continue
+        traversed += 1
+    return traversed
+
+
+def estimate_nftables_traversal(ruleset, interface):
+    """Same estimate as estimate_iptables_traversal() for the nftables forward chain. Set lookups count as one rule."""
+    traversed = 0
+    chain = None
+    for line in ruleset.splitlines():
+        chain_match = NFTABLES_CHAIN_REGEX.match(line)
+        if chain_match:
+            chain = chain_match.group(1)
+            continue
+        if chain != 'forward' or not line.strip() or line.strip().startswith(('#', 'type ', '}')):
+            continue
+        iifname_match = NFTABLES_IIFNAME_REGEX.search(line)
+        if iifname_match and iifname_match.group(1) and not interface_matches(iifname_match.group(1), interface):
+            continue
+        traversed += 1
+    return traversed
+
+
+def get_webadmin_ip():
+    """Resolve the web admin address the same way the nftables script does."""
+    try:
+        return socket.gethostbyname('wireguard-webadmin')
+    except OSError:
+        pass
+    try:
+        return socket.gethostbyname(socket.gethostname())
+    except OSError:
+        return '127.0.0.1'
+
+
+def time_firewall_test_apply(backend, firewall_rules, nftables_ruleset):
+    """
+    Time a dry run of the apply: 'iptables-restore --test' or 'nft -c' parse and validate the whole
+    ruleset without committing it, so the running firewall is not touched.
+
+    Returns (seconds, success), or (None, None) when the tool is not installed.
+    """
+    if backend == 'iptables':
+        command = ['iptables-restore', '--noflush', '--test']
+        payload = generate_iptables_restore_payload(tag_firewall_rules(firewall_rules, get_dns_ip()))
+        payload = payload.replace('$DNS_IP', get_dns_ip())
+    else:
+        command = ['nft', '-c', '-f', '-']
+        payload = nftables_ruleset.replace('$DNS_IP', get_dns_ip()).replace('$WEBADMIN_IP', get_webadmin_ip())
+    if not shutil.which(command[0]):
+        return None, None
+    start = time.perf_counter()
+    result = subprocess.run(command, input=payload, capture_output=True, text=True)
+    return time.perf_counter() - start, result.returncode == 0
+
+
+def run_firewall_benchmark(apply=False, test_apply=False):
+    """
+    Compile the firewall from the database with both backends and report rule counts, compile time,
+    query count, and an estimate of the rules traversed per packet for each instance.
+
+    With test_apply=True each backend also times a dry run of its apply ('iptables-restore --test',
+    'nft -c'). With apply=True the firewall is applied to the running system and the apply time is reported.
+    """
+    from wireguard_tools.views import apply_firewall_configuration, compile_firewall_rules
+
+    firewall_settings, firewall_settings_created = FirewallSettings.objects.get_or_create(name='global')
+
+    with CaptureQueriesContext(connection) as iptables_queries:
+        start = time.perf_counter()
+        user_rules = get_firewall_rules()
+        firewall_rules = compile_firewall_rules(user_rules, firewall_settings)
+        firewall_ipsets = export_firewall_ipsets(user_rules)
+        iptables_compile_seconds = time.perf_counter() - start
+
+    with CaptureQueriesContext(connection) as nftables_queries:
+        start = time.perf_counter()
+        nftables_ruleset = generate_nftables_ruleset(firewall_settings)
+        nftables_compile_seconds = time.perf_counter() - start
+
+    test_apply_results = {}
+    for backend in ('iptables', 'nftables'):
+        test_apply_results[backend] = (None, None)
+        if test_apply:
+            test_apply_results[backend] = time_firewall_test_apply(backend, firewall_rules, nftables_ruleset)
+
+    apply_seconds = None
+    apply_success = None
+    if apply:
+        start = time.perf_counter()
+        apply_success = apply_firewall_configuration()
+        apply_seconds = time.perf_counter() - start
+
+    instances = []
+    for wireguard_instance in WireGuardInstance.objects.annotate(peer_count=Count('peer')).order_by('instance_id'):
+        interface = f"wg{wireguard_instance.instance_id}"
+        instances.append({
+            'interface': interface,
+            'peers': wireguard_instance.peer_count,
+            'iptables_traversal': estimate_iptables_traversal(firewall_rules, interface),
+            'nftables_traversal': estimate_nftables_traversal(nftables_ruleset, interface),
+        })
+
+    return {
+        'backend': firewall_settings.firewall_backend,
+        'firewall_rules': len(user_rules),
+        'iptables': {
+            'compile_seconds': iptables_compile_seconds,
+            'queries': len(iptables_queries),
+            'chains': count_iptables_rules(firewall_rules),
+            'ipsets': len(firewall_ipsets),
+            'ipset_members': sum(len(members) for members in firewall_ipsets.values()),
+            'test_apply_seconds': test_apply_results['iptables'][0],
+            'test_apply_success': test_apply_results['iptables'][1],
+        },
+        'nftables': {
+            'compile_seconds': nftables_compile_seconds,
+            'queries': len(nftables_queries),
+            'chains': count_nftables_rules(nftables_ruleset),
+            'sets': nftables_ruleset.count('\n    set '),
+            'test_apply_seconds': test_apply_results['nftables'][0],
+            'test_apply_success': test_apply_results['nftables'][1],
+        },
+        'apply_seconds': apply_seconds,
+        'apply_success': apply_success,
+        'instances': instances,
+    }
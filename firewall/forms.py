@@ -186,4 +186,6 @@ class FirewallSettingsForm(forms.ModelForm):
 
     class Meta:
         model = FirewallSettings
-        fields = ['default_forward_policy', 'allow_peer_to_peer', 'allow_instance_to_instance', 'wan_interface']
\ No newline at end of file
+        fields = ['default_forward_policy', 'allow_peer_to_peer', 'allow_instance_to_instance', 'wan_interface', 'firewall_backend']
+        # firewall_backend choices come from the model field
+        labels = {'firewall_backend': _('Firewall Backend')}
\ No newline at end of file
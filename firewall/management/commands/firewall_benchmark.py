@@ -0,0 +1,100 @@
+"""
+Management command to compile the firewall and report its size and compile time.
+With --synthetic a generated dataset is compiled instead, inside a transaction that is rolled back.
+With --test-apply the apply time is measured with a dry run that leaves the running firewall untouched.
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from firewall.benchmark import generate_synthetic_firewall_dataset, run_firewall_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Compile the firewall and report rule counts per chain, compile time and per packet rule traversal'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--synthetic',
+            action='store_true',
+            help='Benchmark a generated dataset added to the current data (rolled back afterwards)',
+        )
+        parser.add_argument('--peers', type=int, default=1000, help='Number of synthetic peers (default: 1000)')
+        parser.add_argument('--rules', type=int, default=200, help='Number of synthetic firewall rules (default: 200)')
+        parser.add_argument('--instances', type=int, default=4, help='Number of synthetic instances (default: 4)')
+        parser.add_argument(
+            '--test-apply',
+            action='store_true',
+            help="Time a dry run of the apply with 'iptables-restore --test' and 'nft -c' (does not touch the firewall)",
+        )
+        parser.add_argument(
+            '--apply',
+            action='store_true',
+            help='Also apply the firewall to the running system and report the apply time',
+        )
+        parser.add_argument(
+            '--max-compile-seconds',
+            type=float,
+            help='Fail if compiling with either backend takes longer than this',
+        )
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        if options['synthetic'] and options['apply']:
+            raise CommandError("--apply cannot be used with --synthetic")
+
+        if options['synthetic']:
+            with transaction.atomic():
+                generate_synthetic_firewall_dataset(options['peers'], options['rules'], options['instances'])
+                report = run_firewall_benchmark(test_apply=options['test_apply'])
+                transaction.set_rollback(True)
+        else:
+            report = run_firewall_benchmark(apply=options['apply'], test_apply=options['test_apply'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_report(report, options['test_apply'])
+
+        max_compile_seconds = options['max_compile_seconds']
+        if max_compile_seconds is not None:
+            for backend in ('iptables', 'nftables'):
+                if report[backend]['compile_seconds'] > max_compile_seconds:
+                    raise CommandError(
+                        f"{backend} compile took {report[backend]['compile_seconds']:.3f}s, limit is {max_compile_seconds:.3f}s"
+                    )
+
+    def print_report(self, report, test_apply=False):
+        self.stdout.write(f"Firewall backend: {report['backend']}")
+        self.stdout.write(f"Firewall rules in database: {report['firewall_rules']}")
+        for backend in ('iptables', 'nftables'):
+            backend_report = report[backend]
+            self.stdout.write("")
+            self.stdout.write(
+                f"{backend}: compiled in {backend_report['compile_seconds'] * 1000:.1f} ms with {backend_report['queries']} queries"
+            )
+            for chain, rule_count in backend_report['chains'].items():
+                self.stdout.write(f"  {chain}: {rule_count} rules")
+            if backend == 'iptables':
+                self.stdout.write(f"  ipsets: {backend_report['ipsets']} ({backend_report['ipset_members']} members)")
+            else:
+                self.stdout.write(f"  sets: {backend_report['sets']}")
+            if test_apply and backend_report['test_apply_success'] is None:
+                self.stdout.write("  test apply: not available")
+            elif test_apply:
+                test_apply_status = self.style.SUCCESS("valid") if backend_report['test_apply_success'] else self.style.ERROR("invalid")
+                self.stdout.write(f"  test apply: {test_apply_status} in {backend_report['test_apply_seconds'] * 1000:.1f} ms")
+
+        if report['apply_seconds'] is not None:
+            self.stdout.write("")
+            apply_status = self.style.SUCCESS("applied") if report['apply_success'] else self.style.ERROR("failed")
+            self.stdout.write(f"Apply: {apply_status} in {report['apply_seconds'] * 1000:.1f} ms")
+
+        self.stdout.write("")
+        self.stdout.write("Forward rules traversed per packet (worst case, iptables / nftables):")
+        for instance in report['instances']:
+            self.stdout.write(
+                f"  {instance['interface']} ({instance['peers']} peers): {instance['iptables_traversal']} / {instance['nftables_traversal']}"
+            )
+        self.stdout.write(self.style.SUCCESS("Benchmark complete"))
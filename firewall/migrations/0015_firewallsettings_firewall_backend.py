@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firewall', '0014_redirectrule_port_forward'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='firewallsettings',
+            name='firewall_backend',
+            field=models.CharField(choices=[('iptables', 'iptables'), ('nftables', 'nftables')], default='iptables', max_length=8),
+        ),
+    ]
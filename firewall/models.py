@@ -77,6 +77,7 @@ class FirewallSettings(models.Model):
     allow_peer_to_peer = models.BooleanField(default=True)
     allow_instance_to_instance = models.BooleanField(default=True)
     wan_interface = models.CharField(max_length=12, default='eth0')
+    firewall_backend = models.CharField(max_length=8, default='iptables', choices=[('iptables', 'iptables'), ('nftables', 'nftables')])
     pending_changes = models.BooleanField(default=False)
     last_firewall_reset = models.DateTimeField(blank=True, null=True)
 
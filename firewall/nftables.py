@@ -0,0 +1,274 @@
+import ipaddress
+
+from django.utils import timezone
+
+from firewall.models import FirewallSettings
+from firewall.tools import get_firewall_rules, get_peer_addresses, get_redirect_rules
+from wireguard.models import WireGuardInstance
+
+NFTABLES_TABLE = 'wgwadm'
+
+
+def nft_interface(interface):
+    """Translate an iptables interface name ('wg+') into an nftables one ('"wg*"')."""
+    if interface.endswith('+'):
+        interface = interface[:-1] + '*'
+    return f'"{interface}"'
+
+
+def nft_comment(text):
+    """Strip characters that would break the generated script (heredoc expansion or nft string quoting)."""
+    for character in ('$', '`', '\\', '"', '\n'):
+        text = text.replace(character, '')
+    return text
+
+
+def nft_address(address):
+    """Normalize an 'ip/netmask' string into a network accepted by nftables, or None if it is not an address."""
+    try:
+        return str(ipaddress.ip_network(address, strict=False))
+    except ValueError:
+        return None
+
+
+def nft_set(name, set_type, elements, interval=False):
+    flags = "        flags interval\n        auto-merge\n" if interval else ""
+    nft_set_definition = f"    set {name} {{\n        type {set_type}\n{flags}"
+    if elements:
+        nft_set_definition += f"        elements = {{ {', '.join(elements)} }}\n"
+    nft_set_definition += "    }\n"
+    return nft_set_definition
+
+
+def resolve_rule_addresses(peers, include_networks, ip_address, netmask):
+    """
+    Return (addresses, missing) for one side of a FirewallRule.
+
+    'missing' lists the selected peers without an address. If the rule selects something but nothing
+    resolves, the caller must skip the rule, otherwise it would match every address.
+    """
+    addresses = []
+    missing = []
+    for address in get_peer_addresses(peers, include_networks):
+        if "Missing IP for selected peer:" in address:
+            missing.append(address)
+        else:
+            addresses.append(address)
+    if ip_address:
+        addresses.append(f"{ip_address}/{netmask}")
+    addresses = [nft_address(address) for address in addresses]
+    return list(dict.fromkeys(address for address in addresses if address)), missing
+
+
+def compile_address_match(field, addresses, negate, set_name, sets):
+    """Match a single address inline and anything larger through a named interval set."""
+    operator = "!= " if negate else ""
+    if len(addresses) == 1:
+        return f"ip {field} {operator}{addresses[0]}"
+    sets.append(nft_set(set_name, 'ipv4_addr', addresses, interval=True))
+    return f"ip {field} {operator}@{set_name}"
+
+
+def compile_firewall_rule(rule, index, sets):
+    """
+    Compile a FirewallRule into a single nftables rule.
+
+    Peer selections are placed in named sets, so the rule count follows the FirewallRule rows instead of
+    the protocols × sources × destinations product used by the iptables backend.
+    """
+    description = f" - {nft_comment(rule.description)}" if rule.description else ""
+    comment = f"        # {rule.sort_order} - {rule.uuid}{description}\n"
+
+    source_addresses, source_missing = resolve_rule_addresses(
+        rule.source_peer, rule.source_peer_include_networks, rule.source_ip, rule.source_netmask
+    )
+    destination_addresses, destination_missing = resolve_rule_addresses(
+        rule.destination_peer, rule.destination_peer_include_networks, rule.destination_ip, rule.destination_netmask
+    )
+    for missing in source_missing + destination_missing:
+        comment += f"        # {rule.sort_order} - {rule.uuid}{description} - {nft_comment(missing)}\n"
+    if (source_missing and not source_addresses) or (destination_missing and not destination_addresses):
+        return comment
+
+    matches = []
+    if rule.in_interface:
+        matches.append(f"iifname {nft_interface(rule.in_interface)}")
+    if rule.out_interface:
+        matches.append(f"oifname {nft_interface(rule.out_interface)}")
+    if source_addresses:
+        matches.append(compile_address_match('saddr', source_addresses, rule.not_source, f"rule_{index}_saddr", sets))
+    if destination_addresses:
+        matches.append(compile_address_match('daddr', destination_addresses, rule.not_destination, f"rule_{index}_daddr", sets))
+
+    states = []
+    if rule.state_new:
+        states.append("new")
+    if rule.state_related:
+        states.append("related")
+    if rule.state_established:
+        states.append("established")
+    if rule.state_invalid:
+        states.append("invalid")
+    if rule.state_untracked:
+        states.append("untracked")
+    if states:
+        not_state = "!= " if rule.not_state else ""
+        matches.append(f"ct state {not_state}{','.join(states)}")
+
+    destination_port = rule.destination_port.replace(':', '-') if rule.destination_port else ""
+    if rule.protocol == 'both':
+        matches.append("meta l4proto { tcp, udp }")
+        if destination_port:
+            matches.append(f"th dport {destination_port}")
+    elif rule.protocol in ('tcp', 'udp'):
+        matches.append(f"{rule.protocol} dport {destination_port}" if destination_port else f"meta l4proto {rule.protocol}")
+    elif rule.protocol:
+        matches.append(f"meta l4proto {rule.protocol}")
+    elif destination_port:
+        matches.append(f"th dport {destination_port}")
+
+    matches.append(rule.rule_action)
+    return f"{comment}        {' '.join(matches)}\n"
+
+
+def generate_nftables_ruleset(firewall_settings=None):
+    """
+    Generate the nftables ruleset for the 'wgwadm' table.
+
+    The ruleset creates, deletes and recreates the table in a single 'nft -f' transaction, so the
+    replacement is atomic and never touches tables owned by other software.
+    """
+    if firewall_settings is None:
+        firewall_settings, firewall_settings_created = FirewallSettings.objects.get_or_create(name='global')
+    wan_interface = nft_interface(firewall_settings.wan_interface)
+    deny_policy = 'reject'
+    if firewall_settings.default_forward_policy == 'drop':
+        deny_policy = 'drop'
+
+    sets = []
+    prerouting = []
+    forward = ["        ct state related,established accept\n"]
+    postrouting = []
+
+    wireguard_instances = list(WireGuardInstance.objects.all().order_by('instance_id'))
+    if wireguard_instances:
+        sets.append(nft_set('dns_redirect', 'ifname . ipv4_addr', [
+            f'"wg{wireguard_instance.instance_id}" . {wireguard_instance.address}' for wireguard_instance in wireguard_instances
+        ]))
+        sets.append(nft_set('instance_interfaces', 'ifname', [
+            f'"wg{wireguard_instance.instance_id}"' for wireguard_instance in wireguard_instances
+        ]))
+        sets.append(nft_set('instance_networks', 'ipv4_addr', [
+            nft_address(f"{wireguard_instance.address}/{wireguard_instance.netmask}") for wireguard_instance in wireguard_instances
+        ], interval=True))
+        prerouting.append("        # DNS Redirect for all instances\n")
+        prerouting.append("        iifname . ip daddr @dns_redirect meta l4proto { tcp, udp } th dport 53 dnat to $DNS_IP:53\n")
+        postrouting.append(f"        ip saddr @instance_networks oifname {wan_interface} ip daddr $DNS_IP masquerade\n")
+        forward.append(f"        iifname @instance_interfaces oifname {wan_interface} ip daddr $DNS_IP accept\n")
+
+    redirect_rules, peer_destinations = get_redirect_rules()
+    for redirect_rule in redirect_rules:
+        description = f" - {nft_comment(redirect_rule.description)} " if redirect_rule.description else ""
+        rule_destination = redirect_rule.ip_address
+        try:
+            if redirect_rule.port_forward:
+                destination_port = int(redirect_rule.port_forward)
+            else:
+                destination_port = redirect_rule.port
+        except ValueError:
+            destination_port = redirect_rule.port
+
+        if redirect_rule.peer_id:
+            rule_destination = peer_destinations.get(redirect_rule.peer_id, rule_destination)
+        comment = f"        # {redirect_rule.port}/{redirect_rule.protocol} - {redirect_rule.uuid} - Port Forward Rule set{description}"
+        if not rule_destination:
+            prerouting.append(f"{comment} - Missing IP for selected peer: {nft_comment(str(redirect_rule.peer))}\n")
+            continue
+        prerouting.append(f"{comment}\n")
+        prerouting.append(f"        iifname {wan_interface} ip daddr $WEBADMIN_IP {redirect_rule.protocol} dport {redirect_rule.port} dnat to {rule_destination}:{destination_port}\n")
+        if redirect_rule.masquerade_source:
+            postrouting.append(f"        oifname \"wg*\" ip daddr {rule_destination} {redirect_rule.protocol} dport {destination_port} masquerade\n")
+        if redirect_rule.add_forward_rule:
+            forward.append(f"        iifname {wan_interface} oifname \"wg*\" ip daddr {rule_destination} {redirect_rule.protocol} dport {destination_port} accept\n")
+
+    for index, rule in enumerate(get_firewall_rules()):
+        if rule.firewall_chain == 'forward':
+            forward.append(compile_firewall_rule(rule, index, sets))
+        elif rule.firewall_chain == 'postrouting':
+            postrouting.append(compile_firewall_rule(rule, index, sets))
+
+    forward.append("        # The following rules come from Firewall settings\n")
+    peer_to_peer_action = 'accept' if firewall_settings.allow_peer_to_peer else deny_policy
+    instance_to_instance_action = 'accept' if firewall_settings.allow_instance_to_instance else deny_policy
+    if wireguard_instances and peer_to_peer_action != instance_to_instance_action:
+        forward.append("        # Same instance Peer to Peer traffic\n")
+        sets.append(nft_set('peer_to_peer', 'ifname . ifname', [
+            f'"wg{wireguard_instance.instance_id}" . "wg{wireguard_instance.instance_id}"' for wireguard_instance in wireguard_instances
+        ]))
+        forward.append(f"        iifname . oifname @peer_to_peer {peer_to_peer_action}\n")
+        forward.append("        # Instance to Instance traffic\n")
+    else:
+        forward.append("        # Same instance Peer to Peer and Instance to Instance traffic\n")
+    forward.append(f"        iifname \"wg*\" oifname \"wg*\" {instance_to_instance_action}\n")
+
+    # Chain policies only accept 'accept' or 'drop', so a reject default is an explicit final rule
+    forward_policy = 'drop' if firewall_settings.default_forward_policy == 'drop' else 'accept'
+    if firewall_settings.default_forward_policy == 'reject':
+        forward.append("        # Default FORWARD policy\n")
+        forward.append("        reject\n")
+
+    ruleset = f"table ip {NFTABLES_TABLE}\n"
+    ruleset += f"delete table ip {NFTABLES_TABLE}\n"
+    ruleset += f"table ip {NFTABLES_TABLE} {{\n"
+    ruleset += "".join(sets)
+    ruleset += "    chain prerouting {\n        type nat hook prerouting priority dstnat; policy accept;\n"
+    ruleset += "".join(prerouting)
+    ruleset += "    }\n"
+    ruleset += f"    chain forward {{\n        type filter hook forward priority filter; policy {forward_policy};\n"
+    ruleset += "".join(forward)
+    ruleset += "    }\n"
+    ruleset += "    chain postrouting {\n        type nat hook postrouting priority srcnat; policy accept;\n"
+    ruleset += "".join(postrouting)
+    ruleset += "    }\n"
+    ruleset += "}\n"
+    return ruleset
+
+
+def generate_nftables_script(firewall_settings=None):
+    script = f'''#!/bin/bash
+# Description: Firewall rules for WireGuard_WebAdmin (nftables backend)
+# Do not edit this file directly. Use the web interface to manage firewall rules.
+#
+# This script was generated by WireGuard_WebAdmin on {timezone.now().strftime('%Y-%m-%d %H:%M:%S %Z')}
+#
+DNS_IP=$(getent hosts wireguard-webadmin-dns | awk '{{ print $1 }}')
+if [ -z "$DNS_IP" ]; then
+    DNS_IP="127.0.0.250"
+fi
+WEBADMIN_IP=$(getent hosts wireguard-webadmin | awk '{{ print $1 }}')
+if [ -z "$WEBADMIN_IP" ]; then
+    WEBADMIN_IP=$(hostname -i | awk '{{ print $1 }}')
+fi
+
+# Empty the iptables backend chains so both backends never filter the same traffic. The iptables backend
+# also set the FORWARD policy, a DROP left behind would drop what nftables accepts. The nftables forward
+# chain applies the default policy instead.
+if command -v iptables >> /dev/null 2>&1 && iptables -t filter -S WGWADM_FORWARD >> /dev/null 2>&1; then
+    iptables -t nat    -F WGWADM_POSTROUTING >> /dev/null 2>&1
+    iptables -t nat    -F WGWADM_PREROUTING  >> /dev/null 2>&1
+    iptables -t filter -F WGWADM_FORWARD     >> /dev/null 2>&1
+    iptables -t filter -P FORWARD ACCEPT
+fi
+
+if nft -f - << WGWADM_NFTABLES
+'''
+    script += generate_nftables_ruleset(firewall_settings)
+    script += '''WGWADM_NFTABLES
+then
+    echo "Firewall rules applied with nftables"
+else
+    echo "Failed to apply nftables firewall rules"
+    exit 1
+fi
+'''
+    return script
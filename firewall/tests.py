@@ -1,3 +1,130 @@
-from django.test import TestCase
+import ipaddress
 
-# Create your tests here.
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase
+
+from firewall.benchmark import generate_synthetic_firewall_dataset, run_firewall_benchmark
+from firewall.models import FirewallRule, FirewallSettings, RedirectRule
+from firewall.tools import export_user_firewall, generate_firewall_footer, generate_iptables_restore_payload, \
+    generate_port_forward_firewall, get_firewall_rules
+from wireguard.models import Peer, PeerAllowedIP, WireGuardInstance
+
+# Queries to load the rules with their peers and allowed IPs, and the redirect rules with their destinations
+FIREWALL_COMPILE_QUERIES = 7
+# The iptables compile also loads the instances, pooled slots and routed networks for the ipsets
+BENCHMARK_IPTABLES_QUERIES = 9
+BENCHMARK_NFTABLES_QUERIES = 7
+# Base, DNS and Firewall settings rules around the user rules
+BENCHMARK_FIXED_FORWARD_RULES = 5
+
+
+class FirewallQueryCountTest(TestCase):
+    """Compiling the firewall costs the same number of queries whatever the number of rules and peers."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # bulk_create sends no post_save signal, nothing touches the running system
+        cls.wireguard_instance = WireGuardInstance.objects.bulk_create([WireGuardInstance(
+            name='test', instance_id=200, listen_port=52020, address='10.250.0.1', netmask=16,
+            private_key='test', public_key='test', hostname='test',
+        )])[0]
+        cls.firewall_settings = FirewallSettings.objects.create(name='global')
+
+    def add_rules(self, start, count):
+        peers = Peer.objects.bulk_create([
+            Peer(name=f'test{index}', public_key=f'test{index}', wireguard_instance=self.wireguard_instance)
+            for index in range(start, start + count)
+        ])
+        allowed_ips = []
+        for index, peer in zip(range(start, start + count), peers):
+            allowed_ips.append(PeerAllowedIP(peer=peer, priority=0, netmask=32, allowed_ip=f'10.250.{index // 250}.{index % 250 + 2}'))
+            allowed_ips.append(PeerAllowedIP(peer=peer, priority=1, netmask=24, allowed_ip=f'100.64.{index}.0'))
+        PeerAllowedIP.objects.bulk_create(allowed_ips)
+
+        firewall_rules = FirewallRule.objects.bulk_create([
+            FirewallRule(
+                firewall_chain='forward', sort_order=index, protocol='tcp', destination_port='443',
+                destination_peer_include_networks=index % 2 == 0,
+            ) for index in range(start, start + count)
+        ])
+        source_peers = FirewallRule.source_peer.through
+        destination_peers = FirewallRule.destination_peer.through
+        source_peers.objects.bulk_create([
+            source_peers(firewallrule_id=firewall_rule.pk, peer_id=peer.pk) for firewall_rule, peer in zip(firewall_rules, peers)
+        ])
+        destination_peers.objects.bulk_create([
+            destination_peers(firewallrule_id=firewall_rule.pk, peer_id=peer.pk)
+            for firewall_rule in firewall_rules for peer in peers[:3]
+        ])
+
+        RedirectRule.objects.bulk_create([
+            RedirectRule(protocol='tcp', port=10000 + index, peer=peer) for index, peer in zip(range(start, start + count), peers)
+        ])
+
+    def compile_user_firewall(self):
+        rules = get_firewall_rules()
+        user_firewall = export_user_firewall(rules)
+        port_forward_firewall = generate_port_forward_firewall(self.firewall_settings)
+        return rules, user_firewall, port_forward_firewall
+
+    def test_query_count_does_not_grow_with_rules_and_peers(self):
+        self.add_rules(0, 10)
+        with self.assertNumQueries(FIREWALL_COMPILE_QUERIES):
+            rules, user_firewall, port_forward_firewall = self.compile_user_firewall()
+        self.assertEqual(len(rules), 10)
+        self.assertIn('--dport 10009', port_forward_firewall)
+
+        self.add_rules(10, 10)
+        with self.assertNumQueries(FIREWALL_COMPILE_QUERIES):
+            rules, user_firewall, port_forward_firewall = self.compile_user_firewall()
+        self.assertEqual(len(rules), 20)
+        self.assertIn('--dport 10019', port_forward_firewall)
+
+
+class FirewallBenchmarkTest(TestCase):
+    """The synthetic benchmark at reduced scale: query counts stay constant and rule counts follow the rules."""
+
+    def run_synthetic_benchmark(self, peer_count, rule_count):
+        # Roll the dataset back like the firewall_benchmark command, so the next run starts from scratch
+        with transaction.atomic():
+            wireguard_instances = generate_synthetic_firewall_dataset(peer_count, rule_count, instance_count=2)
+            report = run_firewall_benchmark()
+            transaction.set_rollback(True)
+        return wireguard_instances, report
+
+    def test_synthetic_dataset_bounds(self):
+        for peer_count, rule_count in ((50, 10), (100, 20)):
+            wireguard_instances, report = self.run_synthetic_benchmark(peer_count, rule_count)
+            networks = [
+                ipaddress.ip_network(f"{wireguard_instance.address}/{wireguard_instance.netmask}", strict=False)
+                for wireguard_instance in wireguard_instances
+            ]
+            self.assertFalse(networks[0].overlaps(networks[1]))
+
+            self.assertEqual(report['firewall_rules'], rule_count)
+            self.assertEqual(report['iptables']['queries'], BENCHMARK_IPTABLES_QUERIES)
+            self.assertEqual(report['nftables']['queries'], BENCHMARK_NFTABLES_QUERIES)
+            # A rule for 'both' protocols compiles to one tcp and one udp rule, peers go to ipsets
+            self.assertLessEqual(report['iptables']['chains']['filter/WGWADM_FORWARD'], 2 * rule_count + BENCHMARK_FIXED_FORWARD_RULES)
+            self.assertLessEqual(report['nftables']['chains']['forward'], rule_count + BENCHMARK_FIXED_FORWARD_RULES)
+            self.assertEqual(len(report['instances']), 2)
+            self.assertEqual(sum(instance['peers'] for instance in report['instances']), peer_count)
+
+
+class ForwardPolicyTest(SimpleTestCase):
+    """The iptables-restore payload only uses the chain policies iptables accepts."""
+
+    def get_filter_payload(self, default_forward_policy):
+        firewall_settings = FirewallSettings(name='global', default_forward_policy=default_forward_policy)
+        payload = generate_iptables_restore_payload(generate_firewall_footer(firewall_settings))
+        return payload.split('*filter\n')[1].split('COMMIT')[0].splitlines()
+
+    def test_reject_is_a_final_rule(self):
+        payload = self.get_filter_payload('reject')
+        self.assertIn(':FORWARD ACCEPT [0:0]', payload)
+        self.assertEqual(payload[-1], '-A WGWADM_FORWARD -j REJECT')
+
+    def test_drop_is_the_chain_policy(self):
+        payload = self.get_filter_payload('drop')
+        self.assertIn(':FORWARD DROP [0:0]', payload)
+        self.assertNotIn('-A WGWADM_FORWARD -j REJECT', payload)
@@ -1,18 +1,41 @@
+import difflib
+import hashlib
+import ipaddress
+import logging
+import re
+import shutil
+import socket
+import subprocess
+
+from django.db.models import Prefetch
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from firewall.models import FirewallRule, FirewallSettings, RedirectRule
-from wireguard.models import PeerAllowedIP, WireGuardInstance
+from wireguard.models import PeerAllowedIP, PooledInstance, WireGuardInstance
+
+logger = logging.getLogger(__name__)
+
+FIREWALL_CHAINS = {'nat': ['WGWADM_POSTROUTING', 'WGWADM_PREROUTING'], 'filter': ['WGWADM_FORWARD']}
+FIREWALL_RULE_TAG_REGEX = re.compile(r'--comment "?wgwadm:([0-9a-f]+)')
+FIREWALL_IPSET_TYPES = {'wgwadm_instance_p2p': 'hash:net,iface'}
 
 
 def get_peer_addresses(peers, include_networks):
+    """
+    Return the server side addresses of the given peers.
+
+    The allowed IPs are read through peer.peerallowedip_set.all(), so rules loaded with
+    get_firewall_rules() are compiled without any additional query.
+    """
     addresses = []
     for peer in peers.all():
-        peer_ips = peer.peerallowedip_set.filter(config_file='server').order_by('priority')
-        if not include_networks:
-            peer_ips = peer_ips.filter(priority=0)
-        
-        if peer_ips.exists():
+        peer_ips = sorted(
+            [peer_ip for peer_ip in peer.peerallowedip_set.all() if peer_ip.config_file == 'server' and (include_networks or peer_ip.priority == 0)],
+            key=lambda peer_ip: peer_ip.priority
+        )
+
+        if peer_ips:
             addresses.extend([f"{peer_ip.allowed_ip}/{peer_ip.netmask}" for peer_ip in peer_ips])
         else:
             addresses.append(f"Missing IP for selected peer: {peer}")
@@ -20,6 +43,31 @@ def get_peer_addresses(peers, include_networks):
     return addresses
 
 
+def get_firewall_rules():
+    """Load every FirewallRule with its peers and their server side allowed IPs in a constant number of queries."""
+    server_allowed_ips = PeerAllowedIP.objects.filter(config_file='server').order_by('priority')
+    return list(FirewallRule.objects.all().order_by('firewall_chain', 'sort_order').prefetch_related(
+        Prefetch('source_peer__peerallowedip_set', queryset=server_allowed_ips),
+        Prefetch('destination_peer__peerallowedip_set', queryset=server_allowed_ips),
+    ))
+
+
+def get_redirect_rules():
+    """
+    Return (redirect_rules, peer_destinations) where peer_destinations maps a peer id to the address used
+    by port forwarding rules pointing at that peer.
+    """
+    redirect_rules = list(RedirectRule.objects.all().select_related('peer').order_by('port'))
+    peer_destinations = {}
+    peer_allowed_ips = PeerAllowedIP.objects.filter(
+        peer_id__in=[redirect_rule.peer_id for redirect_rule in redirect_rules if redirect_rule.peer_id],
+        config_file='server', netmask=32, priority=0
+    ).order_by('created')
+    for peer_allowed_ip in peer_allowed_ips:
+        peer_destinations.setdefault(peer_allowed_ip.peer_id, peer_allowed_ip.allowed_ip)
+    return redirect_rules, peer_destinations
+
+
 def reset_firewall_to_default():
     for wireguard_instance in WireGuardInstance.objects.all():
         wireguard_instance.pending_changes = True
@@ -69,19 +117,177 @@ def reset_firewall_to_default():
     return
 
 
-def export_user_firewall():
+def get_firewall_ipset_name(rule, direction):
+    """Stable per rule ipset name, so peer IP changes only touch set membership and never the chain."""
+    return f"wgwadm_{direction}_{rule.uuid.hex[:12]}"
+
+
+def get_rule_addresses(rule):
+    source_addresses = get_peer_addresses(rule.source_peer, rule.source_peer_include_networks)
+    destination_addresses = get_peer_addresses(rule.destination_peer, rule.destination_peer_include_networks)
+
+    # Adiciona source_ip/destination_ip às listas, se definidos
+    if rule.source_ip:
+        source_addresses.append(f"{rule.source_ip}/{rule.source_netmask}")
+    if rule.destination_ip:
+        destination_addresses.append(f"{rule.destination_ip}/{rule.destination_netmask}")
+    return source_addresses, destination_addresses
+
+
+def get_rule_ipset_members(addresses):
+    """Return the addresses that belong in an ipset, or None if a single inline match is enough."""
+    members = [address for address in addresses if "Missing IP for selected peer:" not in address]
+    if len(members) > 1:
+        return list(dict.fromkeys(members))
+    return None
+
+
+def get_instance_ipset_members(wireguard_instance):
+    """Return the members a single instance adds to the instance ipsets, without the networks routed to its peers."""
+    network = ipaddress.ip_network(f"{wireguard_instance.address}/{wireguard_instance.netmask}", strict=False)
+    return {
+        'wgwadm_instance_addresses': [f"{wireguard_instance.address}/32"],
+        'wgwadm_instance_networks': [str(network)],
+        'wgwadm_instance_p2p': [f"{network},wg{wireguard_instance.instance_id}"],
+    }
+
+
+def export_instance_ipsets(wireguard_instances=None):
+    """
+    Return the ipsets describing the WireGuard instances.
+
+    A single set match replaces the per instance DNS redirect and peer to peer rules, so adding an
+    instance only changes set membership. 'wgwadm_instance_p2p' pairs each instance network, and the
+    networks routed to its peers, with the instance interface. Unless the instances are given, the
+    pooled slots are included as well, so claiming one does not change the firewall.
+    """
+    pooled_members = []
+    if wireguard_instances is None:
+        wireguard_instances = list(WireGuardInstance.objects.all().order_by('instance_id'))
+        pooled_members = list(PooledInstance.objects.order_by('instance_id').values_list('firewall_ipsets', flat=True))
+    instance_members = [get_instance_ipset_members(wireguard_instance) for wireguard_instance in wireguard_instances]
+    instance_members += pooled_members
+    instance_addresses = [member for members in instance_members for member in members.get('wgwadm_instance_addresses', [])]
+    instance_networks = [member for members in instance_members for member in members.get('wgwadm_instance_networks', [])]
+    instance_peer_to_peer = [member for members in instance_members for member in members.get('wgwadm_instance_p2p', [])]
+
+    routed_networks = PeerAllowedIP.objects.filter(
+        config_file='server', priority__gt=0, peer__wireguard_instance__in=wireguard_instances
+    ).values_list('peer__wireguard_instance__instance_id', 'allowed_ip', 'netmask')
+    for instance_id, allowed_ip, netmask in routed_networks:
+        network = ipaddress.ip_network(f"{allowed_ip}/{netmask}", strict=False)
+        instance_peer_to_peer.append(f"{network},wg{instance_id}")
+
+    return {
+        'wgwadm_instance_addresses': instance_addresses,
+        'wgwadm_instance_networks': list(dict.fromkeys(instance_networks)),
+        'wgwadm_instance_p2p': list(dict.fromkeys(instance_peer_to_peer)),
+    }
+
+
+def export_firewall_ipsets(rules=None, wireguard_instances=None):
+    """
+    Return {ipset name: [members]} for the instance sets and for every rule side that matches more
+    than one address.
+    """
+    if rules is None:
+        rules = get_firewall_rules()
+    firewall_ipsets = export_instance_ipsets(wireguard_instances)
+    for rule in rules:
+        source_addresses, destination_addresses = get_rule_addresses(rule)
+        source_members = get_rule_ipset_members(source_addresses)
+        destination_members = get_rule_ipset_members(destination_addresses)
+        if source_members:
+            firewall_ipsets[get_firewall_ipset_name(rule, 'src')] = source_members
+        if destination_members:
+            firewall_ipsets[get_firewall_ipset_name(rule, 'dst')] = destination_members
+    return firewall_ipsets
+
+
+def generate_ipset_restore_payload(firewall_ipsets):
+    """
+    Generate an 'ipset restore' payload that refreshes every set atomically.
+
+    Members are loaded into a temporary set which is then swapped with the live one, so a rule never
+    sees a partially filled set.
+    """
+    payload = ''
+    for ipset_name, members in firewall_ipsets.items():
+        temporary_name = f"{ipset_name}_tmp"
+        ipset_type = FIREWALL_IPSET_TYPES.get(ipset_name, 'hash:net')
+        payload += f"create {ipset_name} {ipset_type} -exist\n"
+        payload += f"create {temporary_name} {ipset_type} -exist\n"
+        payload += f"flush {temporary_name}\n"
+        for member in members:
+            payload += f"add {temporary_name} {member} -exist\n"
+        payload += f"swap {temporary_name} {ipset_name}\n"
+        payload += f"destroy {temporary_name}\n"
+    return payload
+
+
+def sync_firewall_ipsets(rules=None, firewall_settings=None, firewall_ipsets=None):
+    """
+    Refresh the membership of the firewall ipsets without touching the iptables chains.
+
+    Callers that already compiled the firewall pass its settings and ipsets, so nothing is loaded twice.
+    Returns True when the sets were updated.
+    """
+    if firewall_settings is None:
+        firewall_settings, firewall_settings_created = FirewallSettings.objects.get_or_create(name='global')
+    if firewall_settings.firewall_backend != 'iptables' or not shutil.which('ipset'):
+        return False
+    if firewall_ipsets is None:
+        firewall_ipsets = export_firewall_ipsets(rules)
+    payload = generate_ipset_restore_payload(firewall_ipsets)
+    if not payload:
+        return False
+    try:
+        subprocess.run(['ipset', 'restore', '-exist'], input=payload, capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Failed to update firewall ipsets: {e.stderr}")
+        return False
+    return True
+
+
+def add_firewall_ipset_members(firewall_ipsets, firewall_settings=None):
+    """
+    Add members to the live firewall ipsets without rebuilding them, e.g. the members of a claimed pooled
+    slot. Returns False when the sets are not used (nftables backend, no ipset) or could not be updated.
+    """
+    if firewall_settings is None:
+        firewall_settings, firewall_settings_created = FirewallSettings.objects.get_or_create(name='global')
+    if firewall_settings.firewall_backend != 'iptables' or not shutil.which('ipset'):
+        return False
+    payload = ''.join(
+        f"add {ipset_name} {member} -exist\n" for ipset_name, members in firewall_ipsets.items() for member in members
+    )
+    if not payload:
+        return False
+    try:
+        subprocess.run(['ipset', 'restore', '-exist'], input=payload, capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Failed to add firewall ipset members: {e.stderr}")
+        return False
+    return True
+
+
+def export_user_firewall(rules=None):
     iptables_rules = []
-    rules = FirewallRule.objects.all().order_by('firewall_chain', 'sort_order')
+    if rules is None:
+        rules = get_firewall_rules()
 
     for rule in rules:
-        source_addresses = get_peer_addresses(rule.source_peer, rule.source_peer_include_networks)
-        destination_addresses = get_peer_addresses(rule.destination_peer, rule.destination_peer_include_networks)
-
-        # Adiciona source_ip/destination_ip às listas, se definidos
-        if rule.source_ip:
-            source_addresses.append(f"{rule.source_ip}/{rule.source_netmask}")
-        if rule.destination_ip:
-            destination_addresses.append(f"{rule.destination_ip}/{rule.destination_netmask}")
+        source_addresses, destination_addresses = get_rule_addresses(rule)
+
+        # Peer selections with more than one address are matched through an ipset instead of one rule per address
+        if get_rule_ipset_members(source_addresses):
+            source_addresses = [f"ipset:{get_firewall_ipset_name(rule, 'src')}"] + [
+                address for address in source_addresses if "Missing IP for selected peer:" in address
+            ]
+        if get_rule_ipset_members(destination_addresses):
+            destination_addresses = [f"ipset:{get_firewall_ipset_name(rule, 'dst')}"] + [
+                address for address in destination_addresses if "Missing IP for selected peer:" in address
+            ]
 
         # Caso especial: se não houver endereços de source e destination, cria uma lista vazia para garantir a execução do loop
         if not source_addresses:
@@ -115,8 +321,6 @@ def export_user_firewall():
                         rule_base = f"#iptables -A {rule.firewall_chain.upper()} "
                     rule_protocol = f"-p {protocol} " if protocol else ""
                     rule_destination_port = f"--dport {rule.destination_port} " if rule.destination_port else ""
-                    rule_source = f"-s {source} " if source else ""
-                    rule_destination = f"-d {destination} " if destination else ""
                     rule_action = f"-j {rule.rule_action.upper()}"
                     rule_in_interface = f"-i {rule.in_interface} " if rule.in_interface else ""
                     rule_out_interface = f"-o {rule.out_interface} " if rule.out_interface else ""
@@ -138,6 +342,17 @@ def export_user_firewall():
 
                     not_source = "! " if rule.not_source and source else ""
                     not_destination = "! " if rule.not_destination and destination else ""
+
+                    if source and source.startswith("ipset:"):
+                        rule_source = f"-m set {not_source}--match-set {source[6:]} src "
+                        not_source = ""
+                    else:
+                        rule_source = f"-s {source} " if source else ""
+                    if destination and destination.startswith("ipset:"):
+                        rule_destination = f"-m set {not_destination}--match-set {destination[6:]} dst "
+                        not_destination = ""
+                    else:
+                        rule_destination = f"-d {destination} " if destination else ""
                     
                     iptables_rule = f"{comment}{rule_base}{rule_in_interface}{rule_out_interface}{not_source}{rule_source}{not_destination}{rule_destination}{rule_state}{rule_protocol}{rule_destination_port}{rule_action}\n"
                     iptables_rules.append(iptables_rule)
@@ -145,21 +360,21 @@ def export_user_firewall():
     return "".join(iptables_rules)
 
 
-def generate_redirect_dns_rules():
-    wireguard_instance_list = WireGuardInstance.objects.all()
-    firewall_settings, firewall_settings_created = FirewallSettings.objects.get_or_create(name='global')
-    dns_redirect_rules = ''
-    for wireguard_instance in wireguard_instance_list:
-        dns_redirect_rules += f"# DNS Redirect for instance wg{wireguard_instance.instance_id}\n"
-        dns_redirect_rules += f"iptables -t nat -A WGWADM_PREROUTING  -i wg{wireguard_instance.instance_id} -d {wireguard_instance.address} -p udp --dport 53 -j DNAT --to $DNS_IP:53\n"
-        dns_redirect_rules += f"iptables -t nat -A WGWADM_PREROUTING  -i wg{wireguard_instance.instance_id} -d {wireguard_instance.address} -p tcp --dport 53 -j DNAT --to $DNS_IP:53\n"
-        dns_redirect_rules += f"iptables -t nat -A WGWADM_POSTROUTING -i wg{wireguard_instance.instance_id} -o {firewall_settings.wan_interface} -d $DNS_IP -j MASQUERADE\n"
-        dns_redirect_rules += f"iptables -t filter -A WGWADM_FORWARD  -i wg{wireguard_instance.instance_id} -o {firewall_settings.wan_interface} -d $DNS_IP -j ACCEPT\n"
+def generate_redirect_dns_rules(firewall_settings=None):
+    if firewall_settings is None:
+        firewall_settings, firewall_settings_created = FirewallSettings.objects.get_or_create(name='global')
+    # The instance addresses and networks come from the instance ipsets, so these rules never change
+    # when instances are added or removed
+    dns_redirect_rules = "# DNS Redirect for all instances\n"
+    dns_redirect_rules += "iptables -t nat -A WGWADM_PREROUTING  -i wg+ -m set --match-set wgwadm_instance_addresses dst -p udp --dport 53 -j DNAT --to $DNS_IP:53\n"
+    dns_redirect_rules += "iptables -t nat -A WGWADM_PREROUTING  -i wg+ -m set --match-set wgwadm_instance_addresses dst -p tcp --dport 53 -j DNAT --to $DNS_IP:53\n"
+    # POSTROUTING cannot match the input interface, so match the instance networks instead
+    dns_redirect_rules += f"iptables -t nat -A WGWADM_POSTROUTING -m set --match-set wgwadm_instance_networks src -o {firewall_settings.wan_interface} -d $DNS_IP -j MASQUERADE\n"
+    dns_redirect_rules += f"iptables -t filter -A WGWADM_FORWARD  -i wg+ -o {firewall_settings.wan_interface} -d $DNS_IP -j ACCEPT\n"
     return dns_redirect_rules
 
 
 def generate_firewall_header():
-    firewall_settings, firewall_settings_created = FirewallSettings.objects.get_or_create(name='global')
     header = f'''#!/bin/bash
 # Description: Firewall rules for WireGuard_WebAdmin
 # Do not edit this file directly. Use the web interface to manage firewall rules.
@@ -171,68 +386,299 @@ if [ -z "$DNS_IP" ]; then
     DNS_IP="127.0.0.250"
 fi
 
+# Remove the nftables backend table, if it was used before
+if command -v nft >> /dev/null 2>&1; then
+    nft delete table ip wgwadm >> /dev/null 2>&1
+fi
+
 iptables -t nat    -N WGWADM_POSTROUTING >> /dev/null 2>&1
 iptables -t nat    -N WGWADM_PREROUTING  >> /dev/null 2>&1
 iptables -t filter -N WGWADM_FORWARD     >> /dev/null 2>&1
 
+iptables -t nat    -C POSTROUTING -j WGWADM_POSTROUTING >> /dev/null 2>&1 || iptables -t nat    -I POSTROUTING -j WGWADM_POSTROUTING
+iptables -t nat    -C PREROUTING  -j WGWADM_PREROUTING  >> /dev/null 2>&1 || iptables -t nat    -I PREROUTING  -j WGWADM_PREROUTING
+iptables -t filter -C FORWARD     -j WGWADM_FORWARD     >> /dev/null 2>&1 || iptables -t filter -I FORWARD     -j WGWADM_FORWARD
+
+'''
+    return header
+
+
+def generate_firewall_base_rules():
+    return "iptables -t filter -A WGWADM_FORWARD -m state --state RELATED,ESTABLISHED -j ACCEPT\n"
+
+
+def parse_iptables_command(line):
+    """
+    Split a generated 'iptables' command into (table, action, chain, arguments).
+    Returns None for comments and anything that is not an iptables command.
+    """
+    tokens = line.split()
+    if not tokens or tokens[0] != 'iptables':
+        return None
+    table = 'filter'
+    if len(tokens) > 2 and tokens[1] == '-t':
+        table = tokens[2]
+        tokens = tokens[3:]
+    else:
+        tokens = tokens[1:]
+    if len(tokens) < 2 or tokens[0] not in ('-A', '-P'):
+        return None
+    return table, tokens[0], tokens[1], " ".join(tokens[2:])
+
+
+def get_dns_ip():
+    """Resolve the DNS container address the same way the generated firewall script does."""
+    try:
+        return socket.gethostbyname('wireguard-webadmin-dns')
+    except OSError:
+        return '127.0.0.250'
+
+
+def get_firewall_rule_tag(table, chain, arguments, dns_ip):
+    rule_text = f"{table} {chain} {' '.join(arguments.replace('$DNS_IP', dns_ip).split())}"
+    return hashlib.sha1(rule_text.encode()).hexdigest()[:16]
+
+
+def tag_firewall_rules(firewall_rules, dns_ip):
+    """
+    Add a 'wgwadm:<hash>' comment to every generated rule.
+
+    The hash identifies a rule by its content, so the live chains can be compared with the compiled
+    rules without reproducing the iptables canonical rule format.
+    """
+    tagged_rules = []
+    for line in firewall_rules.splitlines():
+        parsed_command = parse_iptables_command(line)
+        if parsed_command and parsed_command[1] == '-A':
+            table, action, chain, arguments = parsed_command
+            tag = get_firewall_rule_tag(table, chain, arguments, dns_ip)
+            line = f"iptables -t {table} -A {chain} -m comment --comment wgwadm:{tag} {arguments}"
+        tagged_rules.append(line)
+    return "\n".join(tagged_rules) + "\n"
+
+
+def read_live_chain(table, chain):
+    """
+    Return the rules of a chain as a list of keys (the rule tag, or the full line for untagged rules) and
+    the chain policy, or None if the chain cannot be read.
+    """
+    try:
+        result = subprocess.run(['iptables', '-t', table, '-S', chain], capture_output=True, text=True, check=True)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+    rule_keys = []
+    policy = None
+    for line in result.stdout.splitlines():
+        if line.startswith('-P '):
+            policy = line.split()[2]
+        elif line.startswith('-A '):
+            tag_match = FIREWALL_RULE_TAG_REGEX.search(line)
+            rule_keys.append(tag_match.group(1) if tag_match else line)
+    return rule_keys, policy
+
+
+def generate_firewall_diff_payload(firewall_rules, dns_ip):
+    """
+    Compare the compiled rules with the live WGWADM_* chains and return an iptables-restore payload that
+    only deletes and inserts the rules that differ.
+
+    Returns '' when the live chains already match, or None when the live state cannot be read.
+    """
+    desired = {table: {chain: [] for chain in chains} for table, chains in FIREWALL_CHAINS.items()}
+    policies = {table: {} for table in FIREWALL_CHAINS}
+    for line in tag_firewall_rules(firewall_rules, dns_ip).splitlines():
+        parsed_command = parse_iptables_command(line)
+        if not parsed_command or parsed_command[0] not in FIREWALL_CHAINS:
+            continue
+        table, action, chain, arguments = parsed_command
+        if action == '-P':
+            policies[table][chain] = arguments
+        elif chain in desired[table]:
+            tag = FIREWALL_RULE_TAG_REGEX.search(arguments).group(1)
+            desired[table][chain].append((tag, arguments.replace('$DNS_IP', dns_ip)))
+
+    payload = ''
+    for table, chains in desired.items():
+        table_commands = []
+        for chain, policy in policies[table].items():
+            live_chain = read_live_chain(table, chain)
+            if live_chain is None:
+                return None
+            if live_chain[1] != policy:
+                table_commands.append(f":{chain} {policy} [0:0]")
+        for chain, desired_rules in chains.items():
+            live_chain = read_live_chain(table, chain)
+            if live_chain is None:
+                return None
+            live_keys = live_chain[0]
+            desired_keys = [tag for tag, arguments in desired_rules]
+            opcodes = difflib.SequenceMatcher(None, live_keys, desired_keys, autojunk=False).get_opcodes()
+            # Walk backwards so the rule numbers of the earlier opcodes stay valid
+            for opcode, live_start, live_end, desired_start, desired_end in reversed(opcodes):
+                if opcode in ('delete', 'replace'):
+                    for live_index in range(live_end, live_start, -1):
+                        table_commands.append(f"-D {chain} {live_index}")
+                if opcode in ('insert', 'replace'):
+                    for offset, desired_index in enumerate(range(desired_start, desired_end)):
+                        table_commands.append(f"-I {chain} {live_start + offset + 1} {desired_rules[desired_index][1]}")
+        if table_commands:
+            payload += f"*{table}\n" + "\n".join(table_commands) + "\nCOMMIT\n"
+    return payload
+
+
+def apply_firewall_diff(firewall_rules, firewall_ipsets=None, firewall_settings=None):
+    """
+    Apply the compiled iptables rules by changing only the rules that differ from the live chains.
+
+    Existing traffic never sees the chains without their rules, and the apply time follows the size of
+    the change instead of the size of the ruleset. Returns False when the differential apply is not
+    possible and the full firewall script must be used instead.
+    """
+    if not shutil.which('iptables-restore'):
+        return False
+    if firewall_ipsets is None:
+        firewall_ipsets = export_firewall_ipsets()
+    if firewall_ipsets and not sync_firewall_ipsets(firewall_settings=firewall_settings, firewall_ipsets=firewall_ipsets):
+        return False
+    payload = generate_firewall_diff_payload(firewall_rules, get_dns_ip())
+    if payload is None:
+        return False
+    if not payload:
+        logger.info("Firewall rules already up to date")
+        return True
+    try:
+        subprocess.run(['iptables-restore', '--noflush'], input=payload, capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Failed to apply firewall rule changes: {e.stderr}")
+        return False
+    changes = [line for line in payload.splitlines() if line.startswith(('-D ', '-I ', ':'))]
+    logger.info(f"Applied {len(changes)} firewall rule changes")
+    return True
+
+
+def generate_iptables_restore_payload(firewall_rules):
+    """
+    Convert generated iptables commands into an iptables-restore payload for the WGWADM_* chains.
+
+    Declaring the WGWADM_* chains makes 'iptables-restore --noflush' flush and refill them in a single
+    commit per table, while every other chain is left untouched.
+    """
+    chains = FIREWALL_CHAINS
+    policies = {table: {} for table in chains}
+    rules = {table: [] for table in chains}
+
+    for line in firewall_rules.splitlines():
+        parsed_command = parse_iptables_command(line)
+        if not parsed_command:
+            continue
+        table, action, chain, arguments = parsed_command
+        if table not in chains:
+            continue
+        if action == '-P':
+            policies[table][chain] = arguments
+        else:
+            rules[table].append(f"-A {chain} {arguments}")
+
+    payload = ''
+    for table in chains:
+        payload += f"*{table}\n"
+        for chain, policy in policies[table].items():
+            payload += f":{chain} {policy} [0:0]\n"
+        for chain in chains[table]:
+            payload += f":{chain} - [0:0]\n"
+        payload += "\n".join(rules[table]) + "\n" if rules[table] else ""
+        payload += "COMMIT\n"
+    return payload
+
+
+def generate_firewall_apply(firewall_rules, firewall_ipsets=None):
+    """
+    Generate the part of the firewall script that applies the rules.
+
+    The ipsets referenced by the rules are refreshed first. The rules are then applied atomically with
+    'iptables-restore --noflush'. If that fails, the chains are flushed and the same rules are applied
+    one command at a time. Sets no longer referenced by any rule are destroyed at the end.
+    """
+    firewall_rules = tag_firewall_rules(firewall_rules, get_dns_ip())
+    firewall_apply = ''
+    if firewall_ipsets:
+        firewall_apply += '''ipset restore -exist << WGWADM_IPSET_RESTORE
+'''
+        firewall_apply += generate_ipset_restore_payload(firewall_ipsets)
+        firewall_apply += '''WGWADM_IPSET_RESTORE
+
+'''
+    firewall_apply += '''apply_firewall_fallback() {
 iptables -t nat    -F WGWADM_POSTROUTING
 iptables -t nat    -F WGWADM_PREROUTING
 iptables -t filter -F WGWADM_FORWARD
 
-iptables -t nat    -D POSTROUTING -j WGWADM_POSTROUTING >> /dev/null 2>&1
-iptables -t nat    -D PREROUTING  -j WGWADM_PREROUTING  >> /dev/null 2>&1
-iptables -t filter -D FORWARD     -j WGWADM_FORWARD     >> /dev/null 2>&1
-
-iptables -t nat    -I POSTROUTING -j WGWADM_POSTROUTING
-iptables -t nat    -I PREROUTING  -j WGWADM_PREROUTING
-iptables -t filter -I FORWARD     -j WGWADM_FORWARD
+'''
+    firewall_apply += firewall_rules
+    firewall_apply += '''}
 
-iptables -t filter -A WGWADM_FORWARD -m state --state RELATED,ESTABLISHED -j ACCEPT
+if command -v iptables-restore >> /dev/null 2>&1 && iptables-restore --noflush << WGWADM_IPTABLES_RESTORE
 '''
-    return header
+    firewall_apply += generate_iptables_restore_payload(firewall_rules)
+    firewall_apply += '''WGWADM_IPTABLES_RESTORE
+then
+    echo "Firewall rules applied with iptables-restore"
+else
+    echo "iptables-restore failed, applying firewall rules one by one"
+    apply_firewall_fallback
+fi
+'''
+    firewall_apply += f'''
+if command -v ipset >> /dev/null 2>&1; then
+    for ipset_name in $(ipset list -n | grep '^wgwadm_'); do
+        case " {' '.join(firewall_ipsets or [])} " in
+            *" $ipset_name "*) ;;
+            *) ipset destroy "$ipset_name" >> /dev/null 2>&1 ;;
+        esac
+    done
+fi
+'''
+    return firewall_apply
 
 
-def generate_firewall_footer():
-    firewall_settings, firewall_settings_created = FirewallSettings.objects.get_or_create(name='global')
+def generate_firewall_footer(firewall_settings=None):
+    if firewall_settings is None:
+        firewall_settings, firewall_settings_created = FirewallSettings.objects.get_or_create(name='global')
     deny_policy = 'REJECT'
     if firewall_settings.default_forward_policy == 'drop':
         deny_policy = 'DROP'
+    peer_to_peer_action = 'ACCEPT' if firewall_settings.allow_peer_to_peer else deny_policy
+    instance_to_instance_action = 'ACCEPT' if firewall_settings.allow_instance_to_instance else deny_policy
+
+    # Chain policies only accept ACCEPT or DROP, so a REJECT default is an explicit final rule
+    forward_policy = 'DROP' if firewall_settings.default_forward_policy == 'drop' else 'ACCEPT'
 
     footer = '# The following rules come from Firewall settings\n'
     footer += '# Default FORWARD policy\n'
-    footer += f'iptables -t filter -P FORWARD {firewall_settings.default_forward_policy.upper()}\n'
-
-    footer += '# Same instance Peer to Peer traffic\n'
-    # Generate rules for instances in database - respect per-instance settings
-    for wireguard_instance in WireGuardInstance.objects.all().order_by('instance_id'):
-        # Check both global setting AND instance-specific setting
-        # Instance setting takes precedence over global setting
-        # Note: allow_peer_to_peer field was removed from WireGuardInstance model
-        # Using only global firewall setting for now
-        allow_p2p = firewall_settings.allow_peer_to_peer
-        footer += f'iptables -t filter -A WGWADM_FORWARD -i wg{wireguard_instance.instance_id} -o wg{wireguard_instance.instance_id} -j '
-        footer += 'ACCEPT\n' if allow_p2p else deny_policy + "\n"
-    
-    # FIX: Also generate rules for common WireGuard interfaces that might exist at system level
-    # This ensures peer-to-peer works even if instances aren't in the database
-    # Only apply global setting for system-level interfaces
-    if firewall_settings.allow_peer_to_peer:
-        footer += '# Additional peer-to-peer rules for system-level interfaces (global setting)\n'
-        # Generate rules for wg0-wg9 (common range) - only if global setting allows it
-        for i in range(10):
-            footer += f'iptables -t filter -A WGWADM_FORWARD -i wg{i} -o wg{i} -j ACCEPT\n'
-    footer += '# Instance to Instance traffic\n'
-    footer += 'iptables -t filter -A WGWADM_FORWARD -i wg+ -o wg+ -j '
-    footer += 'ACCEPT\n' if firewall_settings.allow_instance_to_instance else deny_policy + "\n"
+    footer += f'iptables -t filter -P FORWARD {forward_policy}\n'
+
+    if peer_to_peer_action != instance_to_instance_action:
+        # Traffic leaving through the interface of the instance it came from, matched with the instance ipset
+        footer += '# Same instance Peer to Peer traffic\n'
+        footer += f'iptables -t filter -A WGWADM_FORWARD -i wg+ -o wg+ -m set --match-set wgwadm_instance_p2p src,dst -j {peer_to_peer_action}\n'
+        footer += '# Instance to Instance traffic\n'
+    else:
+        footer += '# Same instance Peer to Peer and Instance to Instance traffic\n'
+    footer += f'iptables -t filter -A WGWADM_FORWARD -i wg+ -o wg+ -j {instance_to_instance_action}\n'
+    if firewall_settings.default_forward_policy == 'reject':
+        footer += '# Default FORWARD policy\n'
+        footer += 'iptables -t filter -A WGWADM_FORWARD -j REJECT\n'
     return footer
 
 
-def generate_port_forward_firewall():
-    firewall_settings, firewall_settings_created = FirewallSettings.objects.get_or_create(name='global')
+def generate_port_forward_firewall(firewall_settings=None):
+    if firewall_settings is None:
+        firewall_settings, firewall_settings_created = FirewallSettings.objects.get_or_create(name='global')
     redirect_firewall = ''
     wan_interface = firewall_settings.wan_interface
 
-    for redirect_rule in RedirectRule.objects.all().order_by('port'):
+    redirect_rules, peer_destinations = get_redirect_rules()
+    for redirect_rule in redirect_rules:
         description = f" - {redirect_rule.description} " if redirect_rule.description else ""
         rule_destination = redirect_rule.ip_address
         try:
@@ -243,10 +689,8 @@ def generate_port_forward_firewall():
         except:
             destination_port = redirect_rule.port
 
-        if redirect_rule.peer:
-            peer_allowed_ip_address = PeerAllowedIP.objects.filter(peer=redirect_rule.peer, config_file='server', netmask=32, priority=0).first()
-            if peer_allowed_ip_address:
-                rule_destination = peer_allowed_ip_address.allowed_ip
+        if redirect_rule.peer_id:
+            rule_destination = peer_destinations.get(redirect_rule.peer_id, rule_destination)
         if rule_destination:
             rule_text =  f"# {redirect_rule.port}/{redirect_rule.protocol} - {redirect_rule.uuid} - Port Forward Rule set{description}\n"
             rule_text += f"iptables -t nat    -A WGWADM_PREROUTING  -p {redirect_rule.protocol} -d wireguard-webadmin -i {wan_interface} --dport {redirect_rule.port} -j DNAT --to-dest {rule_destination}:{destination_port}\n"
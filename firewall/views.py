@@ -5,6 +5,7 @@ from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.utils.translation import gettext_lazy as _
 
+from firewall.benchmark import run_firewall_benchmark
 from firewall.forms import FirewallRuleForm, FirewallSettingsForm, RedirectRuleForm
 from firewall.models import FirewallRule, FirewallSettings, RedirectRule
 from firewall.tools import reset_firewall_to_default
@@ -222,4 +223,18 @@ def view_firewall_migration_required(request):
     if not UserAcl.objects.filter(user=request.user).filter(user_level__gte=40).exists():
         return render(request, 'access_denied.html', {'page_title': 'Access Denied'})
     
-    return render(request, 'firewall/firewall_migration_required.html')
\ No newline at end of file
+    return render(request, 'firewall/firewall_migration_required.html')
+
+
+@login_required
+def view_firewall_benchmark(request):
+    if not UserAcl.objects.filter(user=request.user).filter(user_level__gte=50).exists():
+        return render(request, 'access_denied.html', {'page_title': 'Access Denied'})
+    test_apply = request.GET.get('test_apply') == '1'
+    report = run_firewall_benchmark(test_apply=test_apply)
+    for backend in ('iptables', 'nftables'):
+        report[backend]['compile_milliseconds'] = report[backend]['compile_seconds'] * 1000
+        if report[backend]['test_apply_seconds'] is not None:
+            report[backend]['test_apply_milliseconds'] = report[backend]['test_apply_seconds'] * 1000
+    context = {'page_title': _('Firewall Benchmark'), 'report': report, 'test_apply': test_apply}
+    return render(request, 'firewall/firewall_benchmark.html', context=context)
@@ -0,0 +1,44 @@
+"""
+Gunicorn configuration used by init.sh.
+
+Worker and thread counts are derived from the CPU count and can be overridden with the WEB_* environment
+variables documented in env.example.
+"""
+import multiprocessing
+import os
+
+
+def env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+cpu_count = multiprocessing.cpu_count()
+
+wsgi_app = 'wireguard_webadmin.wsgi:application'
+bind = os.environ.get('WEB_BIND', '0.0.0.0:8000')
+
+# Threaded workers: most requests wait on the database or on wg/iptables subprocesses, so threads give
+# concurrency for the status and config download endpoints without a process per request. Each open
+# status stream holds a thread, hence the thread count. With DB_CONN_MAX_AGE > 0 every thread also keeps
+# a database connection open, see the connection budget in env.example.
+worker_class = 'gthread'
+workers = env_int('WEB_WORKERS', min(cpu_count * 2 + 1, 9))
+threads = env_int('WEB_THREADS', 8)
+
+timeout = env_int('WEB_TIMEOUT', 120)
+graceful_timeout = env_int('WEB_GRACEFUL_TIMEOUT', 30)
+keepalive = env_int('WEB_KEEPALIVE', 5)
+
+# Recycle workers periodically, with jitter so they do not all restart at once
+max_requests = env_int('WEB_MAX_REQUESTS', 2000)
+max_requests_jitter = max_requests // 10
+
+# The worker heartbeat file is written often, keep it off the container overlay filesystem
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+accesslog = '-' if os.environ.get('WEB_ACCESS_LOG', '').lower() == 'true' else None
+errorlog = '-'
+loglevel = os.environ.get('WEB_LOG_LEVEL', 'info')
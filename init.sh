@@ -125,4 +125,16 @@ EOF
 service dnsmasq start
 echo "[init] dnsmasq DNS server started"
 
-exec python manage.py runserver 0.0.0.0:8000
+# Provisioning worker for paid orders queued by the payment webhook
+nohup python manage.py process_provisioning_jobs > /var/log/provisioning_jobs.log 2>&1 &
+echo "[init] Background provisioning worker started"
+
+# Web server
+# DJANGO_RUNSERVER=true starts the Django development server (single process, auto reload) instead of gunicorn
+if [ "${DJANGO_RUNSERVER,,}" == "true" ]; then
+    echo "[init] Starting Django development server"
+    exec python manage.py runserver 0.0.0.0:8000
+fi
+
+echo "[init] Starting gunicorn"
+exec gunicorn --config /app/gunicorn.conf.py
@@ -1,4 +1,12 @@
 from django.contrib import admin
-from .models import PaymentToken
+from .models import PaymentToken, ProvisioningJob
 # Register your models here.
-admin.site.register(PaymentToken)
\ No newline at end of file
+admin.site.register(PaymentToken)
+
+
+class ProvisioningJobAdmin(admin.ModelAdmin):
+    list_display = ('payment_token', 'hostname', 'status', 'attempts', 'next_run_at', 'updated')
+    list_filter = ('status', 'hostname')
+    readonly_fields = ('created', 'updated')
+
+admin.site.register(ProvisioningJob, ProvisioningJobAdmin)
@@ -0,0 +1,81 @@
+"""
+Django management command running the provisioning jobs queued by the payment webhook.
+Only jobs of this node (VPN_HOSTNAME) are run, since the instance is created on the node that took the order.
+It also keeps the node's pool of pre-keyed instances (INSTANCE_POOL_SIZE) filled, rewrites the
+configuration files of interfaces whose peers were changed live with 'wg set' and checks the running
+state for drift every DRIFT_CHECK_INTERVAL seconds.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.views import get_vpn_hostname
+from orders.provisioning import process_provisioning_jobs
+from wgwadmlibrary.instance_allocation import refill_instance_pool
+from wireguard_tools.drift import reconcile_wireguard_drift
+from wireguard_tools.views import write_outdated_wireguard_configs
+
+# Seconds between pool checks while no job runs, a job that ran triggers a refill right away
+POOL_REFILL_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = 'Provision the instances of paid orders queued for this node, deliver the n8n callbacks, refill the instance pool, write outdated WireGuard configs and check for drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run the jobs that are due and exit',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2,
+            help='Seconds between checks for new jobs (default: 2)',
+        )
+
+    def handle(self, *args, **options):
+        hostname = get_vpn_hostname()
+        if options['once']:
+            processed = process_provisioning_jobs(hostname)
+            pooled = refill_instance_pool(hostname) if settings.INSTANCE_POOL_SIZE else 0
+            write_outdated_wireguard_configs()
+            self.stdout.write(self.style.SUCCESS(
+                f'Ran {processed} provisioning jobs and added {pooled} pooled instances for {hostname}'
+            ))
+            return
+
+        self.stdout.write(f'Waiting for provisioning jobs for {hostname}')
+        next_refill = 0
+        next_drift_check = 0
+        while True:
+            # Drop connections closed by the server or older than CONN_MAX_AGE, as a request would
+            close_old_connections()
+            try:
+                processed = process_provisioning_jobs(hostname)
+            except Exception as e:
+                processed = 0
+                self.stderr.write(f'Error running provisioning jobs: {e}')
+
+            if settings.INSTANCE_POOL_SIZE and (processed or time.monotonic() >= next_refill):
+                try:
+                    refill_instance_pool(hostname)
+                except Exception as e:
+                    self.stderr.write(f'Error refilling the instance pool: {e}')
+                next_refill = time.monotonic() + POOL_REFILL_INTERVAL
+
+            try:
+                write_outdated_wireguard_configs()
+            except Exception as e:
+                self.stderr.write(f'Error writing outdated WireGuard configs: {e}')
+
+            if settings.DRIFT_CHECK_INTERVAL and time.monotonic() >= next_drift_check:
+                try:
+                    reconcile_wireguard_drift(hostname, heal=settings.DRIFT_SELF_HEAL)
+                except Exception as e:
+                    self.stderr.write(f'Error checking for drift: {e}')
+                next_drift_check = time.monotonic() + settings.DRIFT_CHECK_INTERVAL
+            time.sleep(options['interval'])
@@ -0,0 +1,35 @@
+# Generated by Django 5.2 on 2026-10-19 15:57
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProvisioningJob',
+            fields=[
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('hostname', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('provisioned', 'Provisioned, callback pending'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_run_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('instance_uuid', models.UUIDField(blank=True, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('payment_token', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='provisioning_job', to='orders.paymenttoken')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hostname', 'status', 'next_run_at'], name='orders_prov_hostnam_7092be_idx')],
+            },
+        ),
+    ]
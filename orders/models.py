@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 import uuid
 
 # Create your models here.
@@ -15,3 +16,38 @@ class PaymentToken(models.Model):
     
     def __str__(self):
         return f"{self.email} - {self.token}"
+
+
+class ProvisioningJob(models.Model):
+    """
+    Background provisioning of the instance paid with a PaymentToken.
+
+    The payment webhook only creates the job, the 'process_provisioning_jobs' worker of the node named in
+    'hostname' creates the instance, user and ACL, then delivers the n8n callback. There is one job per
+    payment token, so a repeated webhook or a retried job never provisions twice.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('provisioned', 'Provisioned, callback pending'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+
+    uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    payment_token = models.OneToOneField(PaymentToken, on_delete=models.CASCADE, related_name='provisioning_job')
+    hostname = models.CharField(max_length=255)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_run_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    instance_uuid = models.UUIDField(null=True, blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['hostname', 'status', 'next_run_at'])]
+
+    def __str__(self):
+        return f"{self.payment_token.email} - {self.status}"
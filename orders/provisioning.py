@@ -0,0 +1,214 @@
+import logging
+import uuid
+import zlib
+from datetime import timedelta
+
+import requests
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from user_manager.models import UserAcl
+from wireguard.models import PeerGroup
+from .models import PaymentToken, ProvisioningJob
+
+logger = logging.getLogger(__name__)
+
+PROVISIONING_CALLBACK_URL = "https://n8n.portbro.com/webhook/13f687ba-4315-4d38-ac6e-d7d2b41f6112"
+PROVISIONING_CALLBACK_TIMEOUT = 10
+PROVISIONING_MAX_ATTEMPTS = 8
+# Seconds before the first retry, doubled on every attempt up to PROVISIONING_MAX_RETRY_DELAY
+PROVISIONING_RETRY_DELAY = 15
+PROVISIONING_MAX_RETRY_DELAY = 900
+# A job claimed by a worker that died is picked up again once its lease expires
+PROVISIONING_LEASE_SECONDS = 300
+# First key of the PostgreSQL advisory locks serializing the webhooks of one email, the second is its crc32
+PROVISIONING_ORDER_LOCK_ID = 0x77670002
+
+
+class ProvisioningRejected(Exception):
+    """The order cannot be provisioned and retrying would not change that."""
+
+
+def lock_order_email(email):
+    """
+    Serialize the payment webhooks of one email until the current transaction ends.
+
+    On PostgreSQL this takes a transaction level advisory lock, shared by every node using the database,
+    so concurrent webhooks for the same order see each other's job. Other databases are not serialized.
+    """
+    if connection.vendor == 'postgresql':
+        # Both keys are signed 32 bit integers
+        email_key = zlib.crc32(email.encode())
+        if email_key >= 2 ** 31:
+            email_key -= 2 ** 32
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [PROVISIONING_ORDER_LOCK_ID, email_key])
+
+
+def enqueue_provisioning_job(email, user_count):
+    """
+    Create the payment token and provisioning job for an order.
+
+    A repeated webhook for an order that is still being provisioned gets the existing job back instead of a
+    second token, also when both arrive at the same time. Returns (job, created).
+    """
+    from api.views import get_vpn_hostname
+
+    with transaction.atomic():
+        lock_order_email(email)
+        job = ProvisioningJob.objects.select_related('payment_token').filter(
+            payment_token__email=email, status__in=('pending', 'provisioned')
+        ).first()
+        if job:
+            return job, False
+
+        payment_token = PaymentToken.objects.create(
+            email=email,
+            expires_at=timezone.now() + timedelta(days=7),
+            user_count=int(user_count),
+            password=str(uuid.uuid4()),
+        )
+        job = ProvisioningJob.objects.create(payment_token=payment_token, hostname=get_vpn_hostname())
+    return job, True
+
+
+def setup_payment_token_instance(payment_token):
+    """
+    Create the WireGuard instance, user account, peer group and UserAcl paid with a payment token and
+    mark the token as used. Call inside a transaction with the token locked. Returns (user, instance).
+    """
+    from api.views import create_customer_instance
+
+    username = payment_token.email
+    if payment_token.is_used:
+        raise ProvisioningRejected('This payment token has already been used')
+    if User.objects.filter(username=username).exists():
+        raise ProvisioningRejected(f'User {username} already exists')
+
+    instance = create_customer_instance(payment_token.email, payment_token.user_count)
+
+    user = User.objects.create_user(
+        username=username,
+        email=payment_token.email,
+        password=payment_token.password
+    )
+
+    peer_group, created = PeerGroup.objects.get_or_create(name=f"{username}_group")
+    peer_group.server_instance.add(instance)
+
+    # Peer manager level
+    user_acl = UserAcl.objects.create(
+        user=user,
+        user_level=30,
+        enable_reload=True,
+        enable_restart=True,
+        enable_console=True
+    )
+    user_acl.peer_groups.add(peer_group)
+
+    payment_token.is_used = True
+    payment_token.save(update_fields=['is_used'])
+
+    logger.info(f"Set up wg{instance.instance_id} for user {username}")
+    return user, instance
+
+
+def provision_payment_token(job):
+    """
+    Provision the instance paid with the job's token.
+
+    Everything, including the job moving to 'provisioned', is written in one transaction, so a failed
+    attempt leaves nothing behind and a retry starts from scratch. Once committed, the interface is
+    brought up, from the ready configuration when the instance was claimed from the pool.
+    """
+    from wireguard_tools.views import reload_wireguard_instance
+
+    with transaction.atomic():
+        payment_token = PaymentToken.objects.select_for_update().get(pk=job.payment_token_id)
+        user, instance = setup_payment_token_instance(payment_token)
+
+        # The callback gets its own retries
+        job.status = 'provisioned'
+        job.instance_uuid = instance.uuid
+        job.attempts = 0
+        job.last_error = ''
+        job.save(update_fields=['status', 'instance_uuid', 'attempts', 'last_error', 'updated'])
+
+    # The instance keeps pending changes when this fails, a manual reload brings it up
+    success, message = reload_wireguard_instance(instance, getattr(instance, 'pooled_instance', None))
+    if not success:
+        logger.error(f"Provisioned wg{instance.instance_id} for {payment_token.email} but could not bring it up: {message}")
+    return instance
+
+
+def send_provisioning_callback(email):
+    """Notify n8n that the user's instance is ready. Raises on failure so the job is retried."""
+    response = requests.post(PROVISIONING_CALLBACK_URL, json={'email': email}, timeout=PROVISIONING_CALLBACK_TIMEOUT)
+    if response.status_code != 200:
+        raise RuntimeError(f"n8n webhook returned {response.status_code}")
+    logger.info(f"Successfully notified n8n webhook for user {email}")
+
+
+def claim_provisioning_job(hostname):
+    """
+    Claim the next due job of this node, or return None.
+
+    Claiming is a conditional UPDATE on the lease, so two workers sharing the database never run the
+    same job at the same time.
+    """
+    now = timezone.now()
+    unlocked = Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+    due_jobs = ProvisioningJob.objects.filter(
+        unlocked, hostname=hostname, status__in=('pending', 'provisioned'), next_run_at__lte=now
+    ).order_by('next_run_at').values_list('pk', flat=True)[:10]
+    for job_pk in due_jobs:
+        claimed = ProvisioningJob.objects.filter(unlocked, pk=job_pk).update(
+            locked_until=now + timedelta(seconds=PROVISIONING_LEASE_SECONDS), attempts=F('attempts') + 1, updated=now
+        )
+        if claimed:
+            return ProvisioningJob.objects.select_related('payment_token').get(pk=job_pk)
+    return None
+
+
+def run_provisioning_job(job):
+    """Run the next step of a claimed job and schedule a retry with exponential backoff if it fails."""
+    step = 'provision'
+    try:
+        if job.status == 'pending':
+            provision_payment_token(job)
+        step = 'callback'
+        send_provisioning_callback(job.payment_token.email)
+    except ProvisioningRejected as e:
+        logger.warning(f"Provisioning for {job.payment_token.email} rejected: {e}")
+        job.status = 'failed'
+        job.last_error = str(e)
+    except Exception as e:
+        logger.exception(f"Provisioning step '{step}' for {job.payment_token.email} failed (attempt {job.attempts})")
+        # The provisioning transaction may have been rolled back after the job was updated in memory
+        job.refresh_from_db(fields=['status', 'attempts'])
+        job.last_error = f"{step}: {e}"
+        if job.attempts >= PROVISIONING_MAX_ATTEMPTS:
+            job.status = 'failed'
+        else:
+            delay = min(PROVISIONING_RETRY_DELAY * 2 ** max(job.attempts - 1, 0), PROVISIONING_MAX_RETRY_DELAY)
+            job.next_run_at = timezone.now() + timedelta(seconds=delay)
+    else:
+        job.status = 'completed'
+        job.last_error = ''
+    job.locked_until = None
+    job.save(update_fields=['status', 'last_error', 'next_run_at', 'locked_until', 'updated'])
+    return job
+
+
+def process_provisioning_jobs(hostname, limit=None):
+    """Run due jobs of this node until none are left or 'limit' jobs ran. Returns the number of jobs run."""
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim_provisioning_job(hostname)
+        if job is None:
+            break
+        run_provisioning_job(job)
+        processed += 1
+    return processed
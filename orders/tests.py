@@ -1,3 +1,44 @@
-from django.test import TestCase
+import threading
+from unittest import skipUnless
 
-# Create your tests here.
+from django.db import connection
+from django.test import TransactionTestCase
+
+from .models import PaymentToken, ProvisioningJob
+from .provisioning import enqueue_provisioning_job
+
+
+class EnqueueProvisioningJobTest(TransactionTestCase):
+    """A repeated payment webhook gets the job of the first one back, even when both arrive together."""
+
+    email = 'customer@example.com'
+
+    def test_repeated_webhook_gets_the_same_job(self):
+        job, created = enqueue_provisioning_job(self.email, 5)
+        self.assertTrue(created)
+        repeated_job, created = enqueue_provisioning_job(self.email, 5)
+        self.assertFalse(created)
+        self.assertEqual(repeated_job.pk, job.pk)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Webhooks are serialized with PostgreSQL advisory locks')
+    def test_concurrent_webhooks_create_one_job(self):
+        barrier = threading.Barrier(4)
+        results = []
+
+        def receive_webhook():
+            barrier.wait()
+            try:
+                results.append(enqueue_provisioning_job(self.email, 5))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=receive_webhook) for index in range(barrier.parties)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([created for job, created in results].count(True), 1)
+        self.assertEqual(len({job.pk for job, created in results}), 1)
+        self.assertEqual(PaymentToken.objects.filter(email=self.email).count(), 1)
+        self.assertEqual(ProvisioningJob.objects.count(), 1)
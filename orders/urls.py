@@ -5,6 +5,7 @@ app_name = 'orders'
 urlpatterns = [
     path('', views.order_form, name='order_form'),
     path('processpaymentsuccess', views.process_payment_success, name='process_payment_success'),
+    path('provisioning/<uuid:job_uuid>/', views.provisioning_job_status, name='provisioning_job_status'),
     path('configure/<uuid:token>/', views.configure_instance, name='configure_instance'),
     path('success/', views.order_success, name='order_success'),
    
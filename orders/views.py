@@ -2,19 +2,16 @@ from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
-from datetime import timedelta
-from api.views import webhook_create_instance
-from django.http import JsonResponse, HttpRequest
+from django.db import transaction
+from django.http import JsonResponse
 from django.contrib.auth.models import User
-from user_manager.models import UserAcl
-from wireguard.models import WireGuardInstance, PeerGroup
-from .models import PaymentToken
+from wireguard.models import WireGuardInstance
+from .models import PaymentToken, ProvisioningJob
+from .provisioning import ProvisioningRejected, enqueue_provisioning_job, send_provisioning_callback, \
+    setup_payment_token_instance
 import json
 import logging
 import traceback
-import requests
-from django.contrib.auth import authenticate
-import uuid
 from django.conf import settings
 from django.core.exceptions import PermissionDenied
 from django.views.decorators.csrf import csrf_exempt
@@ -26,136 +23,11 @@ from .forms import OrderForm
 def order_form(request):
     return render(request, 'orders/order_form.html')
 
-def setup_instance_from_payment_token(payment_token):
-    """
-    Helper function to set up a VPN instance from a payment token.
-    Creates the WireGuard instance, user account, peer group, and UserAcl.
-    
-    Returns:
-        dict: Result with 'status' ('success' or 'error'), 'message', and optional 'user', 'instance' data
-    """
-    try:
-        username = payment_token.email
-        
-        # Check if user already exists
-        if User.objects.filter(username=username).exists():
-            logger.warning(f"User {username} already exists, skipping instance setup")
-            return {
-                'status': 'error',
-                'message': f'User {username} already exists'
-            }
-        
-        # Check if token is already used
-        if payment_token.is_used:
-            logger.warning(f"Payment token {payment_token.token} already used")
-            return {
-                'status': 'error',
-                'message': 'This payment token has already been used'
-            }
-        
-        # Create a mock request for webhook_create_instance
-        webhook_request = HttpRequest()
-        webhook_request.method = 'GET'
-        webhook_request.GET = {
-            'email': payment_token.email,
-            'user_count': str(payment_token.user_count)
-        }
-        
-        # Call the instance creation function
-        response = webhook_create_instance(webhook_request)
-        
-        if not isinstance(response, JsonResponse):
-            return {
-                'status': 'error',
-                'message': 'Unexpected response from instance creation'
-            }
-        
-        data = json.loads(response.content)
-        if data.get('status') != 'success':
-            return {
-                'status': 'error',
-                'message': data.get('message', 'Error creating instance')
-            }
-        
-        # Create user account
-        user = User.objects.create_user(
-            username=username,
-            email=payment_token.email,
-            password=payment_token.password
-        )
-        
-        # Get the WireGuard instance that was just created
-        instance = WireGuardInstance.objects.latest('created')
-        
-        # Create a peer group for this instance
-        peer_group_name = f"{username}_group"
-        peer_group, created = PeerGroup.objects.get_or_create(name=peer_group_name)
-        peer_group.server_instance.add(instance)
-        
-        # Create UserAcl with peer manager level
-        user_acl = UserAcl.objects.create(
-            user=user,
-            user_level=30,
-            enable_reload=True,
-            enable_restart=True,
-            enable_console=True
-        )
-        user_acl.peer_groups.add(peer_group)
-        
-        # Mark token as used AFTER successful user creation
-        payment_token.is_used = True
-        payment_token.save()
-        
-        # Call back to n8n webhook to update user state
-        try:
-            webhook_data = {
-                'email': user.email,
-            }
-            
-            django_app_url = "https://n8n.portbro.com/webhook/13f687ba-4315-4d38-ac6e-d7d2b41f6112"
-            webhook_response = requests.post(
-                django_app_url,
-                json=webhook_data,
-                timeout=10
-            )
-            
-            if webhook_response.status_code == 200:
-                logger.info(f"Successfully notified n8n webhook for user {user.email}")
-            else:
-                logger.warning(f"n8n webhook failed: {webhook_response.status_code}")
-                
-        except requests.RequestException as e:
-            logger.error(f"Failed to notify n8n webhook: {str(e)}")
-            # Don't fail the entire process if webhook fails
-        
-        logger.info(f"Successfully set up instance for user {username}")
-        return {
-            'status': 'success',
-            'message': 'Instance set up successfully',
-            'user': {
-                'username': user.username,
-                'email': user.email
-            },
-            'instance': {
-                'uuid': str(instance.uuid),
-                'name': instance.name,
-                'instance_id': instance.instance_id
-            }
-        }
-        
-    except Exception as e:
-        logger.error(f"Error setting up instance from payment token: {str(e)}")
-        logger.error(traceback.format_exc())
-        return {
-            'status': 'error',
-            'message': str(e)
-        }
-
 @csrf_exempt
 def process_payment_success(request):
     """
     Handle the payment success webhook from n8n
-    Automatically sets up the VPN instance instead of returning a configuration URL
+    Queues the VPN instance setup and answers right away, the job status is served by provisioning_job_status
     """
     try:
         # Verify API key
@@ -192,37 +64,27 @@ def process_payment_success(request):
                 },
                 'already_exists': True
             })
-            
-        # Generate a password that will be used when creating the user
-        generated_password = str(uuid.uuid4())
-            
-        # Create a payment token
-        token = PaymentToken.objects.create(
-            email=customer_email,
-            expires_at=timezone.now() + timedelta(days=7),  # Token expires in 7 days
-            user_count=user_count,  # Store the user_count in the token
-            password=generated_password  # Store the password in the token
-        )
-        
-        # Automatically set up the instance
-        setup_result = setup_instance_from_payment_token(token)
-        
-        if setup_result['status'] == 'error':
-            return JsonResponse({
-                'status': 'error',
-                'message': setup_result['message']
-            }, status=500)
-        
-        # Return success response with instance details
+
+        # Provisioning runs in the node's 'process_provisioning_jobs' worker, n8n is notified when it is done
+        job, created = enqueue_provisioning_job(customer_email, user_count)
+        if created:
+            logger.info(f"Queued provisioning job {job.uuid} for {customer_email}")
+
         return JsonResponse({
-            'status': 'success',
-            'message': 'Instance set up successfully',
-            'user': setup_result.get('user'),
-            'instance': setup_result.get('instance'),
-            'password': generated_password,  # Include the password in the response
-            'user_count': user_count
-        })
-            
+            'status': 'accepted',
+            'message': 'Instance setup queued',
+            'job': {
+                'uuid': str(job.uuid),
+                'status': job.status
+            },
+            'user': {
+                'username': customer_email,
+                'email': customer_email
+            },
+            'password': job.payment_token.password,
+            'user_count': job.payment_token.user_count
+        }, status=202)
+
     except PermissionDenied as e:
         logger.error(f"Permission denied: {str(e)}")
         return JsonResponse({
@@ -237,6 +99,46 @@ def process_payment_success(request):
             'message': str(e)
         }, status=500)
 
+def provisioning_job_status(request, job_uuid):
+    """
+    Report the state of a job queued by process_payment_success
+    """
+    api_key = request.headers.get('X-API-Key')
+    if not api_key or api_key != getattr(settings, 'N8N_API_KEY', 'test-api-key-123'):
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Permission denied'
+        }, status=403)
+
+    try:
+        job = ProvisioningJob.objects.select_related('payment_token').get(uuid=job_uuid)
+    except ProvisioningJob.DoesNotExist:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Job not found'
+        }, status=404)
+
+    data = {
+        'status': 'success',
+        'job': {
+            'uuid': str(job.uuid),
+            'status': job.status,
+            'email': job.payment_token.email,
+            'attempts': job.attempts,
+            'last_error': job.last_error,
+            'instance': None
+        }
+    }
+    if job.instance_uuid:
+        instance = WireGuardInstance.objects.filter(uuid=job.instance_uuid).first()
+        if instance:
+            data['job']['instance'] = {
+                'uuid': str(instance.uuid),
+                'name': instance.name,
+                'instance_id': instance.instance_id
+            }
+    return JsonResponse(data)
+
 def configure_instance(request, token):
     """
     Handle the configuration for a new VPN instance - automatically create on GET request
@@ -263,84 +165,25 @@ def configure_instance(request, token):
             return redirect('orders:order_form')
             
         # Automatically create the instance on GET request (when link is clicked)
-        # Create a new request with the required parameters
-        webhook_request = HttpRequest()
-        webhook_request.method = 'GET'
-        webhook_request.GET = {
-            'email': payment_token.email,
-            'user_count': str(payment_token.user_count)  # Use the stored user_count
-        }
-        
-        # Call the instance creation function
-        response = webhook_create_instance(webhook_request)
-        
-        if isinstance(response, JsonResponse):
-            try:
-                data = json.loads(response.content)
-                if data.get('status') == 'success':
-                    # Create user account
-                    user = User.objects.create_user(
-                        username=username,
-                        email=payment_token.email,
-                        password=payment_token.password  # Use the stored password
-                    )
-                    
-                    # Get the WireGuard instance that was just created
-                    instance = WireGuardInstance.objects.latest('created')
-                    
-                    # Create a peer group for this instance (use get_or_create to avoid duplicates)
-                    peer_group_name = f"{username}_group"
-                    peer_group, created = PeerGroup.objects.get_or_create(name=peer_group_name)
-                    peer_group.server_instance.add(instance)
-                    
-                    # Create UserAcl with peer manager level
-                    user_acl = UserAcl.objects.create(
-                        user=user,
-                        user_level=30,
-                        enable_reload=True,
-                        enable_restart=True,
-                        enable_console=True
-                    )
-                    user_acl.peer_groups.add(peer_group)
-                    
-                    # Mark token as used AFTER successful user creation
-                    payment_token.is_used = True
-                    payment_token.save()
-                    
-                    # NEW: Call back to Django app to update user state
-                    try:
-                        webhook_data = {
-                            'email': user.email,
-                            #'instance_id': instance.id,
-                            # Replace with actual secret
-                        }
-                        
-                        # Make HTTP request to your Django app
-                        django_app_url = "https://n8n.portbro.com/webhook/13f687ba-4315-4d38-ac6e-d7d2b41f6112"
-                        webhook_response = requests.post(
-                            django_app_url,
-                            json=webhook_data,
-                            timeout=10
-                        )
-                        
-                        if webhook_response.status_code == 200:
-                            logger.info(f"Successfully notified Django app for user {user.email}")
-                        else:
-                            logger.warning(f"Webhook failed: {webhook_response.status_code}")
-                            
-                    except requests.RequestException as e:
-                        logger.error(f"Failed to notify Django app: {str(e)}")
-                        # Don't fail the entire process if webhook fails
-                    
-                    messages.success(request, _('VPN instance created successfully! Refer to your welcome email for login details.'))
-                    return redirect('login')
-                else:
-                    messages.error(request, data.get('message', _('Error creating instance')))
-            except json.JSONDecodeError:
-                messages.error(request, _('Invalid response from server'))
+        try:
+            with transaction.atomic():
+                payment_token = PaymentToken.objects.select_for_update().get(token=token)
+                user, instance = setup_payment_token_instance(payment_token)
+        except ProvisioningRejected as e:
+            messages.error(request, str(e))
+        except Exception as e:
+            logger.error(f"Error creating instance: {str(e)}")
+            messages.error(request, _('Error creating instance'))
         else:
-            messages.error(request, _('Unexpected error occurred'))
-            
+            try:
+                send_provisioning_callback(user.email)
+            except Exception as e:
+                # Don't fail the entire process if webhook fails
+                logger.error(f"Failed to notify n8n webhook: {str(e)}")
+
+            messages.success(request, _('VPN instance created successfully! Refer to your welcome email for login details.'))
+            return redirect('login')
+
         # If we get here, there was an error, show the form as fallback
         return render(request, 'orders/configure_instance.html', {
             'token': token,
@@ -0,0 +1,71 @@
+#!/bin/bash
+# Verify the generated bandwidth limiting scripts inside an isolated network namespace.
+# A veth interface stands in for the WireGuard interface, so no WireGuard module is required.
+# Must be run as root from the project root: ./test_scripts/test_bandwidth_ifb.sh
+
+INSTANCE_ID=${INSTANCE_ID:-99}
+BANDWIDTH_MBPS=${BANDWIDTH_MBPS:-20}
+NETNS="wgwadm-bw-test"
+INTERFACE="wg${INSTANCE_ID}"
+IFB_INTERFACE="ifbwg${INSTANCE_ID}"
+WORK_DIR=$(mktemp -d)
+FAILURES=0
+
+cleanup() {
+    ip netns del "$NETNS" 2>/dev/null
+    rm -rf "$WORK_DIR"
+}
+trap cleanup EXIT
+
+check() {
+    local description="$1"
+    shift
+    if "$@" > /dev/null 2>&1; then
+        echo "✅ $description"
+    else
+        echo "❌ $description"
+        FAILURES=$((FAILURES + 1))
+    fi
+}
+
+echo "🔍 Generating bandwidth scripts for $INTERFACE ($BANDWIDTH_MBPS Mbps, per peer)..."
+python3 - "$INSTANCE_ID" "$BANDWIDTH_MBPS" "$WORK_DIR" <<'EOF'
+import sys
+from wireguard_tools.bandwidth_limiter import generate_bandwidth_cleanup_script, generate_bandwidth_limiting_script
+
+instance_id, bandwidth_mbps, work_dir = int(sys.argv[1]), int(sys.argv[2]), sys.argv[3]
+with open(f"{work_dir}/bandwidth.sh", "w") as f:
+    f.write(generate_bandwidth_limiting_script(instance_id, bandwidth_mbps, ["10.188.99.2/32", "10.188.99.3/32"]))
+with open(f"{work_dir}/bandwidth_cleanup.sh", "w") as f:
+    f.write(generate_bandwidth_cleanup_script(instance_id))
+EOF
+
+ip netns add "$NETNS" || exit 1
+ip netns exec "$NETNS" ip link add "$INTERFACE" type veth peer name "${INTERFACE}-peer"
+ip netns exec "$NETNS" ip link set "$INTERFACE" up
+ip netns exec "$NETNS" ip link set "${INTERFACE}-peer" up
+
+echo "🔍 Applying bandwidth script..."
+ip netns exec "$NETNS" bash "$WORK_DIR/bandwidth.sh"
+
+check "HTB root qdisc on $INTERFACE" bash -c "ip netns exec $NETNS tc qdisc show dev $INTERFACE | grep -q 'htb 1:'"
+check "Ingress qdisc on $INTERFACE" bash -c "ip netns exec $NETNS tc qdisc show dev $INTERFACE | grep -q 'ingress ffff:'"
+check "Redirect filter to $IFB_INTERFACE" bash -c "ip netns exec $NETNS tc filter show dev $INTERFACE parent ffff: | grep -q 'Redirect to device $IFB_INTERFACE'"
+check "$IFB_INTERFACE is up" bash -c "ip netns exec $NETNS ip link show $IFB_INTERFACE | grep -q 'UP'"
+check "HTB root qdisc on $IFB_INTERFACE" bash -c "ip netns exec $NETNS tc qdisc show dev $IFB_INTERFACE | grep -q 'htb 1:'"
+check "Ingress rate limit ${BANDWIDTH_MBPS}Mbit" bash -c "ip netns exec $NETNS tc class show dev $IFB_INTERFACE | grep -q 'rate ${BANDWIDTH_MBPS}Mbit'"
+check "Per peer egress classes" bash -c "[ \$(ip netns exec $NETNS tc class show dev $INTERFACE | grep -c 'parent 1:1 .*ceil') -ge 3 ]"
+check "Per peer ingress classes" bash -c "[ \$(ip netns exec $NETNS tc class show dev $IFB_INTERFACE | grep -c 'parent 1:1 .*ceil') -ge 3 ]"
+
+echo "🔍 Applying cleanup script..."
+ip netns exec "$NETNS" bash "$WORK_DIR/bandwidth_cleanup.sh"
+
+check "HTB root qdisc removed from $INTERFACE" bash -c "! ip netns exec $NETNS tc qdisc show dev $INTERFACE | grep -q 'htb'"
+check "Ingress qdisc removed from $INTERFACE" bash -c "! ip netns exec $NETNS tc qdisc show dev $INTERFACE | grep -q 'ingress'"
+check "$IFB_INTERFACE removed" bash -c "! ip netns exec $NETNS ip link show $IFB_INTERFACE"
+
+if [ "$FAILURES" -gt 0 ]; then
+    echo "❌ $FAILURES check(s) failed"
+    exit 1
+fi
+echo "✅ All bandwidth shaping checks passed"
@@ -1,3 +1,75 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from user_manager.models import UserAcl
+from wgwadmlibrary.tools import get_user_acl_index_cache_key, user_allowed_instances, user_has_access_to_instance, \
+    user_has_access_to_peer
+from wireguard.models import Peer, PeerGroup, WireGuardInstance
+
+
+class UserAclIndexTest(TestCase):
+    """The access index is read from the cache without queries and rebuilt when the signals invalidate it."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # bulk_create sends no post_save signal, nothing touches the running system
+        cls.wireguard_instances = WireGuardInstance.objects.bulk_create([
+            WireGuardInstance(
+                name=f'test{index}', instance_id=200 + index, listen_port=52020 + index, address=f'10.25{index}.0.1',
+                netmask=24, private_key='test', public_key=f'test{index}', hostname='test',
+            ) for index in range(2)
+        ])
+        cls.peer = Peer.objects.bulk_create([
+            Peer(name='test', public_key='test', wireguard_instance=cls.wireguard_instances[1])
+        ])[0]
+        cls.peer_group = PeerGroup.objects.create(name='test')
+        cls.user_acl = UserAcl.objects.create(user=User.objects.create_user('test'), user_level=30)
+
+    def setUp(self):
+        cache.delete(get_user_acl_index_cache_key(self.user_acl.pk))
+
+    def load_user_acl(self):
+        # A new request loads the UserAcl again
+        return UserAcl.objects.get(pk=self.user_acl.pk)
+
+    def test_cached_index_needs_no_queries(self):
+        self.peer_group.server_instance.add(self.wireguard_instances[0])
+        self.user_acl.peer_groups.add(self.peer_group)
+
+        user_acl = self.load_user_acl()
+        with self.assertNumQueries(2):
+            self.assertTrue(user_has_access_to_instance(user_acl, self.wireguard_instances[0]))
+        user_acl = self.load_user_acl()
+        with self.assertNumQueries(0):
+            self.assertTrue(user_has_access_to_instance(user_acl, self.wireguard_instances[0]))
+            self.assertFalse(user_has_access_to_instance(user_acl, self.wireguard_instances[1]))
+
+    def test_membership_changes_invalidate_the_index(self):
+        self.user_acl.peer_groups.add(self.peer_group)
+        self.assertFalse(user_has_access_to_peer(self.load_user_acl(), self.peer))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.peer_group.peer.add(self.peer)
+        user_acl = self.load_user_acl()
+        self.assertTrue(user_has_access_to_peer(user_acl, self.peer))
+        self.assertEqual(list(user_allowed_instances(user_acl)), [self.wireguard_instances[1]])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.peer.peergroup_set.clear()
+        self.assertFalse(user_has_access_to_peer(self.load_user_acl(), self.peer))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.wireguard_instances[1].peergroup_set.add(self.peer_group)
+        self.assertTrue(user_has_access_to_peer(self.load_user_acl(), self.peer))
+
+    def test_deleted_peer_group_revokes_access(self):
+        self.peer_group.server_instance.add(self.wireguard_instances[0])
+        self.user_acl.peer_groups.add(self.peer_group)
+        self.assertTrue(user_has_access_to_instance(self.load_user_acl(), self.wireguard_instances[0]))
+
+        # The cascade removes the membership rows without an m2m_changed signal
+        with self.captureOnCommitCallbacks(execute=True):
+            self.peer_group.delete()
+        self.assertIsNone(cache.get(get_user_acl_index_cache_key(self.user_acl.pk)))
+        self.assertFalse(user_has_access_to_instance(self.load_user_acl(), self.wireguard_instances[0]))
@@ -5,8 +5,7 @@ from django.core.exceptions import PermissionDenied
 from django.http import Http404, HttpResponse
 from django.shortcuts import render, get_object_or_404
 
-from user_manager.models import UserAcl
-from wgwadmlibrary.tools import user_has_access_to_peer
+from wgwadmlibrary.tools import get_request_user_acl, user_has_access_to_peer
 from wireguard.models import Peer, WireGuardInstance
 
 import base64
@@ -16,7 +15,7 @@ import os
 
 @login_required
 def view_rrd_graph(request):
-    user_acl = get_object_or_404(UserAcl, user=request.user)
+    user_acl = get_request_user_acl(request)
     peer = None
     instance = None
     if request.GET.get('peer'):
@@ -0,0 +1,193 @@
+import ipaddress
+import logging
+import subprocess
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+
+from wireguard.models import PooledInstance, WireGuardInstance
+
+logger = logging.getLogger(__name__)
+
+# Instances get 10.188.<instance_id>.1, so instance ids are limited to one octet
+INSTANCE_NETWORK_PREFIX = '10.188'
+MAX_INSTANCE_ID = 255
+FIRST_LISTEN_PORT = 51820
+# Key of the PostgreSQL advisory lock serializing allocations between processes and cluster nodes
+INSTANCE_ALLOCATION_LOCK_ID = 0x77670001
+INSTANCE_ALLOCATION_ATTEMPTS = 3
+# Netmask reserved by a pooled slot, orders needing a larger network are not served from the pool
+POOLED_INSTANCE_NETMASK = 24
+
+
+def netmask_for_user_count(user_count):
+    """Smallest netmask with room for user_count peers, at least /29 (6 usable addresses)."""
+    netmask = 29
+    while netmask > 23 and 2 ** (32 - netmask) - 2 < user_count:
+        netmask -= 1
+    return netmask
+
+
+def generate_wireguard_keys():
+    """Return a new (private_key, public_key) pair."""
+    private_key = subprocess.run(['wg', 'genkey'], capture_output=True, text=True, check=True).stdout.strip()
+    public_key = subprocess.run(['wg', 'pubkey'], input=private_key, capture_output=True, text=True, check=True).stdout.strip()
+    return private_key, public_key
+
+
+def find_free_instance_slot(netmask=24):
+    """
+    Return the lowest free {'instance_id', 'listen_port', 'address'} for a new instance.
+
+    Ids and ports of deleted instances are reused, and an id is skipped when its 10.188.<id>.1/<netmask>
+    network would overlap an existing instance or pooled slot. Raises ValueError when no id is left.
+    """
+    used_instance_ids = set()
+    used_listen_ports = set()
+    used_networks = []
+    for instance_id, listen_port, address, instance_netmask in WireGuardInstance.objects.values_list(
+        'instance_id', 'listen_port', 'address', 'netmask'
+    ):
+        used_instance_ids.add(instance_id)
+        used_listen_ports.add(listen_port)
+        used_networks.append(ipaddress.ip_network(f"{address}/{instance_netmask}", strict=False))
+    for instance_id, listen_port, address in PooledInstance.objects.values_list('instance_id', 'listen_port', 'address'):
+        used_instance_ids.add(instance_id)
+        used_listen_ports.add(listen_port)
+        used_networks.append(ipaddress.ip_network(f"{address}/{POOLED_INSTANCE_NETMASK}", strict=False))
+
+    for instance_id in range(MAX_INSTANCE_ID + 1):
+        if instance_id in used_instance_ids:
+            continue
+        address = f'{INSTANCE_NETWORK_PREFIX}.{instance_id}.1'
+        network = ipaddress.ip_network(f"{address}/{netmask}", strict=False)
+        if any(network.overlaps(used_network) for used_network in used_networks):
+            continue
+        break
+    else:
+        raise ValueError(f'No free instance id left in {INSTANCE_NETWORK_PREFIX}.0.0/16')
+
+    listen_port = FIRST_LISTEN_PORT
+    while listen_port in used_listen_ports:
+        listen_port += 1
+
+    return {'instance_id': instance_id, 'listen_port': listen_port, 'address': address}
+
+
+def lock_instance_allocation():
+    """
+    Serialize instance allocation until the current transaction ends.
+
+    On PostgreSQL this takes a transaction level advisory lock, shared by every node using the database.
+    Other databases rely on the unique constraints and the retry in create_wireguard_instance().
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [INSTANCE_ALLOCATION_LOCK_ID])
+
+
+def create_wireguard_instance(netmask=24, **fields):
+    """
+    Create a WireGuardInstance on the lowest free id, listen port and address and return it.
+
+    Keys are generated unless given in 'fields'. The slot is looked up and the instance inserted under
+    the allocation lock, so concurrent orders never get the same slot.
+    """
+    if 'private_key' not in fields:
+        fields['private_key'], fields['public_key'] = generate_wireguard_keys()
+
+    for attempt in range(1, INSTANCE_ALLOCATION_ATTEMPTS + 1):
+        try:
+            with transaction.atomic():
+                lock_instance_allocation()
+                slot = find_free_instance_slot(netmask)
+                return WireGuardInstance.objects.create(netmask=netmask, **slot, **fields)
+        except IntegrityError:
+            if attempt == INSTANCE_ALLOCATION_ATTEMPTS:
+                raise
+            logger.warning(f"Instance slot taken concurrently, retrying allocation (attempt {attempt})")
+
+
+def claim_pooled_instance(node_hostname, netmask=24, **fields):
+    """
+    Turn one of the node's pooled slots into a WireGuardInstance and return it.
+
+    The instance gets the /24 the slot reserves, so the slot's ready configuration applies unchanged. The
+    claimed slot is kept on the instance as 'pooled_instance', pass it to reload_wireguard_instance() to
+    bring the interface up. Returns None when the pool is empty or the netmask needs more than the slot
+    reserves, the caller then falls back to create_wireguard_instance().
+    """
+    if netmask < POOLED_INSTANCE_NETMASK:
+        return None
+    try:
+        with transaction.atomic():
+            pooled_instance = PooledInstance.objects.select_for_update(skip_locked=True).filter(
+                hostname=node_hostname
+            ).order_by('instance_id').first()
+            if pooled_instance is None:
+                return None
+            pooled_instance.delete()
+            instance = WireGuardInstance(
+                instance_id=pooled_instance.instance_id,
+                listen_port=pooled_instance.listen_port,
+                address=pooled_instance.address,
+                private_key=pooled_instance.private_key,
+                public_key=pooled_instance.public_key,
+                netmask=POOLED_INSTANCE_NETMASK,
+                **fields
+            )
+            # Set before saving, the post_save signal skips the firewall the slot is already part of
+            instance.pooled_instance = pooled_instance
+            instance.save(force_insert=True)
+    except IntegrityError:
+        # Only possible without the allocation lock (not PostgreSQL), the slot is stale
+        logger.warning(f"Pooled slot wg{pooled_instance.instance_id} is already in use, allocating a new slot")
+        PooledInstance.objects.filter(pk=pooled_instance.pk).delete()
+        return None
+    logger.info(f"Claimed pooled instance wg{instance.instance_id} on {node_hostname}")
+    return instance
+
+
+def prepare_pooled_instance(pooled_instance):
+    """
+    Render the configuration and the firewall set members of the instance a pooled slot becomes, from the
+    instance defaults. Run on the slot's node, the bandwidth scripts of the interface are written too.
+    """
+    from firewall.tools import get_instance_ipset_members
+    from wireguard_tools.views import generate_wireguard_config
+
+    instance = WireGuardInstance(
+        instance_id=pooled_instance.instance_id, listen_port=pooled_instance.listen_port,
+        address=pooled_instance.address, netmask=POOLED_INSTANCE_NETMASK, hostname=pooled_instance.hostname,
+        private_key=pooled_instance.private_key, public_key=pooled_instance.public_key,
+    )
+    pooled_instance.config = generate_wireguard_config(instance, include_peers=False)
+    pooled_instance.firewall_ipsets = get_instance_ipset_members(instance)
+
+
+def refill_instance_pool(node_hostname, size=None):
+    """
+    Add pooled slots for a node until it has 'size' of them (INSTANCE_POOL_SIZE by default).
+
+    Every slot is keyed, its configuration rendered, and the firewall is applied once for the new slots,
+    so a claim only has to bring the interface up. Returns the number of slots created.
+    """
+    from wireguard_tools.views import apply_firewall_configuration
+
+    if size is None:
+        size = settings.INSTANCE_POOL_SIZE
+    created = 0
+    while PooledInstance.objects.filter(hostname=node_hostname).count() < size:
+        private_key, public_key = generate_wireguard_keys()
+        with transaction.atomic():
+            lock_instance_allocation()
+            slot = find_free_instance_slot(POOLED_INSTANCE_NETMASK)
+            pooled_instance = PooledInstance(hostname=node_hostname, private_key=private_key, public_key=public_key, **slot)
+            prepare_pooled_instance(pooled_instance)
+            pooled_instance.save()
+        created += 1
+    if created:
+        logger.info(f"Added {created} pooled instances for {node_hostname}")
+        if not apply_firewall_configuration():
+            logger.warning("Could not add the pooled instances to the firewall, claims will apply it instead")
+    return created
@@ -3,12 +3,17 @@ import random
 import re
 import smtplib
 import subprocess
+import threading
+from contextlib import contextmanager
 from datetime import timedelta
 from email.mime.text import MIMEText
 
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
-from django.db.models import Max
+from django.db import transaction
+from django.db.models import Max, Q
+from django.http import Http404
 from django.utils import timezone
 
 from user_manager.models import UserAcl
@@ -17,54 +22,149 @@ from wireguard.models import Peer, WireGuardInstance
 from wireguard_tools.models import EmailSettings
 
 
+ACL_INDEX_CACHE_PREFIX = 'wgwadm_acl_index'
+ACL_INDEX_CACHE_TIMEOUT = 3600
+PENDING_CHANGES_CACHE_KEY = 'wgwadm_pending_changes'
+# Bounds how long a change written by another node of the cluster can go unnoticed
+PENDING_CHANGES_CACHE_TIMEOUT = 60
+
+model_signal_state = threading.local()
+
+
+@contextmanager
+def suppress_model_signals():
+    """
+    Make the WireGuard model signal receivers skip their side effects (DNS hosts file, firewall, cached
+    flags) in this thread. Used by bulk operations that run a single targeted cleanup afterwards.
+    """
+    previous_state = getattr(model_signal_state, 'suppressed', False)
+    model_signal_state.suppressed = True
+    try:
+        yield
+    finally:
+        model_signal_state.suppressed = previous_state
+
+
+def model_signals_suppressed():
+    return getattr(model_signal_state, 'suppressed', False)
+
+
+def get_request_user_acl(request):
+    """
+    UserAcl of the logged in user, fetched once per request and shared by the views and the context
+    processors. Raises Http404 when the user has no UserAcl, like get_object_or_404().
+    """
+    if not hasattr(request, '_user_acl'):
+        request._user_acl = UserAcl.objects.filter(user=request.user).first() if request.user.is_authenticated else None
+    if request._user_acl is None:
+        raise Http404('No UserAcl matches the given query.')
+    return request._user_acl
+
+
+def update_pending_changes_flag():
+    pending_changes = WireGuardInstance.objects.filter(pending_changes=True).exists()
+    cache.set(PENDING_CHANGES_CACHE_KEY, pending_changes, timeout=PENDING_CHANGES_CACHE_TIMEOUT)
+    return pending_changes
+
+
+def get_pending_changes_flag():
+    """Whether any instance has pending changes. Kept in the cache and refreshed on every instance write."""
+    pending_changes = cache.get(PENDING_CHANGES_CACHE_KEY)
+    if pending_changes is None:
+        pending_changes = update_pending_changes_flag()
+    return pending_changes
+
+
+def get_user_acl_index_cache_key(user_acl_id):
+    return f"{ACL_INDEX_CACHE_PREFIX}_{user_acl_id}"
+
+
+def invalidate_user_acl_indexes(user_acl_ids):
+    """
+    Force the access index of the given users to be rebuilt.
+
+    'updated' is the version of the cached index, touching it reaches the caches of every node of the
+    cluster. The local cache entries are dropped once the change is committed, so a concurrent request
+    cannot cache the old state again.
+    """
+    user_acl_ids = list(user_acl_ids)
+    if not user_acl_ids:
+        return
+    UserAcl.objects.filter(pk__in=user_acl_ids).update(updated=timezone.now())
+    transaction.on_commit(lambda: cache.delete_many([get_user_acl_index_cache_key(pk) for pk in user_acl_ids]))
+
+
+def get_user_acl_index(user_acl: UserAcl):
+    """
+    Return the cached access index of a user: {'instance_ids', 'peer_ids', 'peer_instance_ids'}.
+
+    'instance_ids' are the instances granted through peer groups, 'peer_ids' the peers granted one by one
+    and 'peer_instance_ids' the instances those peers belong to. The index is read straight from the
+    cache and rebuilt when its version differs from the 'updated' field of the UserAcl, which the
+    signals in wireguard/signals.py touch on every change of the user's peer groups, their members,
+    or a deletion of those. The index is also kept on the UserAcl object for later checks in the
+    same request.
+    """
+    acl_index = getattr(user_acl, '_acl_index', None)
+    if acl_index is not None:
+        return acl_index
+
+    cache_key = get_user_acl_index_cache_key(user_acl.pk)
+    acl_index = cache.get(cache_key)
+    if acl_index is None or acl_index['updated'] != user_acl.updated:
+        acl_index = {
+            'updated': user_acl.updated,
+            'instance_ids': set(),
+            'peer_ids': set(),
+            'peer_instance_ids': set(),
+        }
+        for instance_id in user_acl.peer_groups.filter(server_instance__isnull=False).values_list('server_instance', flat=True):
+            acl_index['instance_ids'].add(instance_id)
+        for peer_id, peer_instance_id in user_acl.peer_groups.filter(peer__isnull=False).values_list('peer', 'peer__wireguard_instance'):
+            acl_index['peer_ids'].add(peer_id)
+            acl_index['peer_instance_ids'].add(peer_instance_id)
+        cache.set(cache_key, acl_index, timeout=ACL_INDEX_CACHE_TIMEOUT)
+
+    user_acl._acl_index = acl_index
+    return acl_index
+
+
+# Users without peer groups have an empty index: they get NO access, not ALL access
 def user_has_access_to_instance(user_acl: UserAcl, instance: WireGuardInstance):
-    if user_acl.peer_groups.all():
-        if user_acl.peer_groups.filter(server_instance=instance).exists():
-            return True
-    else:
-        # SECURITY FIX: Users without peer groups should have NO access, not ALL access
-        return False
-    return False
+    return instance.pk in get_user_acl_index(user_acl)['instance_ids']
 
 
 def user_has_access_to_peer(user_acl: UserAcl, peer: Peer):
-    if user_acl.peer_groups.all():
-        if user_acl.peer_groups.filter(peer=peer).exists():
-            return True
-        if user_acl.peer_groups.filter(server_instance=peer.wireguard_instance).exists():
-            return True
-    else:
-        # SECURITY FIX: Users without peer groups should have NO access, not ALL access
-        return False
-    return False
+    acl_index = get_user_acl_index(user_acl)
+    return peer.pk in acl_index['peer_ids'] or peer.wireguard_instance_id in acl_index['instance_ids']
 
 
 def user_allowed_instances(user_acl: UserAcl):
-    if not user_acl.peer_groups.exists():
-        # SECURITY FIX: Users without peer groups should see NO instances, not ALL instances
+    acl_index = get_user_acl_index(user_acl)
+    instance_ids = acl_index['instance_ids'] | acl_index['peer_instance_ids']
+    if not instance_ids:
         return WireGuardInstance.objects.none()
-    instances_from_groups = WireGuardInstance.objects.filter(peergroup__in=user_acl.peer_groups.all())    
-    instances_from_peers = WireGuardInstance.objects.filter(peer__peergroup__in=user_acl.peer_groups.all())
-    return instances_from_groups.union(instances_from_peers).order_by('instance_id')
+    return WireGuardInstance.objects.filter(pk__in=instance_ids).order_by('instance_id')
 
 
 def user_allowed_peers(user_acl: UserAcl, instance: WireGuardInstance):
-
-    if not user_acl.peer_groups.exists():
-        # SECURITY FIX: Users without peer groups should see NO peers, not ALL peers
-        return Peer.objects.none()
-
-    peers_from_direct = Peer.objects.filter(
-        wireguard_instance=instance,
-        peergroup__in=user_acl.peer_groups.all()
-    )
-    
-    peers_from_instance = Peer.objects.filter(
-        wireguard_instance=instance,
-        wireguard_instance__peergroup__in=user_acl.peer_groups.filter(server_instance=instance)
-    )
-
-    return peers_from_direct.union(peers_from_instance).order_by('sort_order')
+    acl_index = get_user_acl_index(user_acl)
+    if instance.pk in acl_index['instance_ids']:
+        return Peer.objects.filter(wireguard_instance=instance).order_by('sort_order')
+    if instance.pk in acl_index['peer_instance_ids']:
+        return Peer.objects.filter(wireguard_instance=instance, pk__in=acl_index['peer_ids']).order_by('sort_order')
+    return Peer.objects.none()
+
+
+def user_allowed_peer_public_keys(user_acl: UserAcl, instance: WireGuardInstance = None):
+    """Public keys of the peers user_allowed_peers() returns, for one instance or all of them, as a set."""
+    acl_index = get_user_acl_index(user_acl)
+    if not acl_index['instance_ids'] and not acl_index['peer_ids']:
+        return set()
+    peers = Peer.objects.filter(Q(pk__in=acl_index['peer_ids']) | Q(wireguard_instance__in=acl_index['instance_ids']))
+    if instance:
+        peers = peers.filter(wireguard_instance=instance)
+    return set(peers.values_list('public_key', flat=True))
 
 
 def is_valid_ip_or_hostname(value):
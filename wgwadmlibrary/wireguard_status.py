@@ -0,0 +1,180 @@
+import hashlib
+import json
+import logging
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Fields compared when looking for changed peers
+STATUS_FIELDS = ('latest-handshakes', 'transfer', 'endpoints', 'allowed-ips')
+# Snapshots kept to answer '?since=<etag>' requests with a delta, in the shared cache for every worker and in
+# a small per process front cache
+STATUS_HISTORY_SIZE = 32
+STATUS_SNAPSHOT_CACHE_PREFIX = 'wgwadm_status_snapshot'
+# Longer than the 5 minute poll of the RRD collector
+STATUS_SNAPSHOT_CACHE_TIMEOUT = 600
+
+status_history = OrderedDict()
+status_history_lock = threading.Lock()
+
+
+def read_wireguard_status():
+    """
+    Read the status of every interface and peer with a single 'wg show all dump'.
+
+    Returns {interface: {public_key: {'allowed-ips', 'latest-handshakes', 'transfer', 'endpoints'}}}, the
+    format served by /api/wireguard_status/. Raises RuntimeError with the wg error output on failure.
+    """
+    process = subprocess.run(['wg', 'show', 'all', 'dump'], capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr)
+
+    output = {}
+    for line in process.stdout.splitlines():
+        parts = line.split('\t')
+        if len(parts) == 5:
+            # interface, private key, public key, listen port, fwmark
+            output.setdefault(parts[0], {})
+        elif len(parts) == 9:
+            # interface, public key, preshared key, endpoint, allowed ips, latest handshake, rx, tx, keepalive
+            interface, public_key, preshared_key, endpoint, allowed_ips, latest_handshake, rx, tx, keepalive = parts
+            output.setdefault(interface, {})[public_key] = {
+                'allowed-ips': [allowed_ips.replace(',', ' ')],
+                'latest-handshakes': latest_handshake,
+                'transfer': {'tx': int(tx), 'rx': int(rx)},
+                'endpoints': endpoint,
+            }
+    return output
+
+
+def get_status_delta(previous, current):
+    """
+    Return (changed, removed) between two status snapshots of one interface.
+
+    'changed' maps public keys to their full status for new peers and peers with a different handshake,
+    transfer, endpoint or allowed IPs. 'removed' lists public keys that are no longer present.
+    """
+    changed = {}
+    for public_key, peer_status in current.items():
+        previous_status = previous.get(public_key)
+        if previous_status is None or any(previous_status[field] != peer_status[field] for field in STATUS_FIELDS):
+            changed[public_key] = peer_status
+    removed = [public_key for public_key in previous if public_key not in current]
+    return changed, removed
+
+
+def get_status_snapshot_cache_key(etag):
+    return f"{STATUS_SNAPSHOT_CACHE_PREFIX}_{etag}"
+
+
+def store_status_snapshot(snapshot):
+    """
+    Remember a full status snapshot and return its etag.
+
+    The snapshot is written to the shared cache, so a client whose next request reaches another worker still
+    gets a delta. A client whose etag has expired gets a full response.
+    """
+    etag = hashlib.sha1(json.dumps(snapshot, sort_keys=True).encode()).hexdigest()[:20]
+    with status_history_lock:
+        already_stored = etag in status_history
+        status_history[etag] = snapshot
+        status_history.move_to_end(etag)
+        while len(status_history) > STATUS_HISTORY_SIZE:
+            status_history.popitem(last=False)
+    if not already_stored:
+        cache.set(get_status_snapshot_cache_key(etag), snapshot, timeout=STATUS_SNAPSHOT_CACHE_TIMEOUT)
+    return etag
+
+
+def get_status_snapshot(etag):
+    if not etag or not etag.isalnum():
+        return None
+    with status_history_lock:
+        snapshot = status_history.get(etag)
+    if snapshot is None:
+        snapshot = cache.get(get_status_snapshot_cache_key(etag))
+        if snapshot is not None:
+            with status_history_lock:
+                status_history[etag] = snapshot
+                while len(status_history) > STATUS_HISTORY_SIZE:
+                    status_history.popitem(last=False)
+    return snapshot
+
+
+def filter_status(snapshot, interfaces=None, public_keys=None):
+    """Limit a snapshot to some interfaces and, when public_keys is a set, to the peers in it."""
+    filtered = {}
+    for interface, peers in snapshot.items():
+        if interfaces is not None and interface not in interfaces:
+            continue
+        if public_keys is not None:
+            peers = {peer: peer_status for peer, peer_status in peers.items() if peer in public_keys}
+        filtered[interface] = peers
+    return filtered
+
+
+class WireGuardStatusReader:
+    """
+    Shared status reader for the streaming endpoint.
+
+    A single thread per process runs 'wg show all dump' while there are subscribers and wakes every
+    subscriber when a new snapshot is available, so the number of wg calls does not grow with the number
+    of open peer lists. The thread ticks at the shortest interval requested and exits when the last
+    subscriber leaves.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.subscribers = {}
+        self.snapshot = None
+        self.version = 0
+        self.thread = None
+
+    def subscribe(self, interval):
+        token = object()
+        with self.condition:
+            self.subscribers[token] = max(interval, 1)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='wireguard-status-reader', daemon=True)
+                self.thread.start()
+        return token
+
+    def unsubscribe(self, token):
+        with self.condition:
+            self.subscribers.pop(token, None)
+
+    def wait_for_snapshot(self, version, timeout):
+        """Block until a snapshot newer than 'version' exists. Returns (version, snapshot), snapshot is None on timeout."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.snapshot is not None and self.version != version, timeout):
+                return version, None
+            return self.version, self.snapshot
+
+    def run(self):
+        while True:
+            try:
+                snapshot = read_wireguard_status()
+            except (OSError, RuntimeError) as e:
+                logger.warning(f"Failed to read WireGuard status: {e}")
+                snapshot = None
+
+            with self.condition:
+                if snapshot is not None:
+                    self.snapshot = snapshot
+                    self.version += 1
+                    self.condition.notify_all()
+                if not self.subscribers:
+                    # Drop the snapshot so the next subscriber waits for a fresh one
+                    self.snapshot = None
+                    self.thread = None
+                    return
+                interval = min(self.subscribers.values())
+            time.sleep(interval)
+
+
+status_reader = WireGuardStatusReader()
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import WireGuardInstance, Peer, PeerAllowedIP, PeerStatus, WebadminSettings
+from .models import WireGuardInstance, Peer, PeerAllowedIP, PeerStatus, PooledInstance, WebadminSettings
 
 
 class WireGuardInstanceAdmin(admin.ModelAdmin):
@@ -22,11 +22,11 @@ class WireGuardInstanceAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
         ('Bandwidth Limiting', {
-            'fields': ('bandwidth_limit_enabled', 'bandwidth_limit_mbps'),
+            'fields': ('bandwidth_limit_enabled', 'bandwidth_limit_mbps', 'bandwidth_limit_per_peer'),
             'classes': ('collapse',)
         }),
         ('System', {
-            'fields': ('pending_changes', 'legacy_firewall'),
+            'fields': ('pending_changes', 'config_outdated', 'legacy_firewall'),
             'classes': ('collapse',)
         })
     )
@@ -71,4 +71,10 @@ class WebadminSettingsAdmin(admin.ModelAdmin):
     list_display = ('current_version', 'latest_version', 'update_available', 'created', 'updated', 'uuid')
     search_fields = ('current_version', 'latest_version', 'update_available', 'created', 'updated', 'uuid')
 
-admin.site.register(WebadminSettings, WebadminSettingsAdmin)
\ No newline at end of file
+admin.site.register(WebadminSettings, WebadminSettingsAdmin)
+
+class PooledInstanceAdmin(admin.ModelAdmin):
+    list_display = ('hostname', 'instance_id', 'listen_port', 'address', 'created', 'uuid')
+    search_fields = ('hostname', 'instance_id', 'listen_port', 'address')
+
+admin.site.register(PooledInstance, PooledInstanceAdmin)
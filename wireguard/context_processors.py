@@ -1,11 +1,15 @@
-from user_manager.models import UserAcl
-from .models import WireGuardInstance
+from django.http import Http404
+
+from wgwadmlibrary.tools import get_pending_changes_flag, get_request_user_acl
 
 
 def pending_changes_warning(request):
     if request.user.is_authenticated:
-        user_acl = UserAcl.objects.filter(user=request.user).first()
-        pending = WireGuardInstance.objects.filter(pending_changes=True).exists()
+        try:
+            user_acl = get_request_user_acl(request)
+        except Http404:
+            user_acl = None
+        pending = get_pending_changes_flag()
     else:
         user_acl = None
         pending = False
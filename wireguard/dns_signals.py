@@ -7,11 +7,14 @@ from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from .models import Peer, WireGuardInstance
 from .dns_utils import write_dnsmasq_hosts_file, reload_dnsmasq
+from wgwadmlibrary.tools import model_signals_suppressed
 
 
 @receiver(post_save, sender=Peer)
 def update_dns_on_peer_change(sender, instance, created, **kwargs):
     """Update DNS configuration when a peer is created or modified"""
+    if model_signals_suppressed():
+        return
     try:
         print(f"DNS: Peer {'created' if created else 'updated'}: {instance}")
         
@@ -29,6 +32,8 @@ def update_dns_on_peer_change(sender, instance, created, **kwargs):
 @receiver(post_delete, sender=Peer)
 def update_dns_on_peer_delete(sender, instance, **kwargs):
     """Update DNS configuration when a peer is deleted"""
+    if model_signals_suppressed():
+        return
     try:
         print(f"DNS: Peer deleted: {instance}")
         
@@ -46,6 +51,8 @@ def update_dns_on_peer_delete(sender, instance, **kwargs):
 @receiver(post_save, sender=WireGuardInstance)
 def update_dns_on_instance_change(sender, instance, created, **kwargs):
     """Update DNS configuration when a WireGuard instance is modified"""
+    if model_signals_suppressed():
+        return
     try:
         print(f"DNS: WireGuard instance {'created' if created else 'updated'}: {instance}")
         
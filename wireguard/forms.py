@@ -23,13 +23,14 @@ class WireGuardInstanceForm(forms.ModelForm):
     dns_secondary = forms.GenericIPAddressField(label=_('Secondary DNS'), initial='8.8.8.8', required=False)
     bandwidth_limit_enabled = forms.BooleanField(label=_('Enable Bandwidth Limiting'), initial=True, required=False)
     bandwidth_limit_mbps = forms.IntegerField(label=_('Bandwidth Limit (Mbps)'), initial=50, min_value=1, max_value=10000, required=False)
+    bandwidth_limit_per_peer = forms.BooleanField(label=_('Share Bandwidth Fairly Between Peers'), initial=False, required=False)
 
     class Meta:
         model = WireGuardInstance
         fields = [
             'name', 'instance_id', 'private_key', 'public_key','hostname', 'listen_port', 'address', 
             'netmask', 'post_up', 'post_down', 'peer_list_refresh_interval', 'dns_primary', 'dns_secondary',
-            'bandwidth_limit_enabled', 'bandwidth_limit_mbps'
+            'bandwidth_limit_enabled', 'bandwidth_limit_mbps', 'bandwidth_limit_per_peer'
             ]
         
     def clean(self):
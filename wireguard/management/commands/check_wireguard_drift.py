@@ -0,0 +1,79 @@
+"""
+Management command to compare the database with the running WireGuard interfaces, tc and iptables state
+of this node and report the drift per instance. With --heal the drift is fixed with minimal changes.
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.views import get_vpn_hostname
+from wireguard_tools.drift import reconcile_wireguard_drift
+
+
+class Command(BaseCommand):
+    help = 'Report drift between the database and the running WireGuard, tc and iptables state, optionally healing it'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--heal',
+            action='store_true',
+            help='Fix peer, bandwidth and firewall drift with wg set, tc and iptables changes',
+        )
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        try:
+            drift = reconcile_wireguard_drift(get_vpn_hostname(), heal=options['heal'])
+        except (OSError, RuntimeError) as e:
+            raise CommandError(f"Could not read the WireGuard state: {e}")
+
+        if options['json']:
+            self.stdout.write(json.dumps(drift, indent=2))
+        else:
+            self.print_report(drift)
+
+    def print_report(self, drift):
+        drifted = 0
+        for report in drift['instances']:
+            if not report['drift']:
+                self.stdout.write(f"{report['interface']}: {self.style.SUCCESS('in sync')}")
+                continue
+            drifted += 1
+            if not report['running']:
+                self.stdout.write(f"{report['interface']}: {self.style.ERROR('not running')}")
+                continue
+            details = []
+            if report['interface_fields']:
+                details.append(f"interface {', '.join(report['interface_fields'])}")
+            if report['missing_peers']:
+                details.append(f"{len(report['missing_peers'])} missing peers")
+            if report['extra_peers']:
+                details.append(f"{len(report['extra_peers'])} extra peers")
+            if report['changed_peers']:
+                details.append(f"{len(report['changed_peers'])} changed peers")
+            if report['bandwidth'] in ('drift', 'missing'):
+                details.append(f"bandwidth {report['bandwidth']}")
+            if report['pending_changes']:
+                details.append('pending changes')
+            status = self.style.WARNING('drift')
+            if 'healed' in report:
+                status += ' ' + (self.style.SUCCESS('healed') if report['healed'] else self.style.ERROR('not healed'))
+            self.stdout.write(f"{report['interface']}: {status} ({'; '.join(details)})")
+
+        for interface in drift['orphan_interfaces']:
+            self.stdout.write(f"{interface}: {self.style.WARNING('running without instance')}")
+
+        if drift['firewall_changes'] is None:
+            self.stdout.write("Firewall: not compared")
+        elif drift['firewall_changes']:
+            status = f"{drift['firewall_changes']} rule changes needed"
+            if 'firewall_healed' in drift:
+                status += ' (healed)' if drift['firewall_healed'] else ' (not healed)'
+            self.stdout.write(f"Firewall: {self.style.WARNING(status)}")
+        else:
+            self.stdout.write(f"Firewall: {self.style.SUCCESS('in sync')}")
+
+        if drifted:
+            self.stdout.write(self.style.WARNING(f"Drift found on {drifted} of {len(drift['instances'])} instances"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{len(drift['instances'])} instances in sync"))
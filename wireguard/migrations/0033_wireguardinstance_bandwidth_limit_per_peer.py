@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wireguard', '0032_update_default_dns_servers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wireguardinstance',
+            name='bandwidth_limit_per_peer',
+            field=models.BooleanField(default=False, help_text='Share the bandwidth limit fairly between peers instead of a single shared queue'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-19 16:00
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wireguard', '0033_wireguardinstance_bandwidth_limit_per_peer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PooledInstance',
+            fields=[
+                ('hostname', models.CharField(max_length=100)),
+                ('instance_id', models.PositiveIntegerField(unique=True)),
+                ('listen_port', models.IntegerField(unique=True)),
+                ('address', models.GenericIPAddressField(protocol='IPv4', unique=True)),
+                ('private_key', models.CharField(max_length=100)),
+                ('public_key', models.CharField(max_length=100)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 16:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wireguard', '0034_pooledinstance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wireguardinstance',
+            name='config_outdated',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-19 16:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wireguard', '0035_wireguardinstance_config_outdated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pooledinstance',
+            name='config',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='pooledinstance',
+            name='firewall_ipsets',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -61,12 +61,15 @@ class WireGuardInstance(models.Model):
     dns_primary = models.GenericIPAddressField(unique=False, protocol='IPv4', default='172.19.0.2', blank=True, null=True)
     dns_secondary = models.GenericIPAddressField(unique=False, protocol='IPv4', default='8.8.8.8', blank=True, null=True)
     pending_changes = models.BooleanField(default=True)
+    # Peers were applied to the running interface with 'wg set', /etc/wireguard/wgN.conf is rewritten later
+    config_outdated = models.BooleanField(default=False)
     legacy_firewall = models.BooleanField(default=False)
     #allow_peer_to_peer = models.BooleanField(default=True, help_text="Allow peers within this instance to communicate with each other")
     
     # Bandwidth limiting fields
     bandwidth_limit_enabled = models.BooleanField(default=True, help_text="Enable bandwidth limiting for this instance")
     bandwidth_limit_mbps = models.PositiveIntegerField(default=50, help_text="Bandwidth limit in Mbps")
+    bandwidth_limit_per_peer = models.BooleanField(default=False, help_text="Share the bandwidth limit fairly between peers instead of a single shared queue")
 
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
@@ -79,6 +82,33 @@ class WireGuardInstance(models.Model):
             return 'wg' + str(self.instance_id)
 
 
+class PooledInstance(models.Model):
+    """
+    Instance slot reserved and keyed in advance for a node (hostname).
+
+    Customer orders turn a pooled slot into a WireGuardInstance instead of allocating a slot and generating
+    keys while the customer waits. Each slot reserves the /24 of its address, and its configuration and
+    firewall set members are prepared in advance, so claiming a slot costs a database update and bringing
+    the interface up.
+    """
+    hostname = models.CharField(max_length=100)
+    instance_id = models.PositiveIntegerField(unique=True)
+    listen_port = models.IntegerField(unique=True)
+    address = models.GenericIPAddressField(unique=True, protocol='IPv4')
+    private_key = models.CharField(max_length=100)
+    public_key = models.CharField(max_length=100)
+    # /etc/wireguard configuration of the instance the slot becomes, without peers
+    config = models.TextField(blank=True, default='')
+    # Members the slot adds to the firewall instance ipsets, {ipset name: [members]}
+    firewall_ipsets = models.JSONField(blank=True, default=dict)
+
+    created = models.DateTimeField(auto_now_add=True)
+    uuid = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
+
+    def __str__(self):
+        return f'{self.hostname} - wg{self.instance_id}'
+
+
 class Peer(models.Model):
     name = models.CharField(max_length=100, blank=True, null=True)
     hostname = models.CharField(max_length=100, blank=True, null=True, help_text="DNS hostname for this peer (e.g., 'laptop', 'server')")
@@ -1,8 +1,11 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from .models import WireGuardInstance
-from wireguard_tools.views import export_firewall_configuration
-import subprocess
+from user_manager.models import UserAcl
+from wgwadmlibrary.tools import invalidate_user_acl_indexes, model_signals_suppressed
+from .models import Peer, PeerAllowedIP, PeerGroup, WireGuardInstance
+from wireguard_tools.views import apply_firewall_configuration
 import logging
 
 logger = logging.getLogger(__name__)
@@ -12,25 +15,113 @@ def apply_firewall_rules_on_instance_creation(sender, instance, created, **kwarg
     """
     Automatically apply firewall rules when a new WireGuard instance is created.
     This ensures peer-to-peer communication works immediately after instance creation.
+    Only the rules that changed are applied, existing connections keep their rules in place.
     """
-    if created:  # Only run for new instances, not updates
+    if not created or model_signals_suppressed():  # Only run for new instances, not updates
+        return
+    if getattr(instance, 'pooled_instance', None) and instance.pooled_instance.firewall_ipsets:
+        # Claimed from the pool, the firewall already includes the slot
+        return
+
+    def apply_rules():
         try:
-            logger.info(f"New WireGuard instance created: wg{instance.instance_id}")
-            
-            # Generate firewall script with all instances
-            export_firewall_configuration()
-            
-            # Apply the firewall rules
-            result = subprocess.run(['bash', '/etc/wireguard/wg-firewall.sh'], 
-                                  capture_output=True, text=True, check=True)
-            
-            logger.info(f"✅ Firewall rules applied successfully for wg{instance.instance_id}")
-            logger.debug(f"Firewall script output: {result.stdout}")
-            
-        except subprocess.CalledProcessError as e:
-            # Log error but don't fail instance creation
-            logger.error(f"❌ Failed to apply firewall rules for wg{instance.instance_id}: {e}")
-            logger.error(f"Firewall script stderr: {e.stderr}")
+            if apply_firewall_configuration():
+                logger.info(f"✅ Firewall rules applied successfully for wg{instance.instance_id}")
+            else:
+                logger.error(f"❌ Failed to apply firewall rules for wg{instance.instance_id}")
+
         except Exception as e:
-            # Log any other errors
+            # Log any other errors, but don't fail instance creation
             logger.error(f"❌ Unexpected error applying firewall rules for wg{instance.instance_id}: {e}")
+
+    logger.info(f"New WireGuard instance created: wg{instance.instance_id}")
+    # Instances created inside a transaction (order provisioning) only reach the firewall once committed
+    transaction.on_commit(apply_rules)
+
+
+@receiver(post_save, sender=WireGuardInstance)
+@receiver(post_delete, sender=WireGuardInstance)
+def update_pending_changes_flag_on_instance_change(sender, instance, **kwargs):
+    """Refresh the cached pending changes flag shown on every page once the write is committed."""
+    from wgwadmlibrary.tools import update_pending_changes_flag
+
+    if model_signals_suppressed():
+        return
+    transaction.on_commit(update_pending_changes_flag)
+
+
+@receiver(post_save, sender=PeerAllowedIP)
+@receiver(post_delete, sender=PeerAllowedIP)
+def sync_firewall_ipsets_on_peer_address_change(sender, instance, **kwargs):
+    """
+    Keep the firewall ipsets in sync when a server side peer address changes.
+    Only set membership is updated, the iptables chains are not touched.
+    """
+    from firewall.models import FirewallRule
+    from firewall.tools import sync_firewall_ipsets
+
+    if instance.config_file != 'server' or model_signals_suppressed():
+        return
+    # Routed networks (priority > 0) are part of the instance peer to peer ipset
+    if instance.priority == 0 and not FirewallRule.objects.filter(Q(source_peer=instance.peer_id) | Q(destination_peer=instance.peer_id)).exists():
+        return
+    transaction.on_commit(sync_firewall_ipsets)
+
+
+@receiver(m2m_changed, sender=UserAcl.peer_groups.through)
+def invalidate_acl_index_on_peer_groups_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Rebuild the cached access index (see get_user_acl_index in wgwadmlibrary/tools.py) of the users whose peer groups changed."""
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_user_acl_indexes([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        invalidate_user_acl_indexes(pk_set)
+    elif action == 'pre_clear':
+        invalidate_user_acl_indexes(instance.useracl_set.values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=PeerGroup.peer.through)
+@receiver(m2m_changed, sender=PeerGroup.server_instance.through)
+def invalidate_acl_index_on_members_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Same as invalidate_acl_index_on_peer_groups_change() for the users of a PeerGroup whose peers or instances changed."""
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            user_acls = UserAcl.objects.filter(peer_groups=instance)
+        else:
+            return
+    elif action in ('post_add', 'post_remove'):
+        user_acls = UserAcl.objects.filter(peer_groups__in=pk_set)
+    elif action == 'pre_clear':
+        user_acls = UserAcl.objects.filter(peer_groups__in=instance.peergroup_set.all())
+    else:
+        return
+    invalidate_user_acl_indexes(user_acls.values_list('pk', flat=True).distinct())
+
+
+@receiver(pre_delete, sender=Peer)
+@receiver(pre_delete, sender=PeerGroup)
+@receiver(pre_delete, sender=WireGuardInstance)
+def collect_acl_users_on_delete(sender, instance, **kwargs):
+    """
+    Remember the users granted access through the deleted object. The cascade removes the m2m rows
+    without an m2m_changed signal, and they are gone by post_delete.
+
+    Bulk deletes under suppress_model_signals() skip the per peer lookup: they delete the peers through their
+    instance or peer group, whose own lookup already covers the users of the peer groups involved.
+    """
+    if sender is Peer and model_signals_suppressed():
+        return
+    if sender is PeerGroup:
+        user_acls = UserAcl.objects.filter(peer_groups=instance)
+    elif sender is Peer:
+        user_acls = UserAcl.objects.filter(peer_groups__peer=instance)
+    else:
+        user_acls = UserAcl.objects.filter(peer_groups__server_instance=instance)
+    instance._acl_user_ids = list(user_acls.values_list('pk', flat=True).distinct())
+
+
+@receiver(post_delete, sender=Peer)
+@receiver(post_delete, sender=PeerGroup)
+@receiver(post_delete, sender=WireGuardInstance)
+def invalidate_acl_index_on_delete(sender, instance, **kwargs):
+    invalidate_user_acl_indexes(getattr(instance, '_acl_user_ids', []))
@@ -1,3 +1,30 @@
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
 from django.test import TestCase
 
-# Create your tests here.
+from user_manager.models import UserAcl
+from wgwadmlibrary.instance_allocation import MAX_INSTANCE_ID
+from wireguard.models import WireGuardInstance
+
+
+class CreateInstancePageTest(TestCase):
+    """The create instance page reports a full instance table instead of failing."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # bulk_create sends no post_save signal, nothing touches the running system
+        WireGuardInstance.objects.bulk_create([
+            WireGuardInstance(
+                name=f'test{instance_id}', instance_id=instance_id, listen_port=51820 + instance_id,
+                address=f'10.188.{instance_id}.1', netmask=24, private_key='test', public_key=f'test{instance_id}',
+                hostname='test',
+            ) for instance_id in range(MAX_INSTANCE_ID + 1)
+        ])
+        cls.user = User.objects.create_user('admin')
+        UserAcl.objects.create(user=cls.user, user_level=50)
+
+    def test_no_free_instance_id(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/server/manage/', {'action': 'create'})
+        self.assertRedirects(response, '/server/manage/', fetch_redirect_response=False)
+        self.assertIn('No free instance id left', str(list(get_messages(response.wsgi_request))[0]))
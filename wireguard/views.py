@@ -2,13 +2,13 @@ import subprocess
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db import models
 from django.shortcuts import get_object_or_404, redirect, render
 from django.utils.translation import gettext as _
 from django.utils.translation import gettext_lazy as _
 
 from user_manager.models import UserAcl
-from wgwadmlibrary.tools import user_allowed_instances
+from wgwadmlibrary.instance_allocation import find_free_instance_slot, generate_wireguard_keys
+from wgwadmlibrary.tools import get_request_user_acl, user_allowed_instances
 from wireguard.forms import WireGuardInstanceForm
 from .models import WebadminSettings, WireGuardInstance
 
@@ -17,16 +17,12 @@ def generate_instance_defaults(request=None):
     from wgwadmlibrary.dns_utils import get_optimal_dns_config
     from api.views import get_vpn_hostname
     
-    max_instance_id = WireGuardInstance.objects.all().aggregate(models.Max('instance_id'))['instance_id__max']
-    new_instance_id = (max_instance_id + 1) if max_instance_id is not None else 0
-
-    max_listen_port = WireGuardInstance.objects.all().aggregate(models.Max('listen_port'))['listen_port__max']
-    new_listen_port = (max_listen_port + 1) if max_listen_port is not None else 51820
-
-    new_private_key = subprocess.check_output('wg genkey', shell=True).decode('utf-8').strip()
-    new_public_key = subprocess.check_output(f'echo {new_private_key} | wg pubkey', shell=True).decode('utf-8').strip()
-
-    new_address = f'10.188.{new_instance_id}.1'
+    # Only a proposal for the form, the unique fields are checked again when it is saved
+    slot = find_free_instance_slot()
+    new_instance_id = slot['instance_id']
+    new_listen_port = slot['listen_port']
+    new_private_key, new_public_key = generate_wireguard_keys()
+    new_address = slot['address']
 
     address_parts = new_address.split('.')
     if len(address_parts) == 4:
@@ -81,7 +77,7 @@ def generate_instance_defaults(request=None):
 
 @login_required
 def legacy_view_wireguard_status(request):
-    user_acl = get_object_or_404(UserAcl, user=request.user)
+    user_acl = get_request_user_acl(request)
     page_title = 'WireGuard Status'
     # SECURITY FIX: Use proper user access control instead of showing all instances
     wireguard_instances = user_allowed_instances(user_acl)
@@ -104,7 +100,7 @@ def legacy_view_wireguard_status(request):
 
 @login_required
 def view_wireguard_status(request):
-    user_acl = get_object_or_404(UserAcl, user=request.user)
+    user_acl = get_request_user_acl(request)
     page_title = _("WireGuard Status")
 
     if user_acl.peer_groups.exists():
@@ -152,25 +148,16 @@ def view_wireguard_manage_instance(request):
                 instance_id = current_instance.instance_id
                 instance_name = current_instance.name or f'wg{instance_id}'
 
-                # Stop the WireGuard interface and remove its config file so peers are disconnected
-                from wireguard_tools.views import stop_and_remove_interface, reload_wireguard_interfaces
-                try:
-                    stop_and_remove_interface(instance_id)
-                except Exception as e:
-                    import logging
-                    logger = logging.getLogger(__name__)
-                    logger.error(f"Error stopping/removing WireGuard interface wg{instance_id}: {e}")
-                
-                # Delete the instance
                 current_instance.delete()
-                
-                # Reload WireGuard interfaces to apply changes
-                success, message = reload_wireguard_interfaces()
-                
+
+                # Stop the removed interface only, the other interfaces are not reloaded
+                from wireguard_tools.views import cleanup_removed_instance
+                success, message = cleanup_removed_instance(instance_id)
+
                 if success:
-                    messages.success(request, message_title + _('|WireGuard instance deleted: wg') + str(instance_id) + _(' and interfaces reloaded successfully.'))
+                    messages.success(request, message_title + _('|WireGuard instance deleted: wg') + str(instance_id))
                 else:
-                    messages.warning(request, message_title + _('|WireGuard instance deleted: wg') + str(instance_id) + f' but reload failed: {message}')
+                    messages.warning(request, message_title + _('|WireGuard instance deleted: wg') + str(instance_id) + f' but cleanup failed: {message}')
                 
                 return redirect('/server/manage/')
             else:
@@ -191,7 +178,12 @@ def view_wireguard_manage_instance(request):
             return redirect('/server/manage/?uuid=' + str(form.instance.uuid))
     else:
         if not current_instance:
-            form = WireGuardInstanceForm(initial=generate_instance_defaults(request))
+            try:
+                form = WireGuardInstanceForm(initial=generate_instance_defaults(request))
+            except ValueError:
+                # Every instance id is in use
+                messages.warning(request, message_title + _('|No free instance id left, remove an unused instance first.'))
+                return redirect('/server/manage/')
         else:
             form = WireGuardInstanceForm(instance=current_instance)  
     context = {'page_title': page_title, 'wireguard_instances': wireguard_instances, 'current_instance': current_instance, 'form': form}
@@ -9,9 +9,11 @@ from django.utils.translation import gettext_lazy as _
 
 from user_manager.models import UserAcl
 from wgwadmlibrary.tools import check_sort_order_conflict, deduplicate_sort_order, default_sort_peers, \
-    user_allowed_instances, user_allowed_peers, user_has_access_to_instance, user_has_access_to_peer
+    get_request_user_acl, user_allowed_instances, user_allowed_peers, user_has_access_to_instance, \
+    user_has_access_to_peer
 from wireguard.models import Peer, PeerAllowedIP, WireGuardInstance
 from wireguard_peer.forms import PeerAllowedIPForm, PeerForm, PeerNameForm
+from wireguard_tools.live_apply import apply_peer_change, apply_peer_removal
 
 
 def generate_peer_default(wireguard_instance):
@@ -52,7 +54,7 @@ def generate_peer_default(wireguard_instance):
 @login_required
 def view_wireguard_peer_list(request):
     page_title = _('WireGuard Peer List')
-    user_acl = get_object_or_404(UserAcl, user=request.user)
+    user_acl = get_request_user_acl(request)
     wireguard_instances = user_allowed_instances(user_acl)
 
     if wireguard_instances:
@@ -123,7 +125,7 @@ def view_wireguard_peer_manage(request):
     else:
         if not UserAcl.objects.filter(user=request.user).filter(user_level__gte=20).exists():
             return render(request, 'access_denied.html', {'page_title': 'Access Denied'})
-    user_acl = get_object_or_404(UserAcl, user=request.user)
+    user_acl = get_request_user_acl(request)
 
     if request.GET.get('instance'):
         current_instance = get_object_or_404(WireGuardInstance, uuid=request.GET.get('instance'))
@@ -150,9 +152,10 @@ def view_wireguard_peer_manage(request):
                 priority=0,
                 netmask=32,
             )
-            messages.success(request, _('Peer created|Peer created successfully. In order for newly added peers to be able to connect, ensure that you update and reload your instance service.'))
-            new_peer.wireguard_instance.pending_changes = True
-            new_peer.wireguard_instance.save()
+            if apply_peer_change(new_peer):
+                messages.success(request, _('Peer created|Peer created successfully.'))
+            else:
+                messages.success(request, _('Peer created|Peer created successfully. In order for newly added peers to be able to connect, ensure that you update and reload your instance service.'))
             
             # Update mDNS configuration automatically
             try:
@@ -173,9 +176,9 @@ def view_wireguard_peer_manage(request):
         current_instance = current_peer.wireguard_instance
         if request.GET.get('action') == 'delete':
             if request.GET.get('confirmation') == 'delete':
-                current_peer.wireguard_instance.pending_changes = True
-                current_peer.wireguard_instance.save()
+                public_key = current_peer.public_key
                 current_peer.delete()
+                apply_peer_removal(current_instance, public_key)
                 messages.success(request, _('Peer deleted|Peer deleted successfully.'))
                 return redirect('/peer/list/?uuid=' + str(current_instance.uuid))
             else:
@@ -214,7 +217,7 @@ def view_manage_ip_address(request):
     if not UserAcl.objects.filter(user=request.user).filter(user_level__gte=30).exists():
         return render(request, 'access_denied.html', {'page_title': 'Access Denied'})
 
-    user_acl = get_object_or_404(UserAcl, user=request.user)
+    user_acl = get_request_user_acl(request)
     config_file = request.GET.get('config', 'server')
 
     if request.GET.get('peer'):
@@ -234,8 +237,11 @@ def view_manage_ip_address(request):
             if request.GET.get('confirmation') == 'delete':
                 current_ip.delete()
                 messages.success(request, _('IP address deleted|IP address deleted successfully.'))
-                current_peer.wireguard_instance.pending_changes = True
-                current_peer.wireguard_instance.save()
+                if config_file == 'server':
+                    apply_peer_change(current_peer)
+                else:
+                    current_peer.wireguard_instance.pending_changes = True
+                    current_peer.wireguard_instance.save()
                 return redirect('/peer/manage/?peer=' + str(current_peer.uuid))
             else:
                 messages.warning(request, _('Error deleting IP address|Invalid confirmation message. Type "delete" to confirm.'))
@@ -255,8 +261,11 @@ def view_manage_ip_address(request):
                 this_form.peer = current_peer
             this_form.config_file = config_file
             this_form.save()
-            current_peer.wireguard_instance.pending_changes = True
-            current_peer.wireguard_instance.save()
+            if config_file == 'server':
+                apply_peer_change(current_peer)
+            else:
+                current_peer.wireguard_instance.pending_changes = True
+                current_peer.wireguard_instance.save()
             if current_ip:
                 messages.success(request, _('IP address updated|IP address updated successfully.'))
             else:
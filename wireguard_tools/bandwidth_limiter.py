@@ -4,30 +4,140 @@ Bandwidth Limiting Script for WireGuard Instances
 This script generates traffic control (tc) commands to limit bandwidth for WireGuard interfaces.
 """
 
+import ipaddress
+import json
 import os
+import re
 import subprocess
 import logging
 
 logger = logging.getLogger(__name__)
 
-def generate_bandwidth_limiting_script(instance_id, bandwidth_mbps=50):
+def get_ifb_interface_name(instance_id):
+    """
+    Return the name of the IFB device used to shape ingress traffic of a WireGuard interface.
+
+    Args:
+        instance_id (int): WireGuard instance ID
+
+    Returns:
+        str: IFB interface name (kept under the 15 character IFNAMSIZ limit)
+    """
+    return f"ifbwg{instance_id}"
+
+
+def get_peer_class_id(index):
+    """
+    Return the HTB class id used for the peer at the given position of the peer list.
+    """
+    return f"1:{100 + index:x}"
+
+
+def get_peer_rate_kbit(bandwidth_mbps, peer_count):
+    """
+    Return the guaranteed rate of each peer class, a fair share of the instance limit.
+    """
+    return max((bandwidth_mbps * 1000) // peer_count, 1)
+
+
+def generate_peer_filter(interface, peer_address, class_id, match_field):
+    """
+    Generate the tc filter command that classifies a peer address into its class.
+    """
+    return f"tc filter add dev {interface} parent 1: protocol ip prio 1 u32 match ip {match_field} {peer_address} flowid {class_id}"
+
+
+def generate_peer_classes(interface, bandwidth_mbps, peer_addresses, match_field):
+    """
+    Generate per peer HTB classes and filters for an interface.
+
+    Every peer gets a guaranteed fair share of the instance limit and may borrow up to the full limit.
+
+    Args:
+        interface (str): Interface that holds the HTB tree (wgN for egress, ifbwgN for ingress)
+        bandwidth_mbps (int): Bandwidth limit in Mbps
+        peer_addresses (list): Peer addresses in CIDR notation
+        match_field (str): 'dst' for egress (download) or 'src' for ingress (upload)
+
+    Returns:
+        list: tc commands
+    """
+    script_lines = []
+    peer_rate_kbit = get_peer_rate_kbit(bandwidth_mbps, len(peer_addresses))
+    for index, peer_address in enumerate(peer_addresses):
+        class_id = get_peer_class_id(index)
+        script_lines.extend([
+            f"# Peer {peer_address}",
+            f"tc class add dev {interface} parent 1:1 classid {class_id} htb rate {peer_rate_kbit}kbit ceil {bandwidth_mbps}mbit",
+            generate_peer_filter(interface, peer_address, class_id, match_field),
+        ])
+    return script_lines
+
+
+def generate_ingress_shaping_script(instance_id, bandwidth_mbps=50, peer_addresses=None):
+    """
+    Generate tc commands to limit ingress (client upload) bandwidth of a WireGuard interface.
+
+    Ingress traffic cannot be queued directly, so it is redirected to an IFB device and shaped there
+    with the same HTB layout used for egress.
+
+    Args:
+        instance_id (int): WireGuard instance ID
+        bandwidth_mbps (int): Bandwidth limit in Mbps
+        peer_addresses (list): Optional peer addresses in CIDR notation for per peer shaping
+
+    Returns:
+        list: tc commands for ingress shaping
+    """
+    interface = f"wg{instance_id}"
+    ifb_interface = get_ifb_interface_name(instance_id)
+
+    script_lines = [
+        f"# Ingress (upload) shaping for {interface} via {ifb_interface}",
+        f"modprobe ifb numifbs=0 2>/dev/null || true",
+        f"ip link add {ifb_interface} type ifb 2>/dev/null || true",
+        f"ip link set dev {ifb_interface} up",
+        "",
+        f"# Redirect all traffic received on {interface} to {ifb_interface}",
+        f"tc qdisc del dev {interface} ingress 2>/dev/null || true",
+        f"tc qdisc add dev {interface} handle ffff: ingress",
+        f"tc filter add dev {interface} parent ffff: protocol all prio 1 u32 match u32 0 0 action mirred egress redirect dev {ifb_interface}",
+        "",
+        f"# Shape redirected traffic on {ifb_interface}",
+        f"tc qdisc del dev {ifb_interface} root 2>/dev/null || true",
+        f"tc qdisc add dev {ifb_interface} root handle 1: htb default 30",
+        f"tc class add dev {ifb_interface} parent 1: classid 1:1 htb rate {bandwidth_mbps}mbit",
+        f"tc class add dev {ifb_interface} parent 1:1 classid 1:30 htb rate {bandwidth_mbps}mbit ceil {bandwidth_mbps}mbit",
+    ]
+
+    if peer_addresses:
+        script_lines.append("")
+        script_lines.extend(generate_peer_classes(ifb_interface, bandwidth_mbps, peer_addresses, 'src'))
+
+    return script_lines
+
+
+def generate_bandwidth_limiting_script(instance_id, bandwidth_mbps=50, peer_addresses=None):
     """
     Generate tc commands to limit bandwidth for a WireGuard interface.
+
+    Egress (client download) is shaped on the WireGuard interface itself, ingress (client upload)
+    is shaped on a dedicated IFB device.
     
     Args:
         instance_id (int): WireGuard instance ID
         bandwidth_mbps (int): Bandwidth limit in Mbps
+        peer_addresses (list): Optional peer addresses in CIDR notation. When provided, each peer
+            gets its own class in both directions.
     
     Returns:
         str: tc commands for bandwidth limiting
     """
     interface = f"wg{instance_id}"
     
-    # Convert Mbps to bits per second for tc
-    bandwidth_bps = bandwidth_mbps * 1000000  # Convert Mbps to bps
-    
     # Generate tc commands
     script_lines = [
+        "#!/bin/bash",
         f"# Bandwidth limiting for {interface}",
         f"# Limit: {bandwidth_mbps} Mbps",
         "",
@@ -43,24 +153,21 @@ def generate_bandwidth_limiting_script(instance_id, bandwidth_mbps=50):
         f"# Add default class for all traffic",
         f"tc class add dev {interface} parent 1:1 classid 1:30 htb rate {bandwidth_mbps}mbit ceil {bandwidth_mbps}mbit",
         "",
-        f"# Add filter to direct all traffic to the default class",
-        f"tc filter add dev {interface} parent 1: protocol ip prio 1 u32 match ip src 0.0.0.0/0 flowid 1:30",
-        "",
-        f"# Optional: Add separate classes for upload and download if needed",
-        f"# Upload class (traffic from server to client)",
-        f"tc class add dev {interface} parent 1:1 classid 1:10 htb rate {bandwidth_mbps//2}mbit ceil {bandwidth_mbps}mbit",
-        "",
-        f"# Download class (traffic from client to server)", 
-        f"tc class add dev {interface} parent 1:1 classid 1:20 htb rate {bandwidth_mbps//2}mbit ceil {bandwidth_mbps}mbit",
-        "",
-        f"# Upload filter (outgoing traffic)",
-        f"tc filter add dev {interface} parent 1: protocol ip prio 2 u32 match ip dst 0.0.0.0/0 flowid 1:10",
+        f"# Add filter to direct remaining traffic to the default class (after any per peer filters)",
+        f"tc filter add dev {interface} parent 1: protocol ip prio 10 u32 match ip src 0.0.0.0/0 flowid 1:30",
         "",
-        f"# Download filter (incoming traffic)",
-        f"tc filter add dev {interface} parent 1: protocol ip prio 3 u32 match ip src 0.0.0.0/0 flowid 1:20",
+    ]
+
+    if peer_addresses:
+        script_lines.append(f"# Per peer egress (download) classes")
+        script_lines.extend(generate_peer_classes(interface, bandwidth_mbps, peer_addresses, 'dst'))
+        script_lines.append("")
+
+    script_lines.extend(generate_ingress_shaping_script(instance_id, bandwidth_mbps, peer_addresses))
+    script_lines.extend([
         "",
         f"echo 'Bandwidth limiting applied to {interface}: {bandwidth_mbps} Mbps'"
-    ]
+    ])
     
     return "\n".join(script_lines)
 
@@ -75,28 +182,34 @@ def generate_bandwidth_cleanup_script(instance_id):
         str: tc commands for cleanup
     """
     interface = f"wg{instance_id}"
+    ifb_interface = get_ifb_interface_name(instance_id)
     
     script_lines = [
+        "#!/bin/bash",
         f"# Remove bandwidth limiting from {interface}",
         f"tc qdisc del dev {interface} root 2>/dev/null || true",
+        f"tc qdisc del dev {interface} ingress 2>/dev/null || true",
+        f"tc qdisc del dev {ifb_interface} root 2>/dev/null || true",
+        f"ip link del {ifb_interface} 2>/dev/null || true",
         f"echo 'Bandwidth limiting removed from {interface}'"
     ]
     
     return "\n".join(script_lines)
 
-def apply_bandwidth_limiting(instance_id, bandwidth_mbps=50):
+def apply_bandwidth_limiting(instance_id, bandwidth_mbps=50, peer_addresses=None):
     """
     Apply bandwidth limiting to a WireGuard interface.
     
     Args:
         instance_id (int): WireGuard instance ID
         bandwidth_mbps (int): Bandwidth limit in Mbps
+        peer_addresses (list): Optional peer addresses in CIDR notation for per peer shaping
     
     Returns:
         bool: True if successful, False otherwise
     """
     try:
-        script_content = generate_bandwidth_limiting_script(instance_id, bandwidth_mbps)
+        script_content = generate_bandwidth_limiting_script(instance_id, bandwidth_mbps, peer_addresses)
         
         # Write script to temporary file
         script_path = f"/tmp/wg{instance_id}_bandwidth.sh"
@@ -220,3 +333,230 @@ def check_bandwidth_limiting_status(instance_id):
             'interface': interface,
             'error': str(e)
         }
+
+
+RATE_UNITS = {'bit': 1, 'kbit': 10 ** 3, 'mbit': 10 ** 6, 'gbit': 10 ** 9, 'tbit': 10 ** 12}
+TC_CLASS_LINE_REGEX = re.compile(r'^class htb (?P<class_id>\S+) (?:root|parent (?P<parent>\S+)).*? rate (?P<rate>\S+) ceil (?P<ceil>\S+)')
+
+
+def parse_tc_rate(rate):
+    """
+    Convert a tc rate string (e.g. '20Mbit', '6666Kbit') to bits per second.
+    """
+    match = re.match(r'^([\d.]+)([a-zA-Z]*)$', str(rate))
+    if not match:
+        return 0
+    return int(float(match.group(1)) * RATE_UNITS.get(match.group(2).lower() or 'bit', 1))
+
+
+def build_bandwidth_tree(instance_id, bandwidth_mbps=50, peer_addresses=None):
+    """
+    Build the desired shaping tree of an instance, mirroring generate_bandwidth_limiting_script.
+
+    Args:
+        instance_id (int): WireGuard instance ID
+        bandwidth_mbps (int): Bandwidth limit in Mbps
+        peer_addresses (list): Optional peer addresses in CIDR notation for per peer shaping
+
+    Returns:
+        dict: {device: {'classes': {class_id: {'parent', 'rate', 'ceil'}}, 'filters': {class_id: address}, 'match_field'}}
+    """
+    bandwidth_bps = bandwidth_mbps * RATE_UNITS['mbit']
+    tree = {}
+    for device, match_field in ((f"wg{instance_id}", 'dst'), (get_ifb_interface_name(instance_id), 'src')):
+        classes = {
+            '1:1': {'parent': None, 'rate': bandwidth_bps, 'ceil': bandwidth_bps},
+            '1:30': {'parent': '1:1', 'rate': bandwidth_bps, 'ceil': bandwidth_bps},
+        }
+        filters = {}
+        if peer_addresses:
+            peer_rate_bps = get_peer_rate_kbit(bandwidth_mbps, len(peer_addresses)) * RATE_UNITS['kbit']
+            for index, peer_address in enumerate(peer_addresses):
+                class_id = get_peer_class_id(index)
+                classes[class_id] = {'parent': '1:1', 'rate': peer_rate_bps, 'ceil': bandwidth_bps}
+                filters[class_id] = str(ipaddress.ip_network(peer_address, strict=False))
+        tree[device] = {'classes': classes, 'filters': filters, 'match_field': match_field}
+    return tree
+
+
+def run_tc_show(*args):
+    """
+    Run a 'tc -j <object> show' command and return the parsed JSON, the raw text when the
+    installed iproute2 does not support JSON for that object, or None if the device does not exist.
+    """
+    result = subprocess.run(['tc', '-j', *args], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    try:
+        return json.loads(result.stdout)
+    except ValueError:
+        return result.stdout
+
+
+def read_live_classes(device):
+    """
+    Read the HTB classes of a device as {class_id: {'parent', 'rate', 'ceil'}} (rates in bits per second).
+    """
+    output = run_tc_show('class', 'show', 'dev', device)
+    classes = {}
+    if isinstance(output, list):
+        for tc_class in output:
+            if tc_class.get('class') != 'htb':
+                continue
+            # JSON output reports rates in bytes per second
+            classes[tc_class['handle']] = {
+                'parent': tc_class.get('parent'),
+                'rate': int(tc_class.get('rate', 0)) * 8,
+                'ceil': int(tc_class.get('ceil', 0)) * 8,
+            }
+    elif isinstance(output, str):
+        for line in output.splitlines():
+            match = TC_CLASS_LINE_REGEX.match(line.strip())
+            if match:
+                classes[match.group('class_id')] = {
+                    'parent': match.group('parent'),
+                    'rate': parse_tc_rate(match.group('rate')),
+                    'ceil': parse_tc_rate(match.group('ceil')),
+                }
+    return classes
+
+
+def read_live_peer_filters(device):
+    """
+    Read the per peer u32 filters (prio 1) of a device as {class_id: address}.
+
+    Returns None when the filters cannot be parsed, so callers rebuild them.
+    """
+    output = run_tc_show('filter', 'show', 'dev', device, 'parent', '1:')
+    if not isinstance(output, list):
+        return None
+    filters = {}
+    for tc_filter in output:
+        options = tc_filter.get('options', {})
+        if tc_filter.get('pref') != 1 or 'flowid' not in options:
+            continue
+        match = options.get('match', {})
+        try:
+            address = ipaddress.ip_address(int(match['value'], 16))
+            prefix_length = bin(int(match['mask'], 16)).count('1')
+        except (KeyError, ValueError):
+            return None
+        filters[options['flowid']] = str(ipaddress.ip_network(f"{address}/{prefix_length}", strict=False))
+    return filters
+
+
+def read_live_bandwidth_state(instance_id):
+    """
+    Take a single snapshot of the live shaping state (qdiscs, classes and peer filters) of an instance.
+
+    Returns:
+        dict: {device: {'qdiscs': list, 'classes': dict, 'filters': dict}} or None if wgN does not exist
+    """
+    state = {}
+    for device in (f"wg{instance_id}", get_ifb_interface_name(instance_id)):
+        qdiscs = run_tc_show('qdisc', 'show', 'dev', device)
+        if qdiscs is None:
+            if device.startswith('wg'):
+                return None
+            state[device] = {'qdiscs': [], 'classes': {}, 'filters': {}}
+            continue
+        state[device] = {
+            'qdiscs': qdiscs if isinstance(qdiscs, list) else [],
+            'classes': read_live_classes(device),
+            'filters': read_live_peer_filters(device),
+        }
+    return state
+
+
+def rates_differ(live_rate, desired_rate):
+    """
+    Compare rates allowing for the rounding tc applies when printing them.
+    """
+    return abs(live_rate - desired_rate) > max(desired_rate // 100, 1000)
+
+
+def diff_bandwidth_tree(instance_id, desired_tree, live_state):
+    """
+    Compute the tc batch commands that turn the live shaping state into the desired tree.
+
+    Returns:
+        list: tc batch commands (without the leading 'tc'), or None when the base qdiscs are missing
+              and the full script has to be applied instead.
+    """
+    interface = f"wg{instance_id}"
+    interface_qdiscs = {(qdisc.get('kind'), qdisc.get('handle')) for qdisc in live_state[interface]['qdiscs']}
+    if ('ingress', 'ffff:') not in interface_qdiscs:
+        return None
+
+    commands = []
+    for device, desired in desired_tree.items():
+        live = live_state[device]
+        if ('htb', '1:') not in {(qdisc.get('kind'), qdisc.get('handle')) for qdisc in live['qdiscs']}:
+            return None
+
+        add_commands = []
+        for class_id, desired_class in desired['classes'].items():
+            parent = desired_class['parent'] or '1:'
+            class_spec = f"htb rate {desired_class['rate']}bit ceil {desired_class['ceil']}bit"
+            live_class = live['classes'].get(class_id)
+            if not live_class:
+                add_commands.append(f"class add dev {device} parent {parent} classid {class_id} {class_spec}")
+            elif rates_differ(live_class['rate'], desired_class['rate']) or rates_differ(live_class['ceil'], desired_class['ceil']):
+                commands.append(f"class change dev {device} parent {parent} classid {class_id} {class_spec}")
+        commands.extend(add_commands)
+
+        stale_classes = [class_id for class_id in live['classes'] if class_id not in desired['classes']]
+        if live['filters'] != desired['filters'] or stale_classes:
+            # Peer filters are rebuilt as a group, traffic falls back to the default class meanwhile
+            if live['filters'] is None or live['filters']:
+                commands.append(f"filter del dev {device} parent 1: protocol ip prio 1")
+            for class_id, peer_address in desired['filters'].items():
+                commands.append(generate_peer_filter(device, peer_address, class_id, desired['match_field']).removeprefix('tc '))
+        for class_id in stale_classes:
+            commands.append(f"class del dev {device} classid {class_id}")
+    return commands
+
+
+def sync_bandwidth_limiting(instance_id, bandwidth_mbps=50, peer_addresses=None):
+    """
+    Apply bandwidth limit changes to a running interface without restarting it.
+
+    The live shaping tree is compared against the desired tree and only the delta is applied with
+    'tc class change' and friends in a single tc batch. If the base qdiscs are missing, the full
+    bandwidth script is applied instead.
+
+    Args:
+        instance_id (int): WireGuard instance ID
+        bandwidth_mbps (int): Bandwidth limit in Mbps
+        peer_addresses (list): Optional peer addresses in CIDR notation for per peer shaping
+
+    Returns:
+        bool: True if successful (or nothing to change), False otherwise
+    """
+    try:
+        live_state = read_live_bandwidth_state(instance_id)
+        if live_state is None:
+            logger.info(f"wg{instance_id} is not running, bandwidth limits will be applied on interface start")
+            return True
+
+        commands = diff_bandwidth_tree(instance_id, build_bandwidth_tree(instance_id, bandwidth_mbps, peer_addresses), live_state)
+        if commands is None:
+            logger.info(f"Shaping tree missing on wg{instance_id}, applying full bandwidth script")
+            return apply_bandwidth_limiting(instance_id, bandwidth_mbps, peer_addresses)
+
+        if not commands:
+            logger.debug(f"Bandwidth limiting on wg{instance_id} already up to date")
+            return True
+
+        subprocess.run(['tc', '-batch', '-'], input="\n".join(commands) + "\n", capture_output=True, text=True, check=True)
+        logger.info(f"Bandwidth limiting updated live on wg{instance_id}: {bandwidth_mbps} Mbps ({len(commands)} tc changes)")
+        logger.debug("Applied tc commands: " + "; ".join(commands))
+        return True
+
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Failed to update bandwidth limiting on wg{instance_id}: {e}")
+        logger.error(f"tc stderr: {e.stderr}")
+        return False
+    except Exception as e:
+        logger.error(f"Unexpected error updating bandwidth limiting on wg{instance_id}: {e}")
+        return False
@@ -0,0 +1,252 @@
+"""
+Detect drift between the database and the running WireGuard, tc and iptables state of this node.
+
+The desired state is rendered from the database and compared with one 'wg show all dump' snapshot, so the
+check costs a single wg call whatever the number of interfaces. Drift is reported per instance and can be
+healed with the minimal 'wg set' operations from wireguard_tools.live_apply.
+"""
+import ipaddress
+import logging
+import subprocess
+
+from django.db.models import Prefetch
+
+from firewall.models import FirewallSettings
+from firewall.tools import generate_firewall_diff_payload, get_dns_ip
+from wireguard.models import Peer, PeerAllowedIP, WireGuardInstance
+from .bandwidth_limiter import build_bandwidth_tree, diff_bandwidth_tree, read_live_bandwidth_state
+from .live_apply import mark_instance_changed, remove_live_peer, set_live_peer
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_allowed_ip(allowed_ip):
+    # The kernel keeps allowed IPs as masked networks
+    return str(ipaddress.ip_network(allowed_ip, strict=False))
+
+
+def read_live_interfaces():
+    """
+    Read every interface with a single 'wg show all dump'.
+
+    Returns {interface: {'public_key', 'listen_port', 'peers': {public_key: {'preshared_key', 'allowed_ips',
+    'persistent_keepalive'}}}}. Raises RuntimeError with the wg error output on failure.
+    """
+    process = subprocess.run(['wg', 'show', 'all', 'dump'], capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr)
+
+    interfaces = {}
+    for line in process.stdout.splitlines():
+        parts = line.split('\t')
+        if len(parts) == 5:
+            # interface, private key, public key, listen port, fwmark
+            interface, private_key, public_key, listen_port, fwmark = parts
+            interfaces.setdefault(interface, {'peers': {}}).update(public_key=public_key, listen_port=int(listen_port))
+        elif len(parts) == 9:
+            # interface, public key, preshared key, endpoint, allowed ips, latest handshake, rx, tx, keepalive
+            interface, public_key, preshared_key, endpoint, allowed_ips, latest_handshake, rx, tx, keepalive = parts
+            interfaces.setdefault(interface, {'peers': {}})['peers'][public_key] = {
+                'preshared_key': '' if preshared_key == '(none)' else preshared_key,
+                'allowed_ips': frozenset(
+                    normalize_allowed_ip(allowed_ip) for allowed_ip in allowed_ips.split(',') if allowed_ip != '(none)'
+                ),
+                'persistent_keepalive': 0 if keepalive == 'off' else int(keepalive),
+            }
+    return interfaces
+
+
+def render_desired_interfaces(instances):
+    """Render the interfaces the database describes, in the format of read_live_interfaces(), keyed by instance pk."""
+    desired = {
+        instance.pk: {'public_key': instance.public_key, 'listen_port': instance.listen_port, 'peers': {}}
+        for instance in instances
+    }
+    peers = Peer.objects.filter(wireguard_instance__in=instances).prefetch_related(
+        Prefetch('peerallowedip_set', queryset=PeerAllowedIP.objects.filter(config_file='server'))
+    )
+    for peer in peers:
+        desired[peer.wireguard_instance_id]['peers'][peer.public_key] = {
+            'preshared_key': peer.pre_shared_key or '',
+            'allowed_ips': frozenset(
+                normalize_allowed_ip(f"{peer_ip.allowed_ip}/{peer_ip.netmask}") for peer_ip in peer.peerallowedip_set.all()
+            ),
+            'persistent_keepalive': peer.persistent_keepalive or 0,
+        }
+    return desired
+
+
+def diff_interface(desired, live):
+    """Compare one interface. Returns (interface_fields, missing_peers, extra_peers, changed_peers)."""
+    interface_fields = [field for field in ('public_key', 'listen_port') if desired[field] != live.get(field)]
+    missing_peers = sorted(public_key for public_key in desired['peers'] if public_key not in live['peers'])
+    extra_peers = sorted(public_key for public_key in live['peers'] if public_key not in desired['peers'])
+    changed_peers = {}
+    for public_key, desired_peer in desired['peers'].items():
+        live_peer = live['peers'].get(public_key)
+        if live_peer is not None:
+            fields = [field for field in desired_peer if desired_peer[field] != live_peer[field]]
+            if fields:
+                changed_peers[public_key] = fields
+    return interface_fields, missing_peers, extra_peers, changed_peers
+
+
+def check_bandwidth_drift(instance):
+    """Return 'ok', 'drift', 'missing' (no shaping tree) or 'unknown' for the tc state of a running interface."""
+    from .views import get_bandwidth_peer_addresses
+
+    if not instance.bandwidth_limit_enabled:
+        return 'ok'
+    try:
+        live_state = read_live_bandwidth_state(instance.instance_id)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read tc state of wg{instance.instance_id}: {e}")
+        return 'unknown'
+    if live_state is None:
+        return 'unknown'
+    desired_tree = build_bandwidth_tree(
+        instance.instance_id, instance.bandwidth_limit_mbps, get_bandwidth_peer_addresses(instance)
+    )
+    commands = diff_bandwidth_tree(instance.instance_id, desired_tree, live_state)
+    if commands is None:
+        return 'missing'
+    return 'drift' if commands else 'ok'
+
+
+def check_firewall_drift():
+    """
+    Return the number of iptables rule changes needed to match the database, or None when it cannot be
+    told (nftables backend, or the live chains cannot be read).
+    """
+    from .views import compile_firewall_rules
+
+    firewall_settings, firewall_settings_created = FirewallSettings.objects.get_or_create(name='global')
+    if firewall_settings.firewall_backend != 'iptables':
+        return None
+    payload = generate_firewall_diff_payload(compile_firewall_rules(firewall_settings=firewall_settings), get_dns_ip())
+    if payload is None:
+        return None
+    return len([line for line in payload.splitlines() if line.startswith(('-D ', '-I ', ':'))])
+
+
+def detect_wireguard_drift(node_hostname=None):
+    """
+    Compare the database with the running state of this node.
+
+    Instances whose interface runs here are checked, as well as instances of 'node_hostname' that should
+    run here but do not. Returns {'instances': [report, ...], 'orphan_interfaces': [...], 'firewall_changes'}.
+    A report has 'drift' True when the interface, its peers or its tc state differ from the database.
+    """
+    live_interfaces = read_live_interfaces()
+    instances = list(WireGuardInstance.objects.order_by('instance_id'))
+    known_interfaces = {f"wg{instance.instance_id}" for instance in instances}
+    instances = [
+        instance for instance in instances
+        if f"wg{instance.instance_id}" in live_interfaces or (node_hostname and instance.hostname == node_hostname)
+    ]
+    desired_interfaces = render_desired_interfaces(instances)
+
+    reports = []
+    for instance in instances:
+        interface_name = f"wg{instance.instance_id}"
+        report = {
+            'instance_id': instance.instance_id,
+            'interface': interface_name,
+            'name': instance.name,
+            'running': interface_name in live_interfaces,
+            'pending_changes': instance.pending_changes,
+            'interface_fields': [],
+            'missing_peers': [],
+            'extra_peers': [],
+            'changed_peers': {},
+            'bandwidth': 'unknown',
+        }
+        if report['running']:
+            (
+                report['interface_fields'], report['missing_peers'], report['extra_peers'], report['changed_peers']
+            ) = diff_interface(desired_interfaces[instance.pk], live_interfaces[interface_name])
+            report['bandwidth'] = check_bandwidth_drift(instance)
+        report['drift'] = (
+            not report['running'] or bool(report['interface_fields'] or report['missing_peers'] or report['extra_peers'])
+            or bool(report['changed_peers']) or report['bandwidth'] in ('drift', 'missing')
+        )
+        reports.append(report)
+
+    try:
+        firewall_changes = check_firewall_drift()
+    except Exception as e:
+        logger.warning(f"Could not compare the firewall rules: {e}")
+        firewall_changes = None
+
+    return {
+        'instances': reports,
+        'orphan_interfaces': sorted(interface for interface in live_interfaces if interface not in known_interfaces),
+        'firewall_changes': firewall_changes,
+    }
+
+
+def heal_instance_drift(instance, report):
+    """
+    Bring the peers and tc state of a running interface in line with the database with 'wg set' and tc
+    changes. Interface level drift (key, port) and stopped interfaces need reload_wireguard_instance().
+    Returns the number of operations that failed.
+    """
+    from .views import sync_instance_bandwidth
+
+    failed = 0
+    peers = {peer.public_key: peer for peer in Peer.objects.filter(
+        wireguard_instance=instance, public_key__in=report['missing_peers'] + list(report['changed_peers'])
+    ).select_related('wireguard_instance')}
+    for public_key, peer in peers.items():
+        if not set_live_peer(peer):
+            failed += 1
+    for public_key in report['extra_peers']:
+        if not remove_live_peer(instance.instance_id, public_key):
+            failed += 1
+    peers_changed = bool(peers or report['extra_peers'])
+    # Per peer classes follow the peer addresses
+    per_peer_classes_changed = peers_changed and instance.bandwidth_limit_enabled and instance.bandwidth_limit_per_peer
+    if report['bandwidth'] in ('drift', 'missing') or per_peer_classes_changed:
+        if not sync_instance_bandwidth(instance):
+            failed += 1
+    if peers_changed:
+        mark_instance_changed(instance, True)
+    logger.info(
+        f"Healed drift on wg{instance.instance_id}: {len(peers)} peers set, {len(report['extra_peers'])} removed, "
+        f"{failed} failed"
+    )
+    return failed
+
+
+def reconcile_wireguard_drift(node_hostname=None, heal=False):
+    """
+    Detect drift and, with 'heal', fix it with minimal changes.
+
+    Instances with pending changes are reported but not healed: they differ from the running interface
+    until somebody reloads them. The firewall is healed with the differential apply.
+    Returns the drift report, healed instances get 'healed' True.
+    """
+    from .views import apply_firewall_configuration
+
+    drift = detect_wireguard_drift(node_hostname)
+    for report in drift['instances']:
+        if report['drift']:
+            logger.warning(
+                f"Drift on {report['interface']}: running={report['running']} interface={report['interface_fields']} "
+                f"missing={len(report['missing_peers'])} extra={len(report['extra_peers'])} "
+                f"changed={len(report['changed_peers'])} bandwidth={report['bandwidth']}"
+            )
+    if drift['orphan_interfaces']:
+        logger.warning(f"Interfaces without instance: {', '.join(drift['orphan_interfaces'])}")
+    if not heal:
+        return drift
+
+    for report in drift['instances']:
+        report['healed'] = False
+        if not report['drift'] or not report['running'] or report['pending_changes'] or report['interface_fields']:
+            continue
+        instance = WireGuardInstance.objects.get(instance_id=report['instance_id'])
+        report['healed'] = heal_instance_drift(instance, report) == 0
+    if drift['firewall_changes']:
+        drift['firewall_healed'] = apply_firewall_configuration()
+    return drift
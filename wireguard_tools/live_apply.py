@@ -0,0 +1,112 @@
+"""
+Apply single peer changes to a running WireGuard interface with 'wg set'.
+
+Only the changed peer is sent to the kernel, so the time to apply a change does not depend on the size of
+the interface. The configuration file is not rewritten here: the instance is flagged config_outdated and
+write_outdated_wireguard_configs() rewrites the file later, making the file eventually consistent with
+the running interface. When the interface is not running on this node the change falls back to the
+pending changes flag and a regular reload.
+"""
+import logging
+import subprocess
+
+from wireguard.models import PeerAllowedIP, WireGuardInstance
+
+logger = logging.getLogger(__name__)
+
+
+def interface_is_running(interface_name):
+    try:
+        return subprocess.run(['wg', 'show', interface_name], capture_output=True, text=True).returncode == 0
+    except FileNotFoundError:
+        return False
+
+
+def get_peer_server_allowed_ips(peer):
+    return [
+        f"{peer_ip.allowed_ip}/{peer_ip.netmask}" for peer_ip in PeerAllowedIP.objects.filter(
+            peer=peer, config_file='server'
+        ).order_by('priority')
+    ]
+
+
+def set_live_peer(peer):
+    """
+    Add or update a peer on its running interface: public key, preshared key, keepalive and allowed IPs.
+    Returns True when the peer was applied.
+    """
+    interface_name = f"wg{peer.wireguard_instance.instance_id}"
+    command = [
+        'wg', 'set', interface_name, 'peer', peer.public_key,
+        # An empty file removes the preshared key
+        'preshared-key', '/dev/stdin' if peer.pre_shared_key else '/dev/null',
+        'persistent-keepalive', str(peer.persistent_keepalive or 'off'),
+        'allowed-ips', ','.join(get_peer_server_allowed_ips(peer)),
+    ]
+    try:
+        result = subprocess.run(command, input=peer.pre_shared_key or '', capture_output=True, text=True)
+    except FileNotFoundError:
+        return False
+    if result.returncode != 0:
+        logger.error(f"Error setting peer {peer.public_key} on {interface_name}: {result.stderr}")
+        return False
+    return True
+
+
+def remove_live_peer(instance_id, public_key):
+    """Remove a peer from its running interface. Returns True when the peer was removed."""
+    interface_name = f"wg{instance_id}"
+    try:
+        result = subprocess.run(
+            ['wg', 'set', interface_name, 'peer', public_key, 'remove'], capture_output=True, text=True
+        )
+    except FileNotFoundError:
+        return False
+    if result.returncode != 0:
+        logger.error(f"Error removing peer {public_key} from {interface_name}: {result.stderr}")
+        return False
+    return True
+
+
+def mark_instance_changed(instance, applied_live):
+    """
+    Record how a peer change reached the instance: applied live, the config file is now outdated, or
+    not applied, the instance has pending changes and needs a reload.
+    """
+    from wgwadmlibrary.tools import update_pending_changes_flag
+
+    if applied_live:
+        WireGuardInstance.objects.filter(pk=instance.pk).update(config_outdated=True)
+    else:
+        WireGuardInstance.objects.filter(pk=instance.pk).update(pending_changes=True)
+        update_pending_changes_flag()
+
+
+def apply_peer_change(peer):
+    """
+    Apply a new or changed peer to its running interface. Returns True when it was applied live,
+    otherwise the instance is flagged with pending changes.
+    """
+    from wireguard_tools.views import sync_instance_bandwidth
+
+    instance = peer.wireguard_instance
+    applied_live = interface_is_running(f"wg{instance.instance_id}") and set_live_peer(peer)
+    if applied_live and instance.bandwidth_limit_enabled and instance.bandwidth_limit_per_peer:
+        # Per peer classes follow the peer addresses
+        sync_instance_bandwidth(instance)
+    mark_instance_changed(instance, applied_live)
+    return applied_live
+
+
+def apply_peer_removal(instance, public_key):
+    """
+    Remove a deleted peer from its running interface. Returns True when it was removed live, otherwise
+    the instance is flagged with pending changes.
+    """
+    from wireguard_tools.views import sync_instance_bandwidth
+
+    applied_live = interface_is_running(f"wg{instance.instance_id}") and remove_live_peer(instance.instance_id, public_key)
+    if applied_live and instance.bandwidth_limit_enabled and instance.bandwidth_limit_per_peer:
+        sync_instance_bandwidth(instance)
+    mark_instance_changed(instance, applied_live)
+    return applied_live
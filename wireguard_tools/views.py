@@ -6,6 +6,7 @@ from io import BytesIO
 import qrcode
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.db.models import Prefetch
 from django.http import HttpResponse
 from django.shortcuts import Http404, get_object_or_404, redirect, render
 from django.utils import timezone
@@ -16,14 +17,17 @@ import logging
 logger = logging.getLogger(__name__)
 
 from dns.views import export_dns_configuration
-from firewall.models import RedirectRule
-from firewall.tools import export_user_firewall, generate_firewall_footer, generate_firewall_header, \
-    generate_port_forward_firewall, generate_redirect_dns_rules
+from firewall.models import FirewallSettings, RedirectRule
+from firewall.nftables import generate_nftables_script
+from firewall.tools import add_firewall_ipset_members, apply_firewall_diff, export_firewall_ipsets, export_user_firewall, \
+    generate_firewall_apply, generate_firewall_base_rules, generate_firewall_footer, generate_firewall_header, \
+    generate_port_forward_firewall, generate_redirect_dns_rules, get_firewall_rules
 from user_manager.models import UserAcl
 from vpn_invite.models import PeerInvite
-from wgwadmlibrary.tools import user_has_access_to_peer
+from wgwadmlibrary.tools import get_request_user_acl, user_has_access_to_instance, user_has_access_to_peer
 from wireguard.models import Peer, PeerAllowedIP, WireGuardInstance
-from .bandwidth_limiter import generate_bandwidth_limiting_script, generate_bandwidth_cleanup_script
+from .bandwidth_limiter import generate_bandwidth_limiting_script, generate_bandwidth_cleanup_script, \
+    remove_bandwidth_limiting, sync_bandwidth_limiting
 
 
 def clean_command_field(command_field):
@@ -72,6 +76,13 @@ def stop_and_remove_interface(instance_id):
         else:
             logger.info(f"No config file found to remove for {interface_name} at {config_path}")
 
+        for script_path in (
+            os.path.join(config_dir, f"{interface_name}_bandwidth.sh"),
+            os.path.join(config_dir, f"{interface_name}_bandwidth_cleanup.sh"),
+        ):
+            if os.path.exists(script_path):
+                os.remove(script_path)
+
     except Exception as e:
         logger.error(
             f"Unexpected error while stopping/removing WireGuard interface for instance "
@@ -79,6 +90,45 @@ def stop_and_remove_interface(instance_id):
         )
 
 
+def cleanup_removed_instance(instance_id):
+    """
+    Clean up the running system after an instance was deleted with suppress_model_signals().
+
+    Stops the removed interface and deletes its files, then refreshes the firewall, the DNS hosts file and
+    the pending changes flag once. The other interfaces are not touched.
+
+    Returns:
+        tuple: (success: bool, message: str)
+    """
+    from wgwadmlibrary.tools import update_pending_changes_flag
+    from wireguard.dns_utils import reload_dnsmasq, write_dnsmasq_hosts_file
+
+    stop_and_remove_interface(instance_id)
+
+    errors = []
+    try:
+        if not apply_firewall_configuration():
+            errors.append('firewall')
+    except Exception as e:
+        logger.error(f"Error applying firewall after removing wg{instance_id}: {e}")
+        errors.append('firewall')
+
+    try:
+        if write_dnsmasq_hosts_file():
+            reload_dnsmasq()
+        else:
+            errors.append('DNS')
+    except Exception as e:
+        logger.error(f"Error updating DNS after removing wg{instance_id}: {e}")
+        errors.append('DNS')
+
+    update_pending_changes_flag()
+
+    if errors:
+        return False, f"Interface wg{instance_id} removed, failed to update: {', '.join(errors)}"
+    return True, f"Interface wg{instance_id} removed"
+
+
 def disconnect_instance_by_email(email):
     """
     Disconnect a WireGuard instance by user email (instance name).
@@ -100,18 +150,11 @@ def disconnect_instance_by_email(email):
         
         instance_id = instance.instance_id
         
-        # Stop the interface and remove config file
+        # Stop the interface and remove config file, the other interfaces are not affected
         stop_and_remove_interface(instance_id)
-        
-        # Reload WireGuard interfaces to apply changes
-        success, message = reload_wireguard_interfaces()
-        
-        if success:
-            logger.info(f"Successfully disconnected instance wg{instance_id} for user {email}")
-            return True, f"Instance wg{instance_id} disconnected successfully", instance_id
-        else:
-            logger.warning(f"Disconnected instance wg{instance_id} but reload failed: {message}")
-            return True, f"Instance wg{instance_id} disconnected but reload failed: {message}", instance_id
+
+        logger.info(f"Successfully disconnected instance wg{instance_id} for user {email}")
+        return True, f"Instance wg{instance_id} disconnected successfully", instance_id
             
     except Exception as e:
         logger.error(f"Error disconnecting instance for email {email}: {e}")
@@ -120,6 +163,31 @@ def disconnect_instance_by_email(email):
         return False, f"Error disconnecting instance: {str(e)}", None
 
 
+def syncconf_interface(interface_name, config_path):
+    """
+    Apply the peers of a configuration file to a running interface with 'wg syncconf'.
+    wg-quick only lines (Address, PostUp, PostDown) are stripped first. Returns the CompletedProcess.
+    """
+    with open(config_path, 'r') as f:
+        lines = f.readlines()
+
+    filtered_lines = []
+    for line in lines:
+        stripped_line = line.strip()
+        if stripped_line.startswith("Address") or stripped_line.startswith("PostUp") or stripped_line.startswith("PostDown"):
+            continue
+        filtered_lines.append(line)
+
+    temp_config_path = f"/tmp/wgreload_{interface_name}.conf"
+    with open(temp_config_path, 'w') as f:
+        f.writelines(filtered_lines)
+
+    try:
+        return subprocess.run(['wg', 'syncconf', interface_name, temp_config_path], capture_output=True, text=True)
+    finally:
+        os.remove(temp_config_path)
+
+
 def reload_wireguard_interfaces():
     """
     Reload all WireGuard interfaces to apply configuration changes.
@@ -157,6 +225,9 @@ def reload_wireguard_interfaces():
         except Exception as e:
             logger.warning(f"Failed to export configuration: {e}")
         
+        # syncconf would drop peers that were only applied live, write their files first
+        write_outdated_wireguard_configs()
+
         # Get list of currently running interfaces
         try:
             result = subprocess.run(['wg', 'show', 'interfaces'], capture_output=True, text=True, check=True)
@@ -182,27 +253,7 @@ def reload_wireguard_interfaces():
                     if interface_name in running_interfaces:
                         logger.info(f"Interface {interface_name} is running, reloading...")
                         
-                        # Create a temporary config without the interface section for syncconf
-                        with open(config_path, 'r') as f:
-                            lines = f.readlines()
-                        
-                        filtered_lines = []
-                        for line in lines:
-                            stripped_line = line.strip()
-                            if stripped_line.startswith("Address") or stripped_line.startswith("PostUp") or stripped_line.startswith("PostDown"):
-                                continue
-                            filtered_lines.append(line)
-
-                        temp_config_path = f"/tmp/wgreload_{interface_name}.conf"
-                        with open(temp_config_path, 'w') as f:
-                            f.writelines(filtered_lines)
-
-                        reload_command = f"wg syncconf {interface_name} {temp_config_path}"
-                        result = subprocess.run(reload_command, shell=True, capture_output=True, text=True)
-                        
-                        # Clean up temp file
-                        if os.path.exists(temp_config_path):
-                            os.remove(temp_config_path)
+                        result = syncconf_interface(interface_name, config_path)
 
                         if result.returncode != 0:
                             logger.error(f"Error reloading {interface_name}: {result.stderr}")
@@ -331,7 +382,7 @@ def download_remote_access_file(request):
         return render(request, 'access_denied.html', {'page_title': 'Access Denied'})
     
     peer = get_object_or_404(Peer, uuid=request.GET.get('uuid'))
-    user_acl = get_object_or_404(UserAcl, user=request.user)
+    user_acl = get_request_user_acl(request)
 
     if not user_has_access_to_peer(user_acl, peer):
         raise Http404
@@ -366,171 +417,343 @@ def download_remote_access_file(request):
     return response
 
 
-def export_firewall_configuration():
-    firewall_content = generate_firewall_header()
-    firewall_content += generate_redirect_dns_rules()
-    firewall_content += generate_port_forward_firewall()
-    firewall_content += export_user_firewall()
-    firewall_content += generate_firewall_footer()
+def get_bandwidth_peer_addresses(instance):
+    """
+    Return the peer addresses used for per peer bandwidth classes, or None when per peer limiting is disabled.
+    """
+    if not instance.bandwidth_limit_per_peer:
+        return None
+    return [
+        f"{peer_ip.allowed_ip}/{peer_ip.netmask}" for peer_ip in PeerAllowedIP.objects.filter(
+            peer__wireguard_instance=instance, config_file='server', priority=0
+        ).order_by('peer__sort_order', 'peer__created')
+    ]
+
+
+def sync_instance_bandwidth(instance):
+    """
+    Bring the bandwidth limits of a running interface in line with the database without restarting it.
+    """
+    if instance.bandwidth_limit_enabled:
+        return sync_bandwidth_limiting(instance.instance_id, instance.bandwidth_limit_mbps, get_bandwidth_peer_addresses(instance))
+    return remove_bandwidth_limiting(instance.instance_id)
+
+
+def export_bandwidth_scripts(instance):
+    """
+    Write the bandwidth limiting and cleanup scripts of an instance to /etc/wireguard.
+
+    When per peer limiting is enabled, every peer gets its own egress and ingress class.
+
+    Returns:
+        tuple: (bandwidth_script_path, bandwidth_cleanup_script_path)
+    """
+    bandwidth_script_path = f'/etc/wireguard/wg{instance.instance_id}_bandwidth.sh'
+    bandwidth_cleanup_script_path = f'/etc/wireguard/wg{instance.instance_id}_bandwidth_cleanup.sh'
+
+    bandwidth_script_content = generate_bandwidth_limiting_script(
+        instance.instance_id,
+        instance.bandwidth_limit_mbps,
+        get_bandwidth_peer_addresses(instance)
+    )
+    bandwidth_cleanup_script_content = generate_bandwidth_cleanup_script(instance.instance_id)
+
+    with open(bandwidth_script_path, 'w') as f:
+        f.write(bandwidth_script_content)
+    os.chmod(bandwidth_script_path, 0o755)
+
+    with open(bandwidth_cleanup_script_path, 'w') as f:
+        f.write(bandwidth_cleanup_script_content)
+    os.chmod(bandwidth_cleanup_script_path, 0o755)
+
+    return bandwidth_script_path, bandwidth_cleanup_script_path
+
+
+def compile_firewall_rules(user_rules=None, firewall_settings=None):
+    if user_rules is None:
+        user_rules = get_firewall_rules()
+    if firewall_settings is None:
+        firewall_settings, firewall_settings_created = FirewallSettings.objects.get_or_create(name='global')
+    firewall_rules = generate_firewall_base_rules()
+    firewall_rules += generate_redirect_dns_rules(firewall_settings)
+    firewall_rules += generate_port_forward_firewall(firewall_settings)
+    firewall_rules += export_user_firewall(user_rules)
+    firewall_rules += generate_firewall_footer(firewall_settings)
+    return firewall_rules
+
+
+def export_firewall_configuration(firewall_settings=None, firewall_rules=None, firewall_ipsets=None):
+    """
+    Write /etc/wireguard/wg-firewall.sh. Callers that already compiled the rules pass the settings,
+    rules and ipsets so the firewall is compiled once.
+    """
+    if firewall_settings is None:
+        firewall_settings, firewall_settings_created = FirewallSettings.objects.get_or_create(name='global')
     firewall_path = "/etc/wireguard/wg-firewall.sh"
+    if firewall_settings.firewall_backend == 'nftables':
+        with open(firewall_path, "w") as firewall_file:
+            firewall_file.write(generate_nftables_script(firewall_settings))
+        subprocess.run(['chmod', '+x', firewall_path], check=True)
+        return
+
+    if firewall_rules is None:
+        user_rules = get_firewall_rules()
+        firewall_rules = compile_firewall_rules(user_rules, firewall_settings)
+        firewall_ipsets = export_firewall_ipsets(user_rules)
+    firewall_content = generate_firewall_header()
+    firewall_content += generate_firewall_apply(firewall_rules, firewall_ipsets)
     with open(firewall_path, "w") as firewall_file:
         firewall_file.write(firewall_content)
     subprocess.run(['chmod', '+x', firewall_path], check=True)
     return
 
 
-@login_required
-def export_wireguard_configs(request):
-    if not UserAcl.objects.filter(user=request.user).filter(user_level__gte=30).exists():
-        return render(request, 'access_denied.html', {'page_title': 'Access Denied'})
-    instances = WireGuardInstance.objects.all()
-    base_dir = "/etc/wireguard"
+def apply_firewall_configuration():
+    """
+    Export the firewall script and apply the current firewall configuration to the running system.
 
-    export_firewall_configuration()
-    export_dns_configuration()
-    
-    firewall_inserted = False
-    for instance in instances:
-        if instance.legacy_firewall:
-            post_up_processed = clean_command_field(instance.post_up) if instance.post_up else ""
-            post_down_processed = clean_command_field(instance.post_down) if instance.post_down else ""
-            
+    With the iptables backend only the rules that differ from the live chains are changed. The full
+    script is used for nftables, or when the differential apply is not possible (first run, missing
+    chains or tools). The settings are loaded and the rules compiled once for both.
+    """
+    firewall_settings, firewall_settings_created = FirewallSettings.objects.get_or_create(name='global')
+    if firewall_settings.firewall_backend == 'iptables':
+        user_rules = get_firewall_rules()
+        firewall_rules = compile_firewall_rules(user_rules, firewall_settings)
+        firewall_ipsets = export_firewall_ipsets(user_rules)
+        export_firewall_configuration(firewall_settings, firewall_rules, firewall_ipsets)
+        if apply_firewall_diff(firewall_rules, firewall_ipsets, firewall_settings):
+            return True
+    else:
+        export_firewall_configuration(firewall_settings)
+    result = subprocess.run(['bash', '/etc/wireguard/wg-firewall.sh'], capture_output=True, text=True)
+    if result.returncode != 0:
+        logger.error(f"Error applying firewall script: {result.stderr}")
+        return False
+    logger.debug(f"Firewall script output: {result.stdout}")
+    return True
+
+
+def get_firewall_instance_id():
+    """
+    Return the instance_id of the interface whose PostUp runs wg-firewall.sh, the lowest instance that does
+    not use the legacy firewall, or None.
+    """
+    return WireGuardInstance.objects.filter(legacy_firewall=False).order_by('instance_id').values_list(
+        'instance_id', flat=True
+    ).first()
+
+
+def generate_wireguard_config(instance, include_firewall_script=False, include_peers=True):
+    """
+    Render the /etc/wireguard configuration of an instance. The bandwidth scripts referenced by
+    PostUp/PostDown are written as a side effect. Without include_peers only the [Interface] section is
+    rendered, which also works for an unsaved instance (pooled slots).
+    """
+    if instance.legacy_firewall:
+        post_up_processed = clean_command_field(instance.post_up) if instance.post_up else ""
+        post_down_processed = clean_command_field(instance.post_down) if instance.post_down else ""
+        
+        if post_up_processed:
+            post_up_processed += '; '
+        if post_down_processed:
+            post_down_processed += '; '
+
+        for redirect_rule in RedirectRule.objects.filter(wireguard_instance=instance):
+            rule_text_up = ""
+            rule_text_down = ""
+            rule_destination = redirect_rule.ip_address
+            if redirect_rule.peer:
+                peer_allowed_ip_address = PeerAllowedIP.objects.filter(config_file='server', peer=redirect_rule.peer, netmask=32, priority=0).first()
+                if peer_allowed_ip_address:
+                    rule_destination = peer_allowed_ip_address.allowed_ip
+            if rule_destination:
+                rule_text_up   = f"iptables -t nat -A PREROUTING -p {redirect_rule.protocol} -d wireguard-webadmin --dport {redirect_rule.port} -j DNAT --to-dest {rule_destination}:{redirect_rule.port} ; "
+                rule_text_down = f"iptables -t nat -D PREROUTING -p {redirect_rule.protocol} -d wireguard-webadmin --dport {redirect_rule.port} -j DNAT --to-dest {rule_destination}:{redirect_rule.port} ; "
+                if redirect_rule.add_forward_rule:
+                    rule_text_up   += f"iptables -A FORWARD -d {rule_destination} -p {redirect_rule.protocol} --dport {redirect_rule.port} -j ACCEPT ; "
+                    rule_text_down += f"iptables -D FORWARD -d {rule_destination} -p {redirect_rule.protocol} --dport {redirect_rule.port} -j ACCEPT ; "
+                if redirect_rule.masquerade_source:
+                    rule_text_up   += f"iptables -t nat -A POSTROUTING -d {rule_destination} -p {redirect_rule.protocol} --dport {redirect_rule.port} -j MASQUERADE ; "
+                    rule_text_down += f"iptables -t nat -D POSTROUTING -d {rule_destination} -p {redirect_rule.protocol} --dport {redirect_rule.port} -j MASQUERADE ; "
+                post_up_processed += rule_text_up
+                post_down_processed += rule_text_down
+        
+        # Add bandwidth limiting if enabled (for legacy firewall case)
+        if instance.bandwidth_limit_enabled:
+            bandwidth_script_path, bandwidth_cleanup_script_path = export_bandwidth_scripts(instance)
+
+            # Add bandwidth limiting to PostUp and PostDown
             if post_up_processed:
-                post_up_processed += '; '
-            if post_down_processed:
-                post_down_processed += '; '
-
-            for redirect_rule in RedirectRule.objects.filter(wireguard_instance=instance):
-                rule_text_up = ""
-                rule_text_down = ""
-                rule_destination = redirect_rule.ip_address
-                if redirect_rule.peer:
-                    peer_allowed_ip_address = PeerAllowedIP.objects.filter(config_file='server', peer=redirect_rule.peer, netmask=32, priority=0).first()
-                    if peer_allowed_ip_address:
-                        rule_destination = peer_allowed_ip_address.allowed_ip
-                if rule_destination:
-                    rule_text_up   = f"iptables -t nat -A PREROUTING -p {redirect_rule.protocol} -d wireguard-webadmin --dport {redirect_rule.port} -j DNAT --to-dest {rule_destination}:{redirect_rule.port} ; "
-                    rule_text_down = f"iptables -t nat -D PREROUTING -p {redirect_rule.protocol} -d wireguard-webadmin --dport {redirect_rule.port} -j DNAT --to-dest {rule_destination}:{redirect_rule.port} ; "
-                    if redirect_rule.add_forward_rule:
-                        rule_text_up   += f"iptables -A FORWARD -d {rule_destination} -p {redirect_rule.protocol} --dport {redirect_rule.port} -j ACCEPT ; "
-                        rule_text_down += f"iptables -D FORWARD -d {rule_destination} -p {redirect_rule.protocol} --dport {redirect_rule.port} -j ACCEPT ; "
-                    if redirect_rule.masquerade_source:
-                        rule_text_up   += f"iptables -t nat -A POSTROUTING -d {rule_destination} -p {redirect_rule.protocol} --dport {redirect_rule.port} -j MASQUERADE ; "
-                        rule_text_down += f"iptables -t nat -D POSTROUTING -d {rule_destination} -p {redirect_rule.protocol} --dport {redirect_rule.port} -j MASQUERADE ; "
-                    post_up_processed += rule_text_up
-                    post_down_processed += rule_text_down
-            
-            # Add bandwidth limiting if enabled (for legacy firewall case)
-            if instance.bandwidth_limit_enabled:
-                bandwidth_script_path = f'/etc/wireguard/wg{instance.instance_id}_bandwidth.sh'
-                bandwidth_cleanup_script_path = f'/etc/wireguard/wg{instance.instance_id}_bandwidth_cleanup.sh'
-                
-                # Generate bandwidth limiting script
-                bandwidth_script_content = generate_bandwidth_limiting_script(
-                    instance.instance_id, 
-                    instance.bandwidth_limit_mbps
-                )
-                
-                # Generate bandwidth cleanup script
-                bandwidth_cleanup_script_content = generate_bandwidth_cleanup_script(
-                    instance.instance_id
-                )
-                
-                # Write bandwidth scripts to files
-                with open(bandwidth_script_path, 'w') as f:
-                    f.write(bandwidth_script_content)
-                os.chmod(bandwidth_script_path, 0o755)
-                
-                with open(bandwidth_cleanup_script_path, 'w') as f:
-                    f.write(bandwidth_cleanup_script_content)
-                os.chmod(bandwidth_cleanup_script_path, 0o755)
-                
-                # Add bandwidth limiting to PostUp and PostDown
-                if post_up_processed:
-                    post_up_processed += f' ; {bandwidth_script_path}'
-                else:
-                    post_up_processed = bandwidth_script_path
-                    
-                if post_down_processed:
-                    post_down_processed += f' ; {bandwidth_cleanup_script_path}'
-                else:
-                    post_down_processed = bandwidth_cleanup_script_path
-        else:
-            post_down_processed = ''
-            
-            if not firewall_inserted:
-                post_up_processed = '/etc/wireguard/wg-firewall.sh'
-                firewall_inserted = True
+                post_up_processed += f' ; {bandwidth_script_path}'
             else:
-                post_up_processed = ''
-            
-            # Add bandwidth limiting if enabled
-            if instance.bandwidth_limit_enabled:
-                bandwidth_script_path = f'/etc/wireguard/wg{instance.instance_id}_bandwidth.sh'
-                bandwidth_cleanup_script_path = f'/etc/wireguard/wg{instance.instance_id}_bandwidth_cleanup.sh'
-                
-                # Generate bandwidth limiting script
-                bandwidth_script_content = generate_bandwidth_limiting_script(
-                    instance.instance_id, 
-                    instance.bandwidth_limit_mbps
-                )
+                post_up_processed = bandwidth_script_path
                 
-                # Generate bandwidth cleanup script
-                bandwidth_cleanup_script_content = generate_bandwidth_cleanup_script(
-                    instance.instance_id
-                )
-                
-                # Write bandwidth scripts to files
-                with open(bandwidth_script_path, 'w') as f:
-                    f.write(bandwidth_script_content)
-                os.chmod(bandwidth_script_path, 0o755)
-                
-                with open(bandwidth_cleanup_script_path, 'w') as f:
-                    f.write(bandwidth_cleanup_script_content)
-                os.chmod(bandwidth_cleanup_script_path, 0o755)
+            if post_down_processed:
+                post_down_processed += f' ; {bandwidth_cleanup_script_path}'
+            else:
+                post_down_processed = bandwidth_cleanup_script_path
+    else:
+        post_down_processed = ''
+        post_up_processed = '/etc/wireguard/wg-firewall.sh' if include_firewall_script else ''
+
+        # Add bandwidth limiting if enabled
+        if instance.bandwidth_limit_enabled:
+            bandwidth_script_path, bandwidth_cleanup_script_path = export_bandwidth_scripts(instance)
+
+            # Add bandwidth limiting to PostUp and PostDown
+            if post_up_processed:
+                post_up_processed += f' ; {bandwidth_script_path}'
+            else:
+                post_up_processed = bandwidth_script_path
                 
-                # Add bandwidth limiting to PostUp and PostDown
-                if post_up_processed:
-                    post_up_processed += f' ; {bandwidth_script_path}'
-                else:
-                    post_up_processed = bandwidth_script_path
-                    
-                if post_down_processed:
-                    post_down_processed += f' ; {bandwidth_cleanup_script_path}'
-                else:
-                    post_down_processed = bandwidth_cleanup_script_path
-            
+            if post_down_processed:
+                post_down_processed += f' ; {bandwidth_cleanup_script_path}'
+            else:
+                post_down_processed = bandwidth_cleanup_script_path
 
-        config_lines = [
-            "[Interface]",
-            f"PrivateKey = {instance.private_key}",
-            f"Address = {instance.address}/{instance.netmask}",
-            f"ListenPort = {instance.listen_port}",
-            f"PostUp = {post_up_processed}",
-            f"PostDown = {post_down_processed}",
+    config_lines = [
+        "[Interface]",
+        f"PrivateKey = {instance.private_key}",
+        f"Address = {instance.address}/{instance.netmask}",
+        f"ListenPort = {instance.listen_port}",
+        f"PostUp = {post_up_processed}",
+        f"PostDown = {post_down_processed}",
+    ]
+    if not include_peers:
+        return "\n".join(config_lines)
+
+    peers = Peer.objects.filter(wireguard_instance=instance).prefetch_related(
+        Prefetch('peerallowedip_set', queryset=PeerAllowedIP.objects.filter(config_file='server').order_by('priority'))
+    )
+    for peer in peers:
+        peer_lines = [
+            "[Peer]",
+            f"PublicKey = {peer.public_key}",
+            f"PresharedKey = {peer.pre_shared_key}" if peer.pre_shared_key else "",
+            f"PersistentKeepalive = {peer.persistent_keepalive}",
         ]
+        allowed_ips = peer.peerallowedip_set.all()
+        allowed_ips_line = "AllowedIPs = " + ", ".join([f"{ip.allowed_ip}/{ip.netmask}" for ip in allowed_ips])
+        peer_lines.append(allowed_ips_line)
+        config_lines.extend(peer_lines)
+        config_lines.append("")
+
+    return "\n".join(config_lines)
+
+
+def write_wireguard_config(instance, include_firewall_script=None, ready_config=None):
+    """
+    Write the configuration file of one instance and return its path. When include_firewall_script is
+    None, it is looked up with get_firewall_instance_id(). A ready_config rendered in advance (pooled
+    slot) is written as is, unless the instance also has to run the firewall script.
+    """
+    if include_firewall_script is None:
+        include_firewall_script = instance.instance_id == get_firewall_instance_id()
+    base_dir = "/etc/wireguard"
+    config_path = os.path.join(base_dir, f"wg{instance.instance_id}.conf")
+    os.makedirs(base_dir, exist_ok=True)
+    # Cleared before rendering, a peer applied live meanwhile flags the file again
+    WireGuardInstance.objects.filter(pk=instance.pk, config_outdated=True).update(config_outdated=False)
+    if ready_config and not include_firewall_script:
+        config_content = ready_config
+    else:
+        config_content = generate_wireguard_config(instance, include_firewall_script)
+
+    with open(config_path, "w") as config_file:
+        config_file.write(config_content)
+    return config_path
+
+
+def write_outdated_wireguard_configs():
+    """
+    Rewrite the configuration files of the interfaces running on this node whose peers were changed live
+    (see wireguard_tools.live_apply). Returns the number of files written.
+    """
+    outdated_instances = list(WireGuardInstance.objects.filter(config_outdated=True).order_by('instance_id'))
+    if not outdated_instances:
+        return 0
+    try:
+        result = subprocess.run(['wg', 'show', 'interfaces'], capture_output=True, text=True)
+    except FileNotFoundError:
+        return 0
+    # Another node owns the interfaces it runs, and rewrites their files
+    running_interfaces = set(result.stdout.split())
+    firewall_instance_id = get_firewall_instance_id()
+    written = 0
+    for instance in outdated_instances:
+        if f"wg{instance.instance_id}" in running_interfaces:
+            write_wireguard_config(instance, instance.instance_id == firewall_instance_id)
+            written += 1
+    return written
+
+
+def reload_wireguard_instance(instance, pooled_instance=None):
+    """
+    Apply the configuration of a single instance to the running system.
+
+    Only this interface is rendered, written and reloaded: a running interface is updated with
+    'wg syncconf' and its bandwidth limits are synced, a stopped one is started. The firewall is applied
+    differentially, so only rules that changed are touched. DNS is not regenerated, the hosts file is
+    already kept current by the peer signals. Other interfaces keep their pending changes.
+
+    An instance claimed from the pool is passed with its pooled slot: the ready configuration is written
+    as is and the firewall only gets the slot's set members, the rules already include the slot.
+
+    Returns:
+        tuple: (success: bool, message: str)
+    """
+    from wgwadmlibrary.tools import update_pending_changes_flag
+
+    interface_name = f"wg{instance.instance_id}"
+    try:
+        config_path = write_wireguard_config(instance, ready_config=pooled_instance.config if pooled_instance else None)
+        check_running = subprocess.run(['wg', 'show', interface_name], capture_output=True, text=True)
+        if check_running.returncode == 0:
+            result = syncconf_interface(interface_name, config_path)
+        else:
+            logger.info(f"Interface {interface_name} is not running, starting it instead of reloading")
+            result = subprocess.run(['wg-quick', 'up', interface_name], capture_output=True, text=True)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.error(f"Error reloading {interface_name}: {e}")
+        return False, f"Error reloading {interface_name}: {e}"
+    if result.returncode != 0:
+        logger.error(f"Error reloading {interface_name}: {result.stderr}")
+        return False, f"Error reloading {interface_name}: {result.stderr}"
+
+    errors = []
+    # syncconf does not run PostUp, so apply bandwidth limit changes live
+    if check_running.returncode == 0 and not sync_instance_bandwidth(instance):
+        errors.append('bandwidth limits')
+
+    try:
+        firewall_ready = pooled_instance is not None and add_firewall_ipset_members(pooled_instance.firewall_ipsets)
+        if not firewall_ready and not apply_firewall_configuration():
+            errors.append('firewall')
+    except Exception as e:
+        logger.error(f"Error applying firewall for {interface_name}: {e}")
+        errors.append('firewall')
+
+    WireGuardInstance.objects.filter(pk=instance.pk).update(pending_changes=False)
+    update_pending_changes_flag()
+
+    if errors:
+        return False, f"Interface {interface_name} reloaded, failed to update: {', '.join(errors)}"
+    logger.info(f"Successfully reloaded {interface_name}")
+    return True, f"Interface {interface_name} reloaded"
 
-        peers = Peer.objects.filter(wireguard_instance=instance)
-        for peer in peers:
-            peer_lines = [
-                "[Peer]",
-                f"PublicKey = {peer.public_key}",
-                f"PresharedKey = {peer.pre_shared_key}" if peer.pre_shared_key else "",
-                f"PersistentKeepalive = {peer.persistent_keepalive}",
-            ]
-            allowed_ips = PeerAllowedIP.objects.filter(config_file='server', peer=peer).order_by('priority')
-            allowed_ips_line = "AllowedIPs = " + ", ".join([f"{ip.allowed_ip}/{ip.netmask}" for ip in allowed_ips])
-            peer_lines.append(allowed_ips_line)
-            config_lines.extend(peer_lines)
-            config_lines.append("")
-
-        config_content = "\n".join(config_lines)
-        config_path = os.path.join(base_dir, f"wg{instance.instance_id}.conf")
-
-        os.makedirs(base_dir, exist_ok=True)
-
-        with open(config_path, "w") as config_file:
-            config_file.write(config_content)
+
+@login_required
+def export_wireguard_configs(request):
+    if not UserAcl.objects.filter(user=request.user).filter(user_level__gte=30).exists():
+        return render(request, 'access_denied.html', {'page_title': 'Access Denied'})
+
+    export_firewall_configuration()
+    export_dns_configuration()
+
+    firewall_instance_id = get_firewall_instance_id()
+    for instance in WireGuardInstance.objects.order_by('instance_id'):
+        write_wireguard_config(instance, instance.instance_id == firewall_instance_id)
     if request.GET.get('action') == 'update_and_restart' or request.GET.get('action') == 'update_and_reload':
         messages.success(request, _("Export successful!|WireGuard configuration files have been exported to /etc/wireguard/."))
     else:
@@ -558,7 +781,7 @@ def download_config_or_qrcode(request):
         if not UserAcl.objects.filter(user=request.user).filter(user_level__gte=20).exists():
             return render(request, 'access_denied.html', {'page_title': 'Access Denied'})
         peer = get_object_or_404(Peer, uuid=request.GET.get('uuid'))
-        user_acl = get_object_or_404(UserAcl, user=request.user)
+        user_acl = get_request_user_acl(request)
 
         if not user_has_access_to_peer(user_acl, peer):
             raise Http404
@@ -600,6 +823,9 @@ def restart_wireguard_interfaces(request):
     config_dir = "/etc/wireguard"
     interface_count = 0
     error_count = 0
+
+    # wg-quick reads the files, bring in peers that were only applied live
+    write_outdated_wireguard_configs()
     
     # First, ensure all instances in the database have config files
     # This is critical in a multi-node setup where instances may be created on other nodes
@@ -661,22 +887,7 @@ def restart_wireguard_interfaces(request):
                         logger.info(f"Successfully started {interface_name}")
                 else:
                     # Interface is running, reload it
-                    with open(config_path, 'r') as f:
-                        lines = f.readlines()
-                    filtered_lines = []
-                    for line in lines:
-                        stripped_line = line.strip()
-                        if stripped_line.startswith("Address") or stripped_line.startswith("PostUp") or stripped_line.startswith("PostDown"):
-                            continue
-                        filtered_lines.append(line)
-
-                    temp_config_path = f"/tmp/wgreload_{interface_name}.conf"
-                    with open(temp_config_path, 'w') as f:
-                        f.writelines(filtered_lines)
-
-                    reload_command = f"wg syncconf {interface_name} {temp_config_path}"
-                    result = subprocess.run(reload_command, shell=True, capture_output=True, text=True)
-                    os.remove(temp_config_path)
+                    result = syncconf_interface(interface_name, config_path)
 
                     if result.returncode != 0:
                         error_msg = f"Failed to reload: {result.stderr}"
@@ -687,6 +898,13 @@ def restart_wireguard_interfaces(request):
                         interface_count += 1
                         logger.info(f"Successfully reloaded {interface_name}")
 
+                        # syncconf does not run PostUp, so apply bandwidth limit changes live
+                        reloaded_instance = None
+                        if interface_name.startswith('wg') and interface_name[2:].isdigit():
+                            reloaded_instance = WireGuardInstance.objects.filter(instance_id=int(interface_name[2:])).first()
+                        if reloaded_instance and not sync_instance_bandwidth(reloaded_instance):
+                            messages.warning(request, _('Error updating bandwidth limits') + f" {interface_name}|" + _('Restart the interface to apply the new limits.'))
+
             else:
                 if not user_acl.enable_restart:
                     return render(request, 'access_denied.html', {'page_title': 'Access Denied'})
@@ -721,6 +939,11 @@ def restart_wireguard_interfaces(request):
                     interface_count += 1
                     logger.info(f"Successfully started {interface_name}")
 
+    # syncconf does not run PostUp, so apply firewall changes to the live chains
+    if mode == 'reload' and interface_count > 0 and not apply_firewall_configuration():
+        messages.warning(request, _('Error updating firewall rules') + '|' + _('Restart the interfaces to apply the firewall rules.'))
+        error_count += 1
+
     if interface_count > 0 and error_count == 0:
         if mode == 'reload':
             messages.warning(request, _("WARNING|Please note that the interface was reloaded, not restarted. Double-check if the the peers are working as expected. If you find any issues, please report them."))
@@ -737,4 +960,24 @@ def restart_wireguard_interfaces(request):
         for wireguard_instancee in WireGuardInstance.objects.filter(pending_changes=True):
             wireguard_instancee.pending_changes = False
             wireguard_instancee.save()
-    return redirect("/status/")
\ No newline at end of file
+    return redirect("/status/")
+
+
+@login_required
+def reload_wireguard_instance_view(request):
+    user_acl = get_request_user_acl(request)
+    if user_acl.user_level < 30 or not user_acl.enable_reload:
+        return render(request, 'access_denied.html', {'page_title': 'Access Denied'})
+    instance = get_object_or_404(WireGuardInstance, uuid=request.GET.get('uuid'))
+    if not user_has_access_to_instance(user_acl, instance):
+        raise Http404
+
+    success, message = reload_wireguard_instance(instance)
+    if success:
+        messages.success(request, _("WireGuard reloaded|") + message)
+    else:
+        messages.error(request, _("Error reloading|") + message)
+
+    if request.GET.get('peer'):
+        return redirect('/peer/manage/?peer=' + request.GET.get('peer'))
+    return redirect('/peer/list/?uuid=' + str(instance.uuid))
@@ -79,6 +79,8 @@ INSTALLED_APPS = [
 PARENT_JWKS_URL = os.getenv('PARENT_JWKS_URL', "https://portbro.com/o/jwks/")
 PARENT_ISSUER = os.getenv('PARENT_ISSUER', "portbro.com")
 PARENT_AUDIENCE = os.getenv('PARENT_AUDIENCE', "vpn-nodes")
+# Seconds between background JWKS refreshes (a token with an unknown kid also triggers one)
+JWT_JWKS_TTL = int(os.getenv('JWT_JWKS_TTL', '3600'))
 
 # Portbro OAuth2 Configuration
 # These should be set via environment variables in production
@@ -156,7 +158,49 @@ DATABASES = {
         'PORT': os.getenv('DB_PORT', '25060'),
         'OPTIONS': {
             'sslmode': 'require',
+            'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '10')),
         },
+        # Seconds a connection is kept open between requests. Every gunicorn thread keeps its own, up to
+        # WEB_WORKERS x WEB_THREADS connections per node, and every node shares the database, so this is
+        # opt-in (see env.example). Broken connections are detected before reuse by CONN_HEALTH_CHECKS.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '0')),
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# Optional psycopg 3 connection pool. requirements.txt ships psycopg2, which has no pool support, so
+# DB_POOL needs 'pip install "psycopg[binary,pool]"'. Django uses psycopg 3 whenever it is installed.
+# Pooled connections replace persistent ones, so CONN_MAX_AGE must be 0 when the pool is enabled.
+if os.getenv('DB_POOL', 'false').lower() == 'true':
+    try:
+        import psycopg  # noqa: F401
+        import psycopg_pool  # noqa: F401
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+            # Per worker process, a node opens up to WEB_WORKERS x DB_POOL_MAX_SIZE connections
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '4')),
+            'timeout': int(os.getenv('DB_POOL_TIMEOUT', '10')),
+        }
+    except ImportError:
+        # psycopg 3 or psycopg_pool not installed, the backend runs on psycopg2: keep persistent connections
+        import warnings
+        warnings.warn(
+            "DB_POOL is ignored: the connection pool needs psycopg 3 with the pool extra "
+            "(pip install \"psycopg[binary,pool]\")",
+            UserWarning
+        )
+
+# PgBouncer in transaction pooling mode cannot keep server-side cursors between transactions
+if os.getenv('DB_PGBOUNCER', 'false').lower() == 'true':
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+# Cache shared by the gunicorn workers of this container. The in-memory default is per process,
+# values maintained on write (pending changes flag, ACL index) must be visible to every worker.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', '/tmp/wireguard_webadmin_cache'),
     }
 }
 
@@ -225,6 +269,13 @@ WIREGUARD_WEBADMIN_VERSION = 9971
 # Should be set via environment variable in production
 N8N_API_KEY = os.getenv('N8N_API_KEY', 'test-api-key-123')
 
+# Instances kept keyed and reserved per node for new customer orders, refilled by process_provisioning_jobs
+INSTANCE_POOL_SIZE = int(os.getenv('INSTANCE_POOL_SIZE', '0'))
+
+# Seconds between the drift checks run by process_provisioning_jobs (0 disables them), DRIFT_SELF_HEAL also fixes the drift
+DRIFT_CHECK_INTERVAL = int(os.getenv('DRIFT_CHECK_INTERVAL', '300'))
+DRIFT_SELF_HEAL = os.getenv('DRIFT_SELF_HEAL', 'false').lower() == 'true'
+
 # JWT RSA Keys - can be provided as file path or direct key content
 # If JWT_RSA_PUBLIC_KEY_FILE is set, it takes precedence over JWT_RSA_PUBLIC_KEY
 JWT_RSA_PUBLIC_KEY_FILE = os.getenv('JWT_RSA_PUBLIC_KEY_FILE', None)
@@ -23,13 +23,13 @@ from accounts.views import view_create_first_user, view_login, view_logout
 from auth_integration.views import jwt_token_async_view
 from api.views import api_instance_info, api_peer_invite, api_peer_list, cron_check_updates, \
     cron_update_peer_latest_handshake, disconnect_instance, peer_info, peers_hosts, peers_hosts_legacy, remove_instance, routerfleet_authenticate_session, routerfleet_get_user_token, \
-    wireguard_status, webhook_create_instance
+    wireguard_status, wireguard_status_stream, webhook_create_instance
 from console.views import view_console
 from dns.views import view_apply_dns_config, view_manage_dns_settings, view_manage_filter_list, view_manage_static_host, \
     view_peer_hostnames, view_static_host_list, view_toggle_dns_list, view_update_dns_list
-from firewall.views import manage_firewall_rule, manage_redirect_rule, view_firewall_migration_required, \
-    view_firewall_rule_list, view_generate_iptables_script, view_manage_firewall_settings, view_redirect_rule_list, \
-    view_reset_firewall
+from firewall.views import manage_firewall_rule, manage_redirect_rule, view_firewall_benchmark, \
+    view_firewall_migration_required, view_firewall_rule_list, view_generate_iptables_script, view_manage_firewall_settings, \
+    view_redirect_rule_list, view_reset_firewall
 from intl_tools.views import view_change_language
 from user_manager.views import view_manage_user, view_peer_group_list, view_peer_group_manage, view_user_list
 from vpn_invite.views import view_email_settings, view_vpn_invite_list, view_vpn_invite_settings
@@ -38,7 +38,8 @@ from wgrrd.views import view_rrd_graph
 from wireguard.views import view_apply_db_patches, view_wireguard_manage_instance, view_wireguard_status
 from wireguard_peer.views import view_manage_ip_address, view_wireguard_peer_list, view_wireguard_peer_manage, \
     view_wireguard_peer_sort
-from wireguard_tools.views import download_config_or_qrcode, download_remote_access_file, export_wireguard_configs, restart_wireguard_interfaces
+from wireguard_tools.views import download_config_or_qrcode, download_remote_access_file, export_wireguard_configs, \
+    reload_wireguard_instance_view, restart_wireguard_interfaces
 
 urlpatterns = [
     path('admin_panel/', admin.site.urls),
@@ -69,6 +70,7 @@ urlpatterns = [
     path('tools/download_peer_config/', download_config_or_qrcode, name='download_config_or_qrcode'),
     path('tools/download_remote_access/', download_remote_access_file, name='download_remote_access_file'),
     path('tools/restart_wireguard/', restart_wireguard_interfaces, name='restart_wireguard_interfaces'),
+    path('tools/reload_instance/', reload_wireguard_instance_view, name='reload_wireguard_instance'),
     path('server/manage/', view_wireguard_manage_instance, name='wireguard_manage_instance'),
     path('accounts/create_first_user/', view_create_first_user, name='create_first_user'),
     path('accounts/login/', view_login, name='login'),    
@@ -79,6 +81,7 @@ urlpatterns = [
     path('accounts/routerfleet_authenticate_session/', routerfleet_authenticate_session, name='routerfleet_authenticate_session'),
     path('api/routerfleet_get_user_token/', routerfleet_get_user_token, name='routerfleet_get_user_token'),
     path('api/wireguard_status/', wireguard_status, name='api_wireguard_status'),
+    path('api/wireguard_status/stream/', wireguard_status_stream, name='api_wireguard_status_stream'),
     path('api/peer_list/', api_peer_list, name='api_peer_list'),
     path('api/instance_info/', api_instance_info, name='api_instance_info'),
     path('api/peer_info/', peer_info, name='api_peer_info'),
@@ -95,6 +98,7 @@ urlpatterns = [
     path('firewall/generate_firewall_script/', view_generate_iptables_script, name='generate_iptables_script'),
     path('firewall/reset_to_default/', view_reset_firewall, name='reset_firewall'),
     path('firewall/migration_required/', view_firewall_migration_required, name='firewall_migration_required'),
+    path('firewall/benchmark/', view_firewall_benchmark, name='firewall_benchmark'),
     path('vpn_invite/', view_vpn_invite_list, name='vpn_invite_list'),
     path('vpn_invite/settings/', view_vpn_invite_settings, name='vpn_invite_settings'),
     path('vpn_invite/smtp_settings/', view_email_settings, name='email_settings'),